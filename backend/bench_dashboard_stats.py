@@ -0,0 +1,180 @@
+"""
+Benchmark do /dashboard/stats - Fotiva
+Compara o cálculo antigo (carrega todos os eventos no Python) com o $group
+e com a leitura de user_stats, para um usuário com 10k e 100k eventos.
+
+    python bench_dashboard_stats.py --events 10000 100000 --runs 5
+
+Usa um banco separado (<DB_NAME>_bench) que é apagado no final.
+"""
+
+import os
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import statistics
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, List
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING
+
+load_dotenv(Path(__file__).parent / '.env')
+
+INSERT_BATCH_SIZE = 5000
+
+
+async def seed(db, user_id: str, events: int):
+    await db.events.delete_many({})
+    await db.clients.delete_many({})
+    await db.user_stats.delete_many({})
+
+    # Mesmos índices do REQUIRED_INDEXES do server.py
+    await db.events.create_index(
+        [("user_id", ASCENDING), ("event_date", ASCENDING), ("id", ASCENDING)],
+        name="events_user_event_date"
+    )
+    await db.clients.create_index(
+        [("user_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)],
+        name="clients_user_created_at"
+    )
+
+    clients = [
+        {"id": str(uuid.uuid4()), "user_id": user_id, "name": f"Cliente {i}", "created_at": datetime.now(timezone.utc)}
+        for i in range(max(1, events // 10))
+    ]
+    await db.clients.insert_many(clients)
+
+    start = datetime.now() - timedelta(days=365)
+    batch: List[Dict[str, Any]] = []
+    total_value = total_paid = 0.0
+
+    for i in range(events):
+        value = float(random.randint(500, 5000))
+        paid = float(random.choice([0, value / 2, value]))
+        total_value += value
+        total_paid += paid
+
+        batch.append({
+            "id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "client_id": random.choice(clients)["id"],
+            "event_type": "casamento",
+            "event_date": (start + timedelta(hours=i % (24 * 730))).strftime("%Y-%m-%dT%H:%M:%S"),
+            "status": random.choice(["confirmado", "pendente", "concluido"]),
+            "total_value": value,
+            "amount_paid": paid,
+            "created_at": datetime.now(timezone.utc)
+        })
+
+        if len(batch) >= INSERT_BATCH_SIZE:
+            await db.events.insert_many(batch)
+            batch = []
+
+    if batch:
+        await db.events.insert_many(batch)
+
+    await db.user_stats.insert_one({
+        "user_id": user_id,
+        "total_clients": len(clients),
+        "total_events": events,
+        "total_revenue": total_paid,
+        "total_value": total_value
+    })
+
+
+async def upcoming_events(db, user_id: str):
+    now_str = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+    return await db.events.find(
+        {"user_id": user_id, "event_date": {"$gte": now_str}, "status": {"$in": ["confirmado", "pendente"]}},
+        {"_id": 0}
+    ).sort("event_date", ASCENDING).limit(5).to_list(5)
+
+
+async def stats_load_all(db, user_id: str):
+    """Versão original: tudo para o Python (sem o limite de 1000, que dava números errados)"""
+
+    clients = await db.clients.find({"user_id": user_id}, {"_id": 0}).to_list(None)
+    events = await db.events.find({"user_id": user_id}, {"_id": 0}).to_list(None)
+
+    total_revenue = sum(e.get('amount_paid', 0) for e in events)
+    pending = sum(e.get('total_value', 0) - e.get('amount_paid', 0) for e in events)
+    upcoming = sorted(
+        [e for e in events if e['status'] in ['confirmado', 'pendente']],
+        key=lambda x: x['event_date']
+    )[:5]
+
+    return len(clients), len(events), total_revenue, pending, upcoming
+
+
+async def stats_aggregate(db, user_id: str):
+    """user-005: count_documents + $group"""
+
+    total_clients = await db.clients.count_documents({"user_id": user_id})
+    totals = await db.events.aggregate([
+        {"$match": {"user_id": user_id}},
+        {"$group": {
+            "_id": None,
+            "total_events": {"$sum": 1},
+            "total_revenue": {"$sum": {"$ifNull": ["$amount_paid", 0]}},
+            "total_value": {"$sum": {"$ifNull": ["$total_value", 0]}}
+        }}
+    ]).to_list(1)
+
+    return total_clients, totals, await upcoming_events(db, user_id)
+
+
+async def stats_materialized(db, user_id: str):
+    """Versão atual: contadores de user_stats"""
+
+    stats = await db.user_stats.find_one({"user_id": user_id}, {"_id": 0})
+    return stats, await upcoming_events(db, user_id)
+
+
+async def measure(func, db, user_id: str, runs: int) -> Dict[str, float]:
+    await func(db, user_id)  # aquecimento
+
+    durations = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        await func(db, user_id)
+        durations.append((time.perf_counter() - started) * 1000)
+
+    return {"median_ms": statistics.median(durations), "max_ms": max(durations)}
+
+
+async def main(event_counts: List[int], runs: int):
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db_name = os.environ.get('DB_NAME', 'fotiva') + "_bench"
+    db = client[db_name]
+    user_id = str(uuid.uuid4())
+
+    try:
+        for events in event_counts:
+            print(f"⏳ Populando {events} eventos...")
+            await seed(db, user_id, events)
+
+            for name, func in (
+                ("carrega tudo (antigo)", stats_load_all),
+                ("$group (user-005)", stats_aggregate),
+                ("user_stats (atual)", stats_materialized),
+            ):
+                result = await measure(func, db, user_id, runs)
+                print(f"📊 {events:>7} eventos | {name:<22} | mediana {result['median_ms']:9.1f} ms | máx {result['max_ms']:9.1f} ms")
+
+            print("")
+    finally:
+        await client.drop_database(db_name)
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark do cálculo do dashboard")
+    parser.add_argument("--events", type=int, nargs="+", default=[10000, 100000], help="Quantidades de eventos")
+    parser.add_argument("--runs", type=int, default=5, help="Medições por cenário")
+    args = parser.parse_args()
+
+    asyncio.run(main(args.events, args.runs))
@@ -0,0 +1,131 @@
+"""
+Benchmark do middleware check_subscription - Fotiva
+Mede o custo por requisição do middleware: loop de startswith + consulta da
+assinatura a cada requisição (como era antes) contra o regex pré-compilado +
+is_subscription_active em cache.
+
+    python bench_subscription_middleware.py --users 1000 --requests 20000
+
+Usa um banco separado (<DB_NAME>_bench) que é apagado no final.
+verify_token fica de fora: o custo é o mesmo nas duas versões.
+"""
+
+import os
+import re
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from pathlib import Path
+from typing import List
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+load_dotenv(Path(__file__).parent / '.env')
+
+from subscription_service import SubscriptionService
+
+# Mesma lista de PUBLIC_ROUTES do subscription_routes.py
+PUBLIC_ROUTES = [
+    "/api/auth/login",
+    "/api/auth/register",
+    "/api/subscription/status",
+    "/api/subscription/create",
+    "/api/payments/webhook"
+]
+
+PUBLIC_ROUTE_PATTERN = re.compile("|".join(re.escape(route) for route in PUBLIC_ROUTES))
+
+PROTECTED_PATHS = [
+    "/api/events",
+    "/api/clients",
+    "/api/dashboard/stats",
+    "/api/events/123/payments",
+]
+
+
+async def middleware_old(path: str, user_id: str) -> bool:
+    """Versão original: startswith por rota + assinatura lida do banco"""
+
+    if any(path.startswith(route) for route in PUBLIC_ROUTES):
+        return True
+
+    SubscriptionService.invalidate_cache(user_id)
+    return await SubscriptionService.is_subscription_active(user_id)
+
+
+async def middleware_new(path: str, user_id: str) -> bool:
+    """Versão atual: regex pré-compilado + veredito em cache"""
+
+    if PUBLIC_ROUTE_PATTERN.match(path):
+        return True
+
+    return await SubscriptionService.is_subscription_active(user_id)
+
+
+def bench_route_match(paths: List[str]):
+    for name, matches in (
+        ("startswith (antigo)", lambda path: any(path.startswith(route) for route in PUBLIC_ROUTES)),
+        ("regex compilado (atual)", lambda path: PUBLIC_ROUTE_PATTERN.match(path) is not None),
+    ):
+        started = time.perf_counter()
+        for path in paths:
+            matches(path)
+        duration = time.perf_counter() - started
+
+        print(f"📊 rota pública? {name:<24} | {duration / len(paths) * 1e6:9.2f} µs/requisição")
+
+
+async def bench_middleware(name: str, func, requests: List[tuple]):
+    started = time.perf_counter()
+    for path, user_id in requests:
+        await func(path, user_id)
+    duration = time.perf_counter() - started
+
+    print(f"📊 middleware {name:<28} | {duration / len(requests) * 1e6:9.1f} µs/requisição | {len(requests) / duration:8.0f} req/s")
+
+
+async def main(users: int, total_requests: int, public_ratio: float):
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db_name = os.environ.get('DB_NAME', 'fotiva') + "_bench"
+    db = client[db_name]
+
+    try:
+        repository = SubscriptionService.configure(db)
+        await repository.ensure_indexes()
+
+        print(f"⏳ Criando {users} assinaturas trial...")
+        user_ids = [str(uuid.uuid4()) for _ in range(users)]
+        await asyncio.gather(*(SubscriptionService.create_trial(user_id) for user_id in user_ids))
+
+        requests = [
+            (
+                random.choice(PUBLIC_ROUTES) if random.random() < public_ratio else random.choice(PROTECTED_PATHS),
+                random.choice(user_ids)
+            )
+            for _ in range(total_requests)
+        ]
+
+        bench_route_match([path for path, _ in requests])
+
+        # Aquecimento do cache para a versão atual
+        for user_id in user_ids:
+            await SubscriptionService.is_subscription_active(user_id)
+
+        await bench_middleware("sem cache (antigo)", middleware_old, requests)
+        await bench_middleware("regex + cache (atual)", middleware_new, requests)
+
+    finally:
+        await client.drop_database(db_name)
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark do middleware de assinatura")
+    parser.add_argument("--users", type=int, default=1000, help="Usuários com assinatura")
+    parser.add_argument("--requests", type=int, default=20000, help="Requisições simuladas")
+    parser.add_argument("--public-ratio", type=float, default=0.1, help="Fração de requisições em rotas públicas")
+    args = parser.parse_args()
+
+    asyncio.run(main(args.users, args.requests, args.public_ratio))
@@ -0,0 +1,64 @@
+"""
+Benchmark dos headers VAPID do push_service - Fotiva
+Mede o custo de CPU por envio: parse da chave + assinatura (como era antes),
+só a assinatura, e os headers em cache de get_vapid_headers.
+
+    python bench_vapid_headers.py --sends 2000
+
+Gera uma chave local; não precisa de endpoints de push reais.
+"""
+
+import time
+import argparse
+from py_vapid import Vapid
+from py_vapid.utils import b64urlencode
+
+import push_service
+
+ENDPOINTS = [
+    "https://fcm.googleapis.com/fcm/send/abc",
+    "https://updates.push.services.mozilla.com/wpush/v2/def",
+    "https://web.push.apple.com/ghi",
+]
+
+
+def generate_private_key() -> str:
+    key = Vapid()
+    key.generate_keys()
+    private_value = key.private_key.private_numbers().private_value
+    return b64urlencode(private_value.to_bytes(32, "big"))
+
+
+def claims_for(endpoint: str) -> dict:
+    audience = "/".join(endpoint.split("/")[:3])
+    return {**push_service.VAPID_CLAIMS, "aud": audience, "exp": int(time.time()) + 12 * 60 * 60}
+
+
+def bench(name: str, sends: int, func):
+    started = time.perf_counter()
+    for i in range(sends):
+        func(ENDPOINTS[i % len(ENDPOINTS)])
+    duration = time.perf_counter() - started
+
+    print(f"📊 {name:<28} | {duration / sends * 1e6:9.1f} µs/envio | {sends / duration:10.0f} envios/s")
+
+
+def main(sends: int):
+    private_key = generate_private_key()
+    parsed_key = Vapid.from_string(private_key=private_key)
+
+    # get_vapid_headers usa a chave global do módulo
+    push_service.vapid_key = parsed_key
+    push_service.vapid_headers_cache.clear()
+
+    bench("parse + assinatura (antigo)", sends, lambda endpoint: Vapid.from_string(private_key=private_key).sign(claims_for(endpoint)))
+    bench("só assinatura", sends, lambda endpoint: parsed_key.sign(claims_for(endpoint)))
+    bench("get_vapid_headers (cache)", sends, push_service.get_vapid_headers)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark da assinatura VAPID")
+    parser.add_argument("--sends", type=int, default=2000, help="Envios simulados por cenário")
+    args = parser.parse_args()
+
+    main(args.sends)
@@ -0,0 +1,90 @@
+"""
+Teste de carga do resgate de cupons - Fotiva
+Dispara reserve_coupon concorrentes contra o MongoDB e confere que o cupom
+não é vendido além de max_uses nem resgatado duas vezes pelo mesmo usuário.
+
+    python coupon_load_test.py --redemptions 200 --max-uses 50
+
+Usa um banco separado (<DB_NAME>_loadtest) que é apagado no final.
+Sai com código 1 se alguma verificação falhar.
+"""
+
+import os
+import sys
+import time
+import uuid
+import asyncio
+import argparse
+from pathlib import Path
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+load_dotenv(Path(__file__).parent / '.env')
+
+from subscription_service import SubscriptionService
+
+
+async def main(redemptions: int, max_uses: int, duplicate_every: int) -> bool:
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], maxPoolSize=redemptions)
+    db_name = os.environ.get('DB_NAME', 'fotiva') + "_loadtest"
+    db = client[db_name]
+
+    try:
+        repository = SubscriptionService.configure(db)
+        await repository.ensure_indexes()
+
+        code = f"CARGA{uuid.uuid4().hex[:6].upper()}"
+        await SubscriptionService.create_coupon(
+            code=code,
+            discount_type="percentage",
+            discount_value=50,
+            created_by="coupon_load_test",
+            max_uses=max_uses
+        )
+
+        # Alguns usuários tentam resgatar duas vezes ao mesmo tempo
+        user_ids = [str(uuid.uuid4()) for _ in range(redemptions)]
+        if duplicate_every:
+            for i in range(duplicate_every, redemptions, duplicate_every):
+                user_ids[i] = user_ids[i - 1]
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(SubscriptionService.reserve_coupon(code, user_id) for user_id in user_ids))
+        duration = time.perf_counter() - started
+
+        accepted = [user_id for user_id, result in zip(user_ids, results) if result["valid"]]
+        coupon = await db.coupons.find_one({"code": code})
+        usages = await db.coupon_usage.count_documents({"coupon_code": code})
+
+        print(
+            f"📊 {redemptions} resgates em {duration:.2f}s | aceitos: {len(accepted)} | "
+            f"current_uses: {coupon['current_uses']} | max_uses: {max_uses} | registros de uso: {usages}"
+        )
+
+        checks = {
+            "current_uses <= max_uses": coupon["current_uses"] <= max_uses,
+            "current_uses == resgates aceitos": coupon["current_uses"] == len(accepted),
+            "registros de uso == resgates aceitos": usages == len(accepted),
+            "nenhum usuário resgatou duas vezes": len(accepted) == len(set(accepted)),
+            "cupom esgotado (havia procura suficiente)": len(accepted) == min(max_uses, len(set(user_ids))),
+        }
+
+        for name, ok in checks.items():
+            print(f"{'✅' if ok else '❌'} {name}")
+
+        return all(checks.values())
+
+    finally:
+        await client.drop_database(db_name)
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Teste de carga do resgate de cupons")
+    parser.add_argument("--redemptions", type=int, default=200, help="Resgates concorrentes")
+    parser.add_argument("--max-uses", type=int, default=50, help="max_uses do cupom de teste")
+    parser.add_argument("--duplicate-every", type=int, default=10, help="A cada N usuários, um repete o anterior (0 = nenhum)")
+    args = parser.parse_args()
+
+    ok = asyncio.run(main(args.redemptions, args.max_uses, args.duplicate_every))
+    sys.exit(0 if ok else 1)
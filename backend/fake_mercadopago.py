@@ -0,0 +1,139 @@
+"""
+Servidor fake do Mercado Pago para testes locais
+
+Implementa o mínimo de /v1/payments e /preapproval usado pelo
+MercadoPagoService, guardando tudo em memória. Para usar:
+
+    python fake_mercadopago.py
+    MERCADOPAGO_API_URL=http://localhost:8090
+"""
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse
+from datetime import datetime, timedelta
+from typing import Any, Dict
+import itertools
+import asyncio
+import uuid
+import os
+
+app = FastAPI()
+
+# Status devolvido para novos pagamentos (approved, pending, rejected)
+FAKE_MP_PAYMENT_STATUS = os.getenv('FAKE_MP_PAYMENT_STATUS', 'approved')
+
+# Latência artificial por requisição, para simular um provedor lento
+FAKE_MP_LATENCY_SECONDS = float(os.getenv('FAKE_MP_LATENCY_SECONDS', 0))
+
+payments: Dict[int, Dict[str, Any]] = {}
+preapprovals: Dict[str, Dict[str, Any]] = {}
+payment_ids = itertools.count(1000000001)
+
+
+@app.middleware("http")
+async def simulate_latency(request: Request, call_next):
+    if FAKE_MP_LATENCY_SECONDS > 0:
+        await asyncio.sleep(FAKE_MP_LATENCY_SECONDS)
+    return await call_next(request)
+
+
+@app.post("/v1/payments")
+async def create_payment(request: Request):
+    data = await request.json()
+    payment_id = next(payment_ids)
+    now = datetime.now().isoformat()
+
+    payment = {
+        "id": payment_id,
+        "status": FAKE_MP_PAYMENT_STATUS,
+        "status_detail": "accredited" if FAKE_MP_PAYMENT_STATUS == "approved" else FAKE_MP_PAYMENT_STATUS,
+        "transaction_amount": data.get("transaction_amount"),
+        "description": data.get("description"),
+        "payment_method_id": data.get("payment_method_id"),
+        "installments": data.get("installments", 1),
+        "external_reference": data.get("external_reference"),
+        "payer": {
+            "id": str(uuid.uuid4().int)[:10],
+            "email": (data.get("payer") or {}).get("email")
+        },
+        "date_created": now,
+        "date_last_updated": now
+    }
+
+    payments[payment_id] = payment
+    return JSONResponse(status_code=201, content=payment)
+
+
+@app.get("/v1/payments/{payment_id}")
+async def get_payment(payment_id: int):
+    payment = payments.get(payment_id)
+
+    if not payment:
+        raise HTTPException(status_code=404, detail="Payment not found")
+
+    return payment
+
+
+@app.put("/v1/payments/{payment_id}")
+async def update_payment(payment_id: int, request: Request):
+    """Permite mudar o status (ex: refunded) para testar webhooks"""
+
+    payment = payments.get(payment_id)
+
+    if not payment:
+        raise HTTPException(status_code=404, detail="Payment not found")
+
+    payment.update(await request.json())
+    payment["date_last_updated"] = datetime.now().isoformat()
+    return payment
+
+
+@app.post("/preapproval")
+async def create_preapproval(request: Request):
+    data = await request.json()
+    preapproval_id = uuid.uuid4().hex
+    now = datetime.now()
+
+    preapproval = {
+        "id": preapproval_id,
+        "status": "authorized",
+        "reason": data.get("reason"),
+        "payer_email": data.get("payer_email"),
+        "external_reference": data.get("external_reference"),
+        "auto_recurring": data.get("auto_recurring"),
+        "back_url": data.get("back_url"),
+        "next_payment_date": (now + timedelta(days=30)).isoformat(),
+        "date_created": now.isoformat(),
+        "last_modified": now.isoformat()
+    }
+
+    preapprovals[preapproval_id] = preapproval
+    return JSONResponse(status_code=201, content=preapproval)
+
+
+@app.get("/preapproval/{preapproval_id}")
+async def get_preapproval(preapproval_id: str):
+    preapproval = preapprovals.get(preapproval_id)
+
+    if not preapproval:
+        raise HTTPException(status_code=404, detail="Preapproval not found")
+
+    return preapproval
+
+
+@app.put("/preapproval/{preapproval_id}")
+async def update_preapproval(preapproval_id: str, request: Request):
+    preapproval = preapprovals.get(preapproval_id)
+
+    if not preapproval:
+        raise HTTPException(status_code=404, detail="Preapproval not found")
+
+    preapproval.update(await request.json())
+    preapproval["last_modified"] = datetime.now().isoformat()
+    return preapproval
+
+
+if __name__ == "__main__":
+    import uvicorn
+    port = int(os.getenv("FAKE_MP_PORT", 8090))
+    uvicorn.run(app, host="0.0.0.0", port=port)
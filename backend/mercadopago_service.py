@@ -1,40 +1,130 @@
-import mercadopago
 import os
+import uuid
+import httpx
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
 
+# API do Mercado Pago (aponte para o fake_mercadopago.py em testes locais)
+MERCADOPAGO_API_URL = os.getenv('MERCADOPAGO_API_URL', 'https://api.mercadopago.com')
+
+# Timeouts por chamada: criar pagamento pode demorar mais que uma consulta
+MERCADOPAGO_TIMEOUT_SECONDS = float(os.getenv('MERCADOPAGO_TIMEOUT_SECONDS', 10))
+MERCADOPAGO_PAYMENT_TIMEOUT_SECONDS = float(os.getenv('MERCADOPAGO_PAYMENT_TIMEOUT_SECONDS', 30))
+MERCADOPAGO_CONNECT_TIMEOUT_SECONDS = float(os.getenv('MERCADOPAGO_CONNECT_TIMEOUT_SECONDS', 5))
+
+# Pool de conexões reaproveitado entre as requisições
+MERCADOPAGO_MAX_CONNECTIONS = int(os.getenv('MERCADOPAGO_MAX_CONNECTIONS', 50))
+MERCADOPAGO_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('MERCADOPAGO_MAX_KEEPALIVE_CONNECTIONS', 10))
+
+
 class MercadoPagoService:
-    """Serviço de integração com Mercado Pago"""
-    
-    def __init__(self):
-        self.access_token = os.getenv('MERCADOPAGO_ACCESS_TOKEN')
-        self.sdk = mercadopago.SDK(self.access_token)
-        
-    def create_subscription(
+    """
+    Serviço de integração com Mercado Pago
+
+    Chama a API REST direto com httpx (assíncrono) em vez do SDK síncrono,
+    que bloqueava o event loop durante a chamada externa. As respostas
+    mantêm o formato do SDK: {"status": <código HTTP>, "response": <json>}.
+    """
+
+    def __init__(
+        self,
+        base_url: str = MERCADOPAGO_API_URL,
+        access_token: Optional[str] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None
+    ):
+        self.access_token = access_token or os.getenv('MERCADOPAGO_ACCESS_TOKEN')
+        self.base_url = base_url.rstrip('/')
+        # Em testes: httpx.ASGITransport(app=fake_mercadopago.app)
+        self.transport = transport
+        self.client: Optional[httpx.AsyncClient] = None
+
+    def get_client(self) -> httpx.AsyncClient:
+        # Criado na primeira chamada, já dentro do event loop
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"Authorization": f"Bearer {self.access_token}"},
+                limits=httpx.Limits(
+                    max_connections=MERCADOPAGO_MAX_CONNECTIONS,
+                    max_keepalive_connections=MERCADOPAGO_MAX_KEEPALIVE_CONNECTIONS,
+                ),
+                timeout=httpx.Timeout(MERCADOPAGO_TIMEOUT_SECONDS, connect=MERCADOPAGO_CONNECT_TIMEOUT_SECONDS),
+                transport=self.transport,
+            )
+        return self.client
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        json: Optional[Dict[str, Any]] = None,
+        timeout: float = MERCADOPAGO_TIMEOUT_SECONDS
+    ) -> Dict[str, Any]:
+        """
+        Faz uma chamada à API do Mercado Pago
+
+        Args:
+            method: Método HTTP
+            path: Caminho (ex: /v1/payments)
+            json: Corpo da requisição
+            timeout: Timeout total da chamada em segundos
+
+        Returns:
+            Dict com status (código HTTP) e response (corpo)
+        """
+
+        headers = {}
+        if method == "POST":
+            # A API pede chave de idempotência em POST (o SDK também gerava uma por chamada)
+            headers["X-Idempotency-Key"] = str(uuid.uuid4())
+
+        response = await self.get_client().request(
+            method,
+            path,
+            json=json,
+            headers=headers,
+            timeout=httpx.Timeout(timeout, connect=MERCADOPAGO_CONNECT_TIMEOUT_SECONDS)
+        )
+
+        try:
+            body = response.json()
+        except ValueError:
+            body = response.text
+
+        return {"status": response.status_code, "response": body}
+
+    async def create_subscription(
         self,
         user_email: str,
         plan_price: float,
         payer_id: str,
         payment_method_id: str,
-        description: str = "Assinatura Fotiva"
+        description: str = "Assinatura Fotiva",
+        external_reference: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         Cria uma assinatura recorrente no Mercado Pago
-        
+
         Args:
             user_email: Email do usuário
             plan_price: Preço do plano (ex: 19.90)
             payer_id: ID do pagador no Mercado Pago
             payment_method_id: ID do método de pagamento
             description: Descrição da assinatura
-            
+            external_reference: Referência nossa (ID do usuário)
+
         Returns:
             Dict com dados da assinatura criada
         """
-        
+
         # Data de início (próximo mês)
         start_date = datetime.now() + timedelta(days=30)
-        
+
         subscription_data = {
             "reason": description,
             "auto_recurring": {
@@ -47,33 +137,35 @@ class MercadoPagoService:
             "back_url": os.getenv('FRONTEND_URL', 'http://localhost:3000') + "/subscription/success",
             "payer_email": user_email,
             "payment_method_id": payment_method_id,
+            "external_reference": external_reference,
         }
-        
-        result = self.sdk.subscription().create(subscription_data)
-        return result
-    
-    def create_payment(
+
+        return await self.request("POST", "/preapproval", json=subscription_data)
+
+    async def create_payment(
         self,
         amount: float,
         description: str,
         payer_email: str,
         payment_method_id: str,
-        installments: int = 1
+        installments: int = 1,
+        external_reference: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         Cria um pagamento único (para o primeiro mês)
-        
+
         Args:
             amount: Valor a cobrar
             description: Descrição do pagamento
             payer_email: Email do pagador
             payment_method_id: ID do método de pagamento
             installments: Número de parcelas
-            
+            external_reference: Referência nossa (ID do usuário, usado pelo webhook)
+
         Returns:
             Dict com dados do pagamento
         """
-        
+
         payment_data = {
             "transaction_amount": float(amount),
             "description": description,
@@ -82,74 +174,73 @@ class MercadoPagoService:
             "payer": {
                 "email": payer_email
             },
+            "external_reference": external_reference,
             "notification_url": os.getenv('BACKEND_URL', 'http://localhost:8000') + "/api/payments/webhook"
         }
-        
-        result = self.sdk.payment().create(payment_data)
-        return result
-    
-    def cancel_subscription(self, subscription_id: str) -> Dict[str, Any]:
+
+        return await self.request(
+            "POST",
+            "/v1/payments",
+            json=payment_data,
+            timeout=MERCADOPAGO_PAYMENT_TIMEOUT_SECONDS
+        )
+
+    async def cancel_subscription(self, subscription_id: str) -> Dict[str, Any]:
         """
         Cancela uma assinatura
-        
+
         Args:
             subscription_id: ID da assinatura no Mercado Pago
-            
+
         Returns:
             Dict com resultado do cancelamento
         """
-        
-        result = self.sdk.subscription().update(
-            subscription_id,
-            {"status": "cancelled"}
-        )
-        return result
-    
-    def get_subscription(self, subscription_id: str) -> Dict[str, Any]:
+
+        return await self.request("PUT", f"/preapproval/{subscription_id}", json={"status": "cancelled"})
+
+    async def get_subscription(self, subscription_id: str) -> Dict[str, Any]:
         """
         Busca informações de uma assinatura
-        
+
         Args:
             subscription_id: ID da assinatura
-            
+
         Returns:
             Dict com dados da assinatura
         """
-        
-        result = self.sdk.subscription().get(subscription_id)
-        return result
-    
-    def get_payment(self, payment_id: str) -> Dict[str, Any]:
+
+        return await self.request("GET", f"/preapproval/{subscription_id}")
+
+    async def get_payment(self, payment_id: str) -> Dict[str, Any]:
         """
         Busca informações de um pagamento
-        
+
         Args:
             payment_id: ID do pagamento
-            
+
         Returns:
             Dict com dados do pagamento
         """
-        
-        result = self.sdk.payment().get(payment_id)
-        return result
-    
+
+        return await self.request("GET", f"/v1/payments/{payment_id}")
+
     def apply_discount(self, amount: float, discount_type: str, discount_value: float) -> float:
         """
         Aplica desconto a um valor
-        
+
         Args:
             amount: Valor original
             discount_type: Tipo de desconto (percentage, fixed)
             discount_value: Valor do desconto
-            
+
         Returns:
             Valor final com desconto aplicado
         """
-        
+
         if discount_type == "percentage":
             discount = amount * (discount_value / 100)
             return round(amount - discount, 2)
         elif discount_type == "fixed":
             return round(max(0, amount - discount_value), 2)
-        
+
         return amount
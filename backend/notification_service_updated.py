@@ -4,128 +4,625 @@ Envia notificações para o FOTÓGRAFO (não cliente) em 48h, 24h e 12h antes do
 """
 
 import os
+import time
+import heapq
+import socket
 import asyncio
+import itertools
 import httpx
-from datetime import datetime, timedelta
-from typing import List, Dict, Any
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from whatsapp_service import QUEUED, WhatsAppSender, create_whatsapp_sender
+
+load_dotenv(Path(__file__).parent / '.env')
+
+# Lembretes: tipo -> horas antes do evento
+REMINDER_HOURS = {
+    "48h": 48,
+    "24h": 24,
+    "12h": 12,
+}
+
+# Antecedência permitida no envio de um lembrete (0.2h = 12 minutos)
+REMINDER_TOLERANCE_HOURS = 0.2
+
+# Tempo até um envio "preso" em sending (réplica caiu no meio) poder ser retomado
+DELIVERY_LEASE_SECONDS = int(os.getenv('NOTIFICATION_DELIVERY_LEASE_SECONDS', 300))
+
+# Tentativas máximas por lembrete antes de desistir
+DELIVERY_MAX_ATTEMPTS = int(os.getenv('NOTIFICATION_DELIVERY_MAX_ATTEMPTS', 3))
+
+# Cliente HTTP compartilhado (keep-alive)
+HTTP_TIMEOUT_SECONDS = float(os.getenv('NOTIFICATION_HTTP_TIMEOUT', 10))
+HTTP_CONNECT_TIMEOUT_SECONDS = float(os.getenv('NOTIFICATION_HTTP_CONNECT_TIMEOUT', 5))
+HTTP_MAX_CONNECTIONS = int(os.getenv('NOTIFICATION_HTTP_MAX_CONNECTIONS', 100))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('NOTIFICATION_HTTP_MAX_KEEPALIVE', 20))
+
+# Envios simultâneos (total de lembretes e por canal)
+REMINDER_CONCURRENCY = int(os.getenv('NOTIFICATION_REMINDER_CONCURRENCY', 50))
+PUSH_CONCURRENCY = int(os.getenv('NOTIFICATION_PUSH_CONCURRENCY', 20))
+WHATSAPP_CONCURRENCY = int(os.getenv('NOTIFICATION_WHATSAPP_CONCURRENCY', 5))
+
+# Notificações por chamada ao /send-batch do serviço de push
+PUSH_BATCH_SIZE = int(os.getenv('NOTIFICATION_PUSH_BATCH_SIZE', 200))
+
+# Faixas (segundos) do histograma de duração dos ticks
+TICK_DURATION_BUCKETS = (0.5, 1, 2, 5, 10, 30, 60)
+
+# Recarga completa da fila de lembretes (rede de segurança para o change stream)
+SCHEDULE_REFRESH_SECONDS = int(os.getenv('NOTIFICATION_SCHEDULE_REFRESH_SECONDS', 3600))
+
+# Recarga enquanto o change stream estiver fora (ex.: MongoDB standalone)
+SCHEDULE_REFRESH_DEGRADED_SECONDS = int(os.getenv('NOTIFICATION_SCHEDULE_REFRESH_DEGRADED_SECONDS', 300))
+
+# Espera antes de reabrir o change stream de eventos após um erro
+CHANGE_STREAM_RETRY_SECONDS = 30
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """Cria o cliente HTTP do scheduler (HTTP/2 se o pacote h2 estiver instalado)"""
+    
+    try:
+        import h2  # noqa: F401
+        http2 = True
+    except ImportError:
+        http2 = False
+    
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        ),
+        timeout=httpx.Timeout(HTTP_TIMEOUT_SECONDS, connect=HTTP_CONNECT_TIMEOUT_SECONDS),
+    )
+
+
+class ReminderQueue:
+    """
+    Fila (heap) de lembretes ordenada pelo instante de envio.
+    Reagendar/remover um evento só invalida a versão antiga; entradas
+    obsoletas são descartadas ao chegar no topo do heap.
+    """
+    
+    def __init__(self):
+        self._heap = []
+        self._versions: Dict[str, int] = {}
+        self._counter = itertools.count()
+        self.changed = asyncio.Event()
+    
+    def __len__(self) -> int:
+        return len(self._versions)
+    
+    def clear(self):
+        self._heap.clear()
+        self._versions.clear()
+        self.changed.set()
+    
+    def schedule(self, event_id: str, event_date: datetime):
+        """(Re)agenda os lembretes 48h/24h/12h de um evento"""
+        
+        previous_next = self.next_fire_at()
+        version = next(self._counter)
+        self._versions[event_id] = version
+        
+        for reminder_type, hours in REMINDER_HOURS.items():
+            fire_at = event_date - timedelta(hours=hours)
+            heapq.heappush(self._heap, (fire_at, version, event_id, reminder_type))
+        
+        self._compact()
+        
+        if previous_next is None or self.next_fire_at() < previous_next:
+            self.changed.set()
+    
+    def remove(self, event_id: str):
+        self._versions.pop(event_id, None)
+    
+    def next_fire_at(self) -> Optional[datetime]:
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+    
+    def pop_due(self, now: datetime) -> List[tuple]:
+        """Remove e retorna (event_id, reminder_type) de todos os lembretes vencidos"""
+        
+        due = []
+        while self.next_fire_at() is not None and self._heap[0][0] <= now:
+            _, _, event_id, reminder_type = heapq.heappop(self._heap)
+            due.append((event_id, reminder_type))
+        return due
+    
+    def _drop_stale(self):
+        while self._heap and self._versions.get(self._heap[0][2]) != self._heap[0][1]:
+            heapq.heappop(self._heap)
+    
+    def _compact(self):
+        # Muitos reagendamentos deixam entradas obsoletas; reconstrói o heap
+        if len(self._heap) > 4 * len(REMINDER_HOURS) * max(len(self._versions), 1):
+            self._heap = [entry for entry in self._heap if self._versions.get(entry[2]) == entry[1]]
+            heapq.heapify(self._heap)
+
 
 class NotificationScheduler:
     """Scheduler de notificações"""
     
-    def __init__(self):
-        self.api_url = os.getenv('BACKEND_URL', 'http://localhost:8000')
+    def __init__(
+        self,
+        db=None,
+        http_client: Optional[httpx.AsyncClient] = None,
+        whatsapp_sender: Optional[WhatsAppSender] = None
+    ):
+        self.push_service_url = os.getenv('PUSH_SERVICE_URL', 'http://localhost:8001')
+        self.http = http_client or create_http_client()
         self.enable_whatsapp = os.getenv('ENABLE_WHATSAPP', 'false').lower() == 'true'
+        
+        # Um sender injetado (ex.: FakeWhatsAppProvider em testes) ativa o canal
+        if whatsapp_sender is not None:
+            self.enable_whatsapp = True
+        elif self.enable_whatsapp:
+            whatsapp_sender = create_whatsapp_sender()
+        self.whatsapp = whatsapp_sender
+        self.instance_id = f"{socket.gethostname()}:{os.getpid()}"
+        
+        self.reminder_semaphore = asyncio.Semaphore(REMINDER_CONCURRENCY)
+        self.push_semaphore = asyncio.Semaphore(PUSH_CONCURRENCY)
+        self.whatsapp_semaphore = asyncio.Semaphore(WHATSAPP_CONCURRENCY)
+        
+        # Histograma cumulativo: limite da faixa (ou "+Inf") -> quantidade de ticks
+        self.tick_duration_histogram = {str(bucket): 0 for bucket in TICK_DURATION_BUCKETS}
+        self.tick_duration_histogram["+Inf"] = 0
+        
+        self.queue = ReminderQueue()
+        # _id do Mongo -> id do evento (eventos de delete no change stream só trazem o _id)
+        self._event_ids_by_object_id: Dict[Any, str] = {}
+        # Sem change stream a fila só se atualiza pela recarga (intervalo curto)
+        self.change_stream_active = False
+        self.change_stream_degraded_logged = False
+        
+        if db is None:
+            db = AsyncIOMotorClient(os.environ['MONGO_URL'])[os.environ['DB_NAME']]
+        self.db = db
+    
+    async def close(self):
+        """Fecha o pool de conexões HTTP e o sender de WhatsApp"""
+        
+        await self.http.aclose()
+        if self.whatsapp:
+            await self.whatsapp.close()
     
-    async def check_and_send_notifications(self):
-        """Verifica eventos e envia notificações quando necessário"""
+    async def ensure_ledger_index(self):
+        """O índice único em (event_id, reminder_type) é o que garante envio único"""
         
-        print("🔔 Verificando eventos para notificar...")
+        await self.db.notification_deliveries.create_index(
+            [("event_id", ASCENDING), ("reminder_type", ASCENDING)],
+            name="notification_deliveries_event_reminder_unique",
+            unique=True
+        )
+    
+    async def fire_due_reminders(self) -> Optional[Dict[str, int]]:
+        """Envia os lembretes da fila cujo instante já chegou"""
+        
+        now = datetime.now()
+        entries = self.queue.pop_due(now)
+        if not entries:
+            return None
         
-        # Pegar todos os eventos
-        events = await self.get_all_events()
+        started_at = time.perf_counter()
         
-        if not events:
-            print("✅ Nenhum evento encontrado")
-            return
+        # Recarrega os eventos para enviar com os dados atuais
+        events = await self.get_events_by_id({event_id for event_id, _ in entries})
+        
+        due = []
+        for event_id, reminder_type in entries:
+            event = events.get(event_id)
+            # Se vários lembretes venceram juntos (ex.: após reinício), só o mais recente vale
+            if event and self.get_due_reminder(event, now) == reminder_type:
+                due.append((event, reminder_type))
+        
+        stats = await self.deliver_due(due)
+        stats["scanned"] = len(entries)
+        
+        self.log_tick(stats, time.perf_counter() - started_at)
+        return stats
+    
+    async def deliver_due(self, due: List[tuple]) -> Dict[str, int]:
+        """Envia os lembretes (evento, tipo) informados: push em lote e WhatsApp em paralelo"""
+        
+        stats = {"scanned": 0, "matched": len(due), "sent": 0, "queued": 0, "skipped": 0, "failed": 0, "no_channel": 0}
+        
+        if not due:
+            return stats
+        
+        # Uma consulta $in para fotógrafos e outra para clientes
+        photographers = await self.get_photographers({event['user_id'] for event, _ in due})
+        client_names = await self.get_client_names({event.get('client_id') for event, _ in due})
+        
+        reminders = []
+        for event, notification_type in due:
+            photographer = photographers.get(event['user_id'])
+            if not photographer:
+                continue
+            
+            event.setdefault('client_name', client_names.get(event.get('client_id'), 'Cliente'))
+            reminders.append({"event": event, "photographer": photographer, "type": notification_type, "channels": {}})
+        
+        # Só a réplica que conseguir registrar o lembrete no ledger envia
+        claims = await asyncio.gather(*(self.claim_reminder(reminder) for reminder in reminders), return_exceptions=True)
+        
+        claimed = []
+        for reminder, claim in zip(reminders, claims):
+            if isinstance(claim, Exception):
+                print(f"❌ Erro ao registrar lembrete do evento {reminder['event'].get('id')}: {str(claim)}")
+                stats["failed"] += 1
+            elif claim:
+                reminder["message"] = self.create_notification_message(reminder["event"], reminder["type"])
+                claimed.append(reminder)
+            else:
+                stats["skipped"] += 1
+        
+        # Push (um lote) e WhatsApp em paralelo; falha de um canal não afeta o outro
+        await asyncio.gather(
+            self.send_push_batch(claimed),
+            self.send_whatsapp_batch(claimed),
+            return_exceptions=True
+        )
+        
+        finishes = []
+        for reminder in claimed:
+            outcomes = list(reminder["channels"].values())
+            if any(outcome is True for outcome in outcomes):
+                status = "sent"
+                print(f"✅ Notificação enviada: {reminder['event']['event_type']} - {reminder['type']}")
+            elif QUEUED in outcomes:
+                # Só o WhatsApp pode entregar e ainda está na fila de reenvio:
+                # o ledger vira sent/failed quando o reenvio terminar
+                status = "queued"
+            elif not outcomes:
+                status = "no_channel"
+            else:
+                status = "failed"
+            
+            stats[status] += 1
+            error = None if status != "failed" else "Nenhum canal entregou a notificação"
+            finishes.append(self.finish_delivery(reminder["event"]["id"], reminder["type"], status, error))
+        
+        await asyncio.gather(*finishes, return_exceptions=True)
+        return stats
+    
+    async def claim_reminder(self, reminder: Dict[str, Any]) -> bool:
+        async with self.reminder_semaphore:
+            return await self.claim_delivery(reminder["event"]["id"], reminder["type"], str(reminder["event"]["event_date"]))
+    
+    def log_tick(self, stats: Dict[str, int], duration: float):
+        """Registra a duração no histograma e imprime o resumo do tick"""
+        
+        self.observe_tick_duration(duration)
+        
+        print(
+            f"🎉 Eventos lidos: {stats['scanned']} | com lembrete pendente: {stats['matched']} | "
+            f"enviadas: {stats['sent']} | na fila de reenvio: {stats['queued']} | já enviadas: {stats['skipped']} | "
+            f"falhas: {stats['failed']} | duração: {duration:.2f}s"
+        )
+    
+    # ========================================
+    # FILA DE LEMBRETES (EVENT-DRIVEN)
+    # ========================================
+    
+    async def run(self):
+        """
+        Dorme até o próximo lembrete da fila (ou até a fila mudar) e envia na hora.
+        A fila é montada a partir dos eventos e atualizada pelo change stream.
+        """
+        
+        await self.rebuild_schedule()
+        last_refresh = time.monotonic()
+        watcher = asyncio.create_task(self.watch_events())
+        
+        try:
+            while True:
+                try:
+                    await self.fire_due_reminders()
+                    
+                    # Recalculado a cada volta: o intervalo muda se o change stream cair
+                    next_refresh = last_refresh + self.refresh_interval()
+                    if time.monotonic() >= next_refresh:
+                        await self.rebuild_schedule()
+                        last_refresh = time.monotonic()
+                        next_refresh = last_refresh + self.refresh_interval()
+                    
+                    timeout = next_refresh - time.monotonic()
+                    next_fire_at = self.queue.next_fire_at()
+                    if next_fire_at is not None:
+                        timeout = min(timeout, (next_fire_at - datetime.now()).total_seconds())
+                    
+                    self.queue.changed.clear()
+                    if timeout > 0:
+                        try:
+                            await asyncio.wait_for(self.queue.changed.wait(), timeout)
+                        except asyncio.TimeoutError:
+                            pass
+                            
+                except Exception as e:
+                    print(f"❌ Erro no scheduler: {str(e)}")
+                    await asyncio.sleep(60)  # Em caso de erro, aguarda 1 minuto
+        finally:
+            watcher.cancel()
+    
+    def refresh_interval(self) -> float:
+        """Intervalo da recarga completa (curto sem change stream)"""
+        
+        if self.change_stream_active:
+            return SCHEDULE_REFRESH_SECONDS
+        return min(SCHEDULE_REFRESH_SECONDS, SCHEDULE_REFRESH_DEGRADED_SECONDS)
+    
+    def schedule_horizon(self, now: datetime) -> datetime:
+        """Eventos até aqui ficam na fila; os demais entram na próxima recarga"""
+        
+        return now + timedelta(
+            hours=max(REMINDER_HOURS.values()) + REMINDER_TOLERANCE_HOURS,
+            seconds=SCHEDULE_REFRESH_SECONDS
+        )
+    
+    async def rebuild_schedule(self):
+        """Recarrega a fila com todos os eventos futuros dentro do horizonte"""
         
         now = datetime.now()
-        notifications_sent = 0
+        events = await self.db.events.find(
+            {"event_date": {
+                "$gt": now.strftime("%Y-%m-%dT%H:%M:%S"),
+                "$lte": self.schedule_horizon(now).strftime("%Y-%m-%dT%H:%M:%S"),
+            }},
+            {"_id": 1, "id": 1, "event_date": 1}
+        ).to_list(None)
+        
+        self.queue.clear()
+        self._event_ids_by_object_id.clear()
         
         for event in events:
+            self.schedule_event(event, now)
+        
+        print(f"🗓️ Fila de lembretes recarregada: {len(self.queue)} eventos")
+    
+    def schedule_event(self, event: Dict[str, Any], now: Optional[datetime] = None):
+        """Coloca (ou tira) um evento da fila conforme a data"""
+        
+        now = now or datetime.now()
+        
+        try:
+            event_date = self.local_event_date(event)
+        except Exception as e:
+            print(f"❌ Data inválida no evento {event.get('id')}: {str(e)}")
+            self.queue.remove(event.get('id'))
+            return
+        
+        if '_id' in event:
+            self._event_ids_by_object_id[event['_id']] = event['id']
+        
+        if now < event_date <= self.schedule_horizon(now):
+            self.queue.schedule(event['id'], event_date)
+        else:
+            self.queue.remove(event['id'])
+    
+    async def watch_events(self):
+        """Atualiza a fila quando eventos são criados, alterados ou removidos"""
+        
+        resume_token = None
+        
+        while True:
             try:
-                # Converter event_date para datetime
-                if isinstance(event['event_date'], str):
-                    event_date = datetime.fromisoformat(event['event_date'].replace('Z', '+00:00'))
-                else:
-                    event_date = event['event_date']
-                
-                # Calcular diferença em horas
-                time_until_event = event_date - now
-                hours_until = time_until_event.total_seconds() / 3600
-                
-                # Verificar se precisa notificar
-                should_notify = False
-                notification_type = ""
-                
-                # 48 horas antes (entre 47h50 e 48h10)
-                if 47.8 <= hours_until <= 48.2:
-                    should_notify = True
-                    notification_type = "48h"
-                
-                # 24 horas antes (entre 23h50 e 24h10)
-                elif 23.8 <= hours_until <= 24.2:
-                    should_notify = True
-                    notification_type = "24h"
-                
-                # 12 horas antes (entre 11h50 e 12h10)
-                elif 11.8 <= hours_until <= 12.2:
-                    should_notify = True
-                    notification_type = "12h"
-                
-                if should_notify:
-                    # Buscar dados do fotógrafo (usuário dono do evento)
-                    photographer = await self.get_photographer(event['user_id'])
-                    
-                    if photographer:
-                        await self.send_notification(event, photographer, notification_type)
-                        notifications_sent += 1
-                        print(f"✅ Notificação enviada: {event['event_type']} - {notification_type}")
+                async with self.db.events.watch(
+                    full_document="updateLookup",
+                    resume_after=resume_token
+                ) as stream:
+                    if not self.change_stream_active:
+                        self.change_stream_active = True
+                        if self.change_stream_degraded_logged:
+                            print("✅ Change stream de eventos restabelecido")
+                            self.change_stream_degraded_logged = False
+                        # Cobre as mudanças feitas enquanto o stream estava fora
+                        await self.rebuild_schedule()
                     
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        self.apply_change(change)
+                        
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
-                print(f"❌ Erro ao processar evento {event.get('id')}: {str(e)}")
-                continue
+                # Ex.: MongoDB standalone não tem change stream - recarga a cada
+                # SCHEDULE_REFRESH_DEGRADED_SECONDS até o stream voltar
+                self.change_stream_active = False
+                if not self.change_stream_degraded_logged:
+                    print(
+                        f"⚠️ Change stream de eventos indisponível ({str(e)}); "
+                        f"fila recarregada a cada {self.refresh_interval()}s"
+                    )
+                    self.change_stream_degraded_logged = True
+                # Acorda o loop principal para usar o intervalo curto
+                self.queue.changed.set()
+                await asyncio.sleep(CHANGE_STREAM_RETRY_SECONDS)
+    
+    def apply_change(self, change: Dict[str, Any]):
+        """Aplica um evento do change stream na fila"""
+        
+        operation = change.get("operationType")
+        object_id = change.get("documentKey", {}).get("_id")
         
-        print(f"🎉 Total de notificações enviadas: {notifications_sent}")
+        if operation in ("insert", "update", "replace"):
+            document = change.get("fullDocument")
+            if document:
+                self.schedule_event(document)
+                return
+        
+        if operation in ("delete", "update", "replace"):
+            event_id = self._event_ids_by_object_id.pop(object_id, None)
+            if event_id:
+                self.queue.remove(event_id)
+    
+    def observe_tick_duration(self, duration: float):
+        """Registra a duração de um tick no histograma"""
+        
+        for bucket in TICK_DURATION_BUCKETS:
+            if duration <= bucket:
+                self.tick_duration_histogram[str(bucket)] += 1
+        self.tick_duration_histogram["+Inf"] += 1
     
-    async def get_all_events(self) -> List[Dict[str, Any]]:
-        """Busca todos os eventos do sistema"""
+    @staticmethod
+    def parse_event_date(event: Dict[str, Any]) -> datetime:
+        """Converte event_date para datetime"""
+        
+        if isinstance(event['event_date'], str):
+            return datetime.fromisoformat(event['event_date'].replace('Z', '+00:00'))
+        return event['event_date']
+    
+    def local_event_date(self, event: Dict[str, Any]) -> datetime:
+        """event_date como datetime local sem fuso (mesma base de datetime.now())"""
+        
+        event_date = self.parse_event_date(event)
+        if event_date.tzinfo is not None:
+            event_date = event_date.astimezone().replace(tzinfo=None)
+        return event_date
+    
+    def get_due_reminder(self, event: Dict[str, Any], now: datetime) -> str:
+        """
+        Retorna o lembrete mais próximo do evento que já venceu (48h/24h/12h), ou ''.
+        Um tick atrasado recupera o lembrete perdido; se vários venceram, só o
+        mais recente é enviado.
+        """
+        
+        event_date = self.local_event_date(event)
+        
+        hours_until = (event_date - now).total_seconds() / 3600
+        if hours_until <= 0:
+            return ""
+        
+        due = [
+            (hours, notification_type)
+            for notification_type, hours in REMINDER_HOURS.items()
+            if hours_until <= hours + REMINDER_TOLERANCE_HOURS
+        ]
+        
+        return min(due)[1] if due else ""
+    
+    async def claim_delivery(self, event_id: str, reminder_type: str, event_date: str) -> bool:
+        """
+        Registra o lembrete no ledger (notification_deliveries) via upsert.
+        
+        O registro guarda a data do evento: se o evento foi remarcado, o
+        lembrete já enviado para a data antiga pode ser enviado de novo.
+        
+        Returns:
+            True se esta réplica ganhou o direito de enviar. False se o lembrete
+            já foi enviado ou está sendo enviado por outra réplica.
+        """
+        
+        now = datetime.now(timezone.utc)
+        ledger = self.db.notification_deliveries
+        
+        # Evento remarcado: reabre o registro da data antiga (envio em andamento fica como está)
+        await ledger.update_one(
+            {
+                "event_id": event_id,
+                "reminder_type": reminder_type,
+                "event_date": {"$exists": True, "$ne": event_date},
+                "status": {"$nin": ["sending", "queued"]}
+            },
+            {"$set": {"status": "failed", "attempts": 0, "event_date": event_date, "error": None}}
+        )
         
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(f"{self.api_url}/api/events/all")
-                
-                if response.status_code == 200:
-                    return response.json()
-                
-                return []
-                
+            await ledger.update_one(
+                {
+                    "event_id": event_id,
+                    "reminder_type": reminder_type,
+                    "$or": [
+                        {"status": "failed", "attempts": {"$lt": DELIVERY_MAX_ATTEMPTS}},
+                        {"status": "sending", "claimed_at": {"$lt": now - timedelta(seconds=DELIVERY_LEASE_SECONDS)}},
+                        # Fila de reenvio perdida (processo reiniciou)
+                        {"status": "queued", "claimed_at": {"$lt": now - timedelta(seconds=DELIVERY_LEASE_SECONDS)}},
+                    ]
+                },
+                {
+                    "$set": {"status": "sending", "claimed_at": now, "claimed_by": self.instance_id, "event_date": event_date},
+                    "$inc": {"attempts": 1}
+                },
+                upsert=True
+            )
+            return True
+            
+        except DuplicateKeyError:
+            # Já existe registro que não pode ser retomado (enviado ou em andamento)
+            return False
+    
+    async def finish_delivery(self, event_id: str, reminder_type: str, status: str, error: Optional[str] = None):
+        """Marca o lembrete como sent/queued/failed no ledger"""
+        
+        await self.db.notification_deliveries.update_one(
+            {"event_id": event_id, "reminder_type": reminder_type, "claimed_by": self.instance_id},
+            {"$set": {"status": status, "finished_at": datetime.now(timezone.utc), "error": error}}
+        )
+    
+    async def finish_queued_delivery(self, event_id: str, reminder_type: str, delivered: bool, error: Optional[str]):
+        """Resultado do reenvio do WhatsApp para um lembrete que ficou em queued"""
+        
+        await self.db.notification_deliveries.update_one(
+            {"event_id": event_id, "reminder_type": reminder_type, "claimed_by": self.instance_id, "status": "queued"},
+            {"$set": {
+                "status": "sent" if delivered else "failed",
+                "finished_at": datetime.now(timezone.utc),
+                "error": error
+            }}
+        )
+    
+    async def get_events_by_id(self, event_ids) -> Dict[str, Dict[str, Any]]:
+        """Busca eventos pelo id em uma única consulta"""
+        
+        try:
+            events = await self.db.events.find(
+                {"id": {"$in": list(event_ids)}},
+                {"_id": 0}
+            ).to_list(None)
+            return {event['id']: event for event in events}
+            
         except Exception as e:
             print(f"❌ Erro ao buscar eventos: {str(e)}")
-            return []
+            return {}
     
-    async def get_photographer(self, user_id: str) -> Dict[str, Any]:
-        """Busca dados do fotógrafo pelo ID"""
+    async def get_photographers(self, user_ids) -> Dict[str, Dict[str, Any]]:
+        """Busca os fotógrafos (donos dos eventos) em uma única consulta"""
         
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(f"{self.api_url}/api/users/{user_id}")
-                
-                if response.status_code == 200:
-                    return response.json()
-                
-                return None
-                
+            users = await self.db.users.find(
+                {"id": {"$in": list(user_ids)}},
+                {"_id": 0, "password_hash": 0}
+            ).to_list(None)
+            return {user['id']: user for user in users}
+            
         except Exception as e:
-            print(f"❌ Erro ao buscar fotógrafo: {str(e)}")
-            return None
+            print(f"❌ Erro ao buscar fotógrafos: {str(e)}")
+            return {}
     
-    async def send_notification(
-        self,
-        event: Dict[str, Any],
-        photographer: Dict[str, Any],
-        notification_type: str
-    ):
-        """Envia notificação para o fotógrafo"""
-        
-        # Preparar mensagem
-        message = self.create_notification_message(event, notification_type)
+    async def get_client_names(self, client_ids) -> Dict[str, str]:
+        """Busca os nomes dos clientes dos eventos em uma única consulta"""
         
-        # Enviar Push Notification
-        await self.send_push_notification(photographer, message, event)
+        client_ids = [client_id for client_id in client_ids if client_id]
+        if not client_ids:
+            return {}
         
-        # Enviar WhatsApp (apenas se ativado e fotógrafo tiver telefone)
-        if self.enable_whatsapp and photographer.get('phone'):
-            await self.send_whatsapp(photographer['phone'], message)
+        try:
+            clients = await self.db.clients.find(
+                {"id": {"$in": client_ids}},
+                {"_id": 0, "id": 1, "name": 1}
+            ).to_list(None)
+            return {client['id']: client.get('name', 'Cliente') for client in clients}
+            
+        except Exception as e:
+            print(f"❌ Erro ao buscar clientes: {str(e)}")
+            return {}
     
     def create_notification_message(
         self,
@@ -145,10 +642,7 @@ class NotificationScheduler:
         time_text = notification_type.replace('h', ' horas')
         
         # Formatar data/hora
-        if isinstance(event['event_date'], str):
-            event_date = datetime.fromisoformat(event['event_date'].replace('Z', '+00:00'))
-        else:
-            event_date = event['event_date']
+        event_date = self.parse_event_date(event)
         
         date_str = event_date.strftime('%d/%m/%Y às %H:%M')
         
@@ -160,8 +654,8 @@ class NotificationScheduler:
         message = f"""{emoji} Lembrete: Faltam {time_text}!
 
 📸 Evento: {event['event_type']}
-👤 Cliente: {event['client_name']}
-📍 Local: {event['location']}
+👤 Cliente: {event.get('client_name', 'Cliente')}
+📍 Local: {event.get('location') or '-'}
 🗓️ Data: {date_str}
 
 💰 Valores:
@@ -173,75 +667,165 @@ Boa sorte no evento! 📸✨"""
         
         return message
     
-    async def send_push_notification(
-        self,
-        photographer: Dict[str, Any],
-        message: str,
-        event: Dict[str, Any]
-    ):
-        """Envia Push Notification para o fotógrafo"""
+    @staticmethod
+    def get_push_subscriptions(photographer: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Subscriptions de push do fotógrafo (uma por dispositivo, sem endpoints repetidos)"""
+        
+        subscriptions = list(photographer.get('push_subscriptions') or [])
+        
+        # Formato antigo: campo único, às vezes como {"subscription": {...}}
+        legacy = photographer.get('push_subscription')
+        if legacy and 'subscription' in legacy:
+            legacy = legacy['subscription']
+        if legacy:
+            subscriptions.append(legacy)
+        
+        unique = {}
+        for subscription in subscriptions:
+            if subscription and subscription.get('endpoint'):
+                unique.setdefault(subscription['endpoint'], subscription)
+        
+        return list(unique.values())
+    
+    async def send_push_batch(self, reminders: List[Dict[str, Any]]):
+        """Envia as push notifications dos lembretes via /send-batch do serviço de push"""
+        
+        items = []
+        owners = []
+        for reminder in reminders:
+            subscriptions = self.get_push_subscriptions(reminder["photographer"])
+            if not subscriptions:
+                print(f"⚠️ Fotógrafo {reminder['photographer'].get('name')} não tem push ativado")
+                continue
+            
+            notification = {
+                "title": f"Evento: {reminder['event']['event_type']}",
+                "body": reminder["message"],
+                "icon": "/fotiva-icon-192.png",
+                "badge": "/fotiva-icon-192.png",
+                "data": {"url": "/agenda", "event_id": reminder['event']['id']}
+            }
+            
+            # Um item por dispositivo do fotógrafo
+            for subscription in subscriptions:
+                items.append({
+                    "subscription": {"endpoint": subscription['endpoint'], "keys": subscription.get('keys', {})},
+                    "notification": notification
+                })
+                owners.append(reminder)
+        
+        chunks = [
+            (items[start:start + PUSH_BATCH_SIZE], owners[start:start + PUSH_BATCH_SIZE])
+            for start in range(0, len(items), PUSH_BATCH_SIZE)
+        ]
+        await asyncio.gather(*(self.send_push_chunk(chunk_items, chunk_owners) for chunk_items, chunk_owners in chunks))
+    
+    async def send_push_chunk(self, items: List[Dict[str, Any]], owners: List[Dict[str, Any]]):
+        """Envia um lote ao serviço de push e registra o resultado de cada lembrete"""
         
         try:
-            if not photographer.get('push_subscription'):
-                print(f"⚠️ Fotógrafo {photographer.get('name')} não tem push ativado")
+            async with self.push_semaphore:
+                response = await self.http.post(f"{self.push_service_url}/send-batch", json={"items": items})
+            
+            if response.status_code != 200:
+                print(f"❌ Erro ao enviar lote de push: {response.status_code}")
+                for owner in owners:
+                    owner["channels"].setdefault("push", False)
                 return
             
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{self.api_url}/api/push/send",
-                    json={
-                        "user_id": photographer['id'],
-                        "title": f"Evento: {event['event_type']}",
-                        "body": message,
-                        "icon": "/fotiva-icon-192.png",
-                        "badge": "/fotiva-icon-192.png"
-                    }
-                )
+            expired = []
+            for result in response.json()["results"]:
+                owner = owners[result["index"]]
+                # Basta um dispositivo receber
+                owner["channels"]["push"] = owner["channels"].get("push", False) or result["status"] == "success"
                 
-                if response.status_code == 200:
-                    print(f"✅ Push enviado para {photographer.get('name')}")
-                else:
-                    print(f"❌ Erro ao enviar push: {response.status_code}")
-                    
+                if result["status"] == "expired":
+                    expired.append((owner["photographer"]["id"], result["endpoint"]))
+                elif result["status"] != "success":
+                    print(f"❌ Push não entregue para {owner['photographer'].get('name')}: {result.get('detail')}")
+            
+            print(f"✅ Lote de push enviado: {len(items)} notificações")
+            
+            if expired:
+                await self.prune_push_subscriptions(expired)
+            
         except Exception as e:
             print(f"❌ Erro ao enviar push notification: {str(e)}")
+            for owner in owners:
+                owner["channels"].setdefault("push", False)
     
-    async def send_whatsapp(self, phone: str, message: str):
-        """Envia mensagem via WhatsApp (Twilio)"""
+    async def prune_push_subscriptions(self, expired: List[tuple]):
+        """Remove dos usuários as subscriptions que o serviço de push respondeu 404/410"""
         
-        if not self.enable_whatsapp:
-            print("⚠️ WhatsApp desativado (ENABLE_WHATSAPP=false)")
-            return
+        operations = []
+        for user_id, endpoint in set(expired):
+            operations.append(UpdateOne(
+                {"id": user_id},
+                {"$pull": {"push_subscriptions": {"endpoint": endpoint}}}
+            ))
+            operations.append(UpdateOne(
+                {"id": user_id, "$or": [
+                    {"push_subscription.endpoint": endpoint},
+                    {"push_subscription.subscription.endpoint": endpoint}
+                ]},
+                {"$unset": {"push_subscription": ""}}
+            ))
         
         try:
-            from twilio.rest import Client
-            
-            account_sid = os.getenv('TWILIO_ACCOUNT_SID')
-            auth_token = os.getenv('TWILIO_AUTH_TOKEN')
-            from_whatsapp = os.getenv('TWILIO_WHATSAPP_FROM')
-            
-            if not all([account_sid, auth_token, from_whatsapp]):
-                print("❌ Credenciais do Twilio não configuradas")
-                return
-            
-            client = Client(account_sid, auth_token)
+            await self.db.users.bulk_write(operations, ordered=False)
+            print(f"🧹 {len(operations) // 2} subscriptions de push expiradas removidas")
+        except Exception as e:
+            print(f"❌ Erro ao remover subscriptions expiradas: {str(e)}")
+    
+    async def send_whatsapp_batch(self, reminders: List[Dict[str, Any]]):
+        """Envia o WhatsApp de cada lembrete (apenas se ativado e fotógrafo tiver telefone)"""
+        
+        if not self.enable_whatsapp or not self.whatsapp:
+            return
+        
+        async def send(reminder):
+            event_id, reminder_type = reminder["event"]["id"], reminder["type"]
             
-            # Formatar número (adicionar +55 se não tiver)
-            if not phone.startswith('+'):
-                phone = '+55' + phone.replace('(', '').replace(')', '').replace('-', '').replace(' ', '')
+            async def on_result(delivered: bool, error: Optional[str]):
+                await self.finish_queued_delivery(event_id, reminder_type, delivered, error)
             
-            # Enviar mensagem
-            client.messages.create(
-                from_=f'whatsapp:{from_whatsapp}',
-                to=f'whatsapp:{phone}',
-                body=message
+            reminder["channels"]["whatsapp"] = await self.send_whatsapp(
+                reminder["photographer"]['phone'], reminder["message"], on_result
             )
+        
+        await asyncio.gather(*(
+            send(reminder) for reminder in reminders if reminder["photographer"].get('phone')
+        ))
+    
+    async def send_whatsapp(self, phone: str, message: str, on_result=None):
+        """
+        Envia mensagem via WhatsApp (Twilio) sem bloquear o event loop
+        
+        Returns:
+            True se o provider aceitou, QUEUED se foi para a fila de reenvio
+            (on_result informa o desfecho) ou False se falhou
+        """
+        
+        if not self.enable_whatsapp:
+            print("⚠️ WhatsApp desativado (ENABLE_WHATSAPP=false)")
+            return False
+        
+        if not self.whatsapp:
+            return False
+        
+        try:
+            async with self.whatsapp_semaphore:
+                outcome = await self.whatsapp.send(phone, message, on_result)
+            
+            if outcome == QUEUED:
+                return QUEUED
             
             print(f"✅ WhatsApp enviado para {phone}")
+            return True
             
         except Exception as e:
             print(f"❌ Erro ao enviar WhatsApp: {str(e)}")
-
+            return False
 
 # ========================================
 # EXECUTAR SCHEDULER
@@ -253,20 +837,18 @@ async def run_scheduler():
     scheduler = NotificationScheduler()
     
     print("🚀 Scheduler de notificações iniciado!")
-    print(f"⏰ Verificando eventos a cada 10 minutos")
+    print(
+        f"⏰ Lembretes enviados no horário exato (fila recarregada a cada {SCHEDULE_REFRESH_SECONDS}s, "
+        f"ou {SCHEDULE_REFRESH_DEGRADED_SECONDS}s sem change stream)"
+    )
     print(f"📱 WhatsApp: {'✅ Ativado' if scheduler.enable_whatsapp else '❌ Desativado'}")
     print("")
     
-    while True:
-        try:
-            await scheduler.check_and_send_notifications()
-            
-            # Aguardar 10 minutos antes da próxima verificação
-            await asyncio.sleep(600)  # 600 segundos = 10 minutos
-            
-        except Exception as e:
-            print(f"❌ Erro no scheduler: {str(e)}")
-            await asyncio.sleep(60)  # Em caso de erro, aguarda 1 minuto
+    try:
+        await scheduler.ensure_ledger_index()
+        await scheduler.run()
+    finally:
+        await scheduler.close()
 
 
 if __name__ == "__main__":
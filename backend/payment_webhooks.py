@@ -0,0 +1,381 @@
+"""
+Processamento dos webhooks do Mercado Pago fora da requisição
+
+O webhook só valida, grava a notificação na caixa de entrada
+(payment_webhook_inbox) e responde 200. Um pool de workers busca o
+pagamento no Mercado Pago e aplica a mudança na assinatura.
+"""
+
+import os
+import hmac
+import time
+import uuid
+import asyncio
+import hashlib
+from datetime import datetime, timezone, timedelta
+from typing import Any, Dict, List, Mapping, Optional
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from subscription_service import SubscriptionService
+
+# Chave secreta dos webhooks (painel do Mercado Pago > Webhooks); sem ela nenhuma notificação é aceita
+MERCADOPAGO_WEBHOOK_SECRET = os.getenv('MERCADOPAGO_WEBHOOK_SECRET', '')
+
+# Workers por processo consumindo a caixa de entrada
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 4))
+
+# Intervalo de polling quando a fila está vazia (notificações de outros processos)
+WEBHOOK_POLL_SECONDS = float(os.getenv('WEBHOOK_POLL_SECONDS', 5))
+
+# Item em processamento sem resposta após isto volta para a fila (worker caiu)
+WEBHOOK_LEASE_SECONDS = int(os.getenv('WEBHOOK_LEASE_SECONDS', 120))
+
+# Reprocessamento com backoff exponencial quando o Mercado Pago falha (5xx, 429, rede)
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv('WEBHOOK_MAX_ATTEMPTS', 8))
+WEBHOOK_RETRY_BASE_SECONDS = float(os.getenv('WEBHOOK_RETRY_BASE_SECONDS', 5))
+
+# Pagamentos que cancelam a assinatura
+REVERSED_PAYMENT_STATUSES = {"refunded", "charged_back"}
+
+# Pagamentos pendentes que não vão mais ser aprovados (devolvem o cupom reservado)
+FAILED_PAYMENT_STATUSES = {"rejected", "cancelled"}
+
+
+class PermanentWebhookError(Exception):
+    """Erro que não melhora com reprocessamento (ex.: 4xx do Mercado Pago)"""
+
+
+def as_utc(value: datetime) -> datetime:
+    """O Motor devolve datas sem fuso (em UTC)"""
+
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def parse_notification(data: Dict[str, Any], query: Dict[str, str]) -> Optional[Dict[str, Any]]:
+    """
+    Valida a notificação (formato webhook ou IPN antigo via query string)
+
+    Args:
+        data: Corpo JSON da notificação
+        query: Parâmetros da URL
+
+    Returns:
+        Dict com notification_id, type, action e payment_id, ou None se não
+        for uma notificação de pagamento válida
+    """
+
+    topic = data.get("type") or data.get("topic") or query.get("type") or query.get("topic")
+    if topic != "payment":
+        return None
+
+    payment_id = (data.get("data") or {}).get("id") or query.get("data.id") or query.get("id")
+    if not payment_id:
+        return None
+
+    payment_id = str(payment_id)
+    action = data.get("action") or "payment.updated"
+
+    # O Mercado Pago manda um id por notificação; sem ele, deduplica por pagamento + ação
+    notification_id = str(data["id"]) if data.get("id") else f"payment:{payment_id}:{action}"
+
+    return {
+        "notification_id": notification_id,
+        "type": topic,
+        "action": action,
+        "payment_id": payment_id
+    }
+
+
+def verify_signature(headers: Mapping[str, str], query: Dict[str, str], payment_id: str, secret: str) -> bool:
+    """
+    Confere o header x-signature (HMAC-SHA256) enviado pelo Mercado Pago
+
+    O manifesto assinado é "id:<data.id>;request-id:<x-request-id>;ts:<ts>;",
+    omitindo as partes ausentes.
+
+    Args:
+        headers: Headers da requisição
+        query: Parâmetros da URL
+        payment_id: ID do pagamento extraído da notificação
+        secret: Chave secreta do webhook
+
+    Returns:
+        True se a assinatura confere com a chave
+    """
+
+    if not secret:
+        return False
+
+    parts = {}
+    for part in (headers.get("x-signature") or "").split(","):
+        key, _, value = part.strip().partition("=")
+        parts[key] = value
+
+    ts, signature = parts.get("ts"), parts.get("v1")
+    if not ts or not signature:
+        return False
+
+    # A assinatura cobre o data.id da URL: o corpo não pode apontar para outro pagamento
+    signed_id = query.get("data.id", payment_id)
+    if signed_id != payment_id:
+        return False
+
+    manifest = f"id:{signed_id.lower() if signed_id.isalnum() else signed_id};"
+    request_id = headers.get("x-request-id")
+    if request_id:
+        manifest += f"request-id:{request_id};"
+    manifest += f"ts:{ts};"
+
+    expected = hmac.new(secret.encode(), manifest.encode(), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+class PaymentWebhookProcessor:
+    """Caixa de entrada dos webhooks + pool de workers"""
+
+    def __init__(self, db, mp_service, workers: int = WEBHOOK_WORKERS):
+        self.db = db
+        self.mp_service = mp_service
+        self.workers = workers
+        self.instance_id = uuid.uuid4().hex
+        self.wakeup = asyncio.Event()
+        self.tasks: List[asyncio.Task] = []
+
+        self.started_at = time.monotonic()
+        self.stats = {
+            "received": 0,
+            "duplicates": 0,
+            "processed": 0,
+            "retried": 0,
+            "failed": 0
+        }
+        self.outcomes: Dict[str, int] = {}
+        self.last_lag_seconds = 0.0
+        self.max_lag_seconds = 0.0
+        self.total_lag_seconds = 0.0
+
+    async def ensure_indexes(self):
+        inbox = self.db.payment_webhook_inbox
+        await inbox.create_index("notification_id", unique=True, name="webhook_inbox_notification_unique")
+        await inbox.create_index([("status", 1), ("available_at", 1)], name="webhook_inbox_status_available")
+
+    # ========================================
+    # ENTRADA (chamado pela rota do webhook)
+    # ========================================
+
+    async def enqueue(self, notification: Dict[str, Any]) -> bool:
+        """
+        Grava a notificação na caixa de entrada
+
+        Returns:
+            False se a notificação já tinha sido recebida (reenvio do Mercado Pago)
+        """
+
+        now = datetime.now(timezone.utc)
+
+        try:
+            await self.db.payment_webhook_inbox.insert_one({
+                **notification,
+                "status": "pending",
+                "attempts": 0,
+                "received_at": now,
+                "available_at": now
+            })
+        except DuplicateKeyError:
+            self.stats["duplicates"] += 1
+            return False
+
+        self.stats["received"] += 1
+        self.wakeup.set()
+        return True
+
+    # ========================================
+    # WORKERS
+    # ========================================
+
+    def start(self):
+        for _ in range(self.workers):
+            self.tasks.append(asyncio.create_task(self.run_worker()))
+        print(f"📥 Processador de webhooks iniciado com {self.workers} worker(s)")
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def run_worker(self):
+        while True:
+            try:
+                item = await self.claim_next()
+
+                if item is None:
+                    self.wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self.wakeup.wait(), timeout=WEBHOOK_POLL_SECONDS)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                await self.process(item)
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Erro no worker de webhooks: {str(e)}")
+                await asyncio.sleep(WEBHOOK_POLL_SECONDS)
+
+    async def claim_next(self) -> Optional[Dict[str, Any]]:
+        """Pega a notificação mais antiga disponível (ou com lease vencido)"""
+
+        now = datetime.now(timezone.utc)
+
+        return await self.db.payment_webhook_inbox.find_one_and_update(
+            {
+                "$or": [
+                    {"status": "pending", "available_at": {"$lte": now}},
+                    {"status": "processing", "lease_expires_at": {"$lt": now}}
+                ]
+            },
+            {
+                "$set": {
+                    "status": "processing",
+                    "claimed_by": self.instance_id,
+                    "lease_expires_at": now + timedelta(seconds=WEBHOOK_LEASE_SECONDS)
+                },
+                "$inc": {"attempts": 1}
+            },
+            sort=[("available_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def process(self, item: Dict[str, Any]):
+        try:
+            outcome = await self.apply_payment(item["payment_id"])
+
+        except PermanentWebhookError as e:
+            print(f"❌ Webhook do pagamento {item['payment_id']} descartado: {str(e)}")
+            await self.finish(item, "failed", error=str(e))
+            return
+
+        except Exception as e:
+            await self.retry_or_fail(item, str(e))
+            return
+
+        await self.finish(item, "done", outcome=outcome)
+
+    async def apply_payment(self, payment_id: str) -> str:
+        """
+        Busca o pagamento e aplica a mudança na assinatura
+
+        Returns:
+            Resultado registrado na caixa de entrada
+
+        Raises:
+            PermanentWebhookError: 4xx do Mercado Pago (exceto 404 e 429), sem reprocessamento
+        """
+
+        payment_info = await self.mp_service.get_payment(payment_id)
+        status_code = payment_info["status"]
+
+        # Pagamento inexistente (ex.: notificação forjada): não adianta tentar de novo
+        if status_code == 404:
+            return "not_found"
+
+        if 400 <= status_code < 500 and status_code != 429:
+            raise PermanentWebhookError(f"Mercado Pago respondeu {status_code}")
+
+        # 5xx e 429 voltam para a fila com backoff
+        if status_code != 200:
+            raise RuntimeError(f"Mercado Pago respondeu {status_code}")
+
+        payment = payment_info["response"]
+        status = payment.get("status")
+        user_id = payment.get("external_reference")
+
+        if not user_id:
+            return "no_reference"
+
+        if status == "approved":
+            await SubscriptionService.settle_coupon_for_payment(payment_id, approved=True)
+            subscription = await SubscriptionService.apply_approved_payment(user_id, payment_id)
+            if subscription:
+                return "extended"
+            if await SubscriptionService.get_subscription(user_id) is None:
+                return "no_subscription"
+            return "already_applied"
+
+        if status in REVERSED_PAYMENT_STATUSES:
+            subscription = await SubscriptionService.cancel_subscription(user_id, reason=f"payment_{status}")
+            return "cancelled" if subscription else "no_subscription"
+
+        if status in FAILED_PAYMENT_STATUSES:
+            return await SubscriptionService.settle_coupon_for_payment(payment_id, approved=False) or f"ignored_{status}"
+
+        return f"ignored_{status}"
+
+    async def retry_or_fail(self, item: Dict[str, Any], error: str):
+        if item["attempts"] >= WEBHOOK_MAX_ATTEMPTS:
+            print(f"❌ Webhook do pagamento {item['payment_id']} descartado após {item['attempts']} tentativa(s): {error}")
+            await self.finish(item, "failed", error=error)
+            return
+
+        delay = WEBHOOK_RETRY_BASE_SECONDS * (2 ** (item["attempts"] - 1))
+        self.stats["retried"] += 1
+
+        await self.db.payment_webhook_inbox.update_one(
+            {"_id": item["_id"], "claimed_by": self.instance_id},
+            {"$set": {
+                "status": "pending",
+                "available_at": datetime.now(timezone.utc) + timedelta(seconds=delay),
+                "last_error": error
+            }}
+        )
+
+    async def finish(self, item: Dict[str, Any], status: str, outcome: Optional[str] = None, error: Optional[str] = None):
+        now = datetime.now(timezone.utc)
+        lag = (now - as_utc(item["received_at"])).total_seconds()
+
+        await self.db.payment_webhook_inbox.update_one(
+            {"_id": item["_id"], "claimed_by": self.instance_id},
+            {"$set": {
+                "status": status,
+                "outcome": outcome,
+                "last_error": error,
+                "processed_at": now,
+                "lag_seconds": lag
+            }}
+        )
+
+        if status == "done":
+            self.stats["processed"] += 1
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+        else:
+            self.stats["failed"] += 1
+
+        self.last_lag_seconds = lag
+        self.max_lag_seconds = max(self.max_lag_seconds, lag)
+        self.total_lag_seconds += lag
+
+    # ========================================
+    # MÉTRICAS
+    # ========================================
+
+    async def metrics(self) -> Dict[str, Any]:
+        """Vazão e atraso deste processo + tamanho atual da fila"""
+
+        uptime = time.monotonic() - self.started_at
+        finished = self.stats["processed"] + self.stats["failed"]
+
+        return {
+            **self.stats,
+            "outcomes": self.outcomes,
+            "throughput_per_second": round(finished / uptime, 3) if uptime > 0 else 0.0,
+            "lag_seconds": {
+                "last": round(self.last_lag_seconds, 3),
+                "avg": round(self.total_lag_seconds / finished, 3) if finished else 0.0,
+                "max": round(self.max_lag_seconds, 3)
+            },
+            "pending": await self.db.payment_webhook_inbox.count_documents({"status": {"$in": ["pending", "processing"]}})
+        }
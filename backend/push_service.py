@@ -3,9 +3,16 @@ Serviço de Push Notifications usando Web Push
 """
 
 from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from pywebpush import webpush, WebPushException
+from py_vapid import Vapid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+import threading
+import asyncio
 import json
+import time
 import os
 import logging
 
@@ -21,6 +28,60 @@ VAPID_CLAIMS = {
     "sub": "mailto:contato@fotivaapp.com"
 }
 
+# Validade do JWT VAPID e margem para renovar antes de expirar
+VAPID_TOKEN_TTL_SECONDS = int(os.getenv('VAPID_TOKEN_TTL_SECONDS', 12 * 60 * 60))
+VAPID_TOKEN_REFRESH_MARGIN_SECONDS = int(os.getenv('VAPID_TOKEN_REFRESH_MARGIN_SECONDS', 10 * 60))
+
+# webpush() é síncrono (criptografia + HTTP): roda neste pool, fora do event loop
+PUSH_WORKERS = int(os.getenv('PUSH_WORKERS', 16))
+PUSH_BATCH_MAX_ITEMS = int(os.getenv('PUSH_BATCH_MAX_ITEMS', 1000))
+
+push_executor = ThreadPoolExecutor(max_workers=PUSH_WORKERS, thread_name_prefix="webpush")
+
+
+def load_vapid_key() -> Optional[Vapid]:
+    """Faz o parse da chave privada VAPID uma única vez, na inicialização"""
+    
+    if not VAPID_PRIVATE_KEY:
+        return None
+    
+    try:
+        return Vapid.from_string(private_key=VAPID_PRIVATE_KEY)
+    except Exception as e:
+        logger.error(f"❌ VAPID_PRIVATE_KEY inválida: {e}")
+        return None
+
+
+vapid_key = load_vapid_key()
+
+# Origem do serviço de push (aud) -> (expiração do JWT, headers assinados)
+vapid_headers_cache: Dict[str, Tuple[int, Dict[str, str]]] = {}
+vapid_headers_lock = threading.Lock()
+
+
+def get_vapid_headers(endpoint: str) -> Dict[str, str]:
+    """
+    Headers VAPID para o endpoint. A assinatura é reaproveitada por origem
+    (FCM, Mozilla, Apple...) até pouco antes de o JWT expirar.
+    """
+    
+    url = urlparse(endpoint)
+    audience = f"{url.scheme}://{url.netloc}"
+    
+    cached = vapid_headers_cache.get(audience)
+    if cached and cached[0] - VAPID_TOKEN_REFRESH_MARGIN_SECONDS > time.time():
+        return dict(cached[1])
+    
+    with vapid_headers_lock:
+        cached = vapid_headers_cache.get(audience)
+        if not cached or cached[0] - VAPID_TOKEN_REFRESH_MARGIN_SECONDS <= time.time():
+            expires_at = int(time.time()) + VAPID_TOKEN_TTL_SECONDS
+            headers = vapid_key.sign({**VAPID_CLAIMS, "aud": audience, "exp": expires_at})
+            cached = (expires_at, headers)
+            vapid_headers_cache[audience] = cached
+    
+    return dict(cached[1])
+
 
 class PushSubscription(BaseModel):
     endpoint: str
@@ -32,26 +93,69 @@ class PushNotificationRequest(BaseModel):
     notification: dict
 
 
+class PushBatchRequest(BaseModel):
+    items: List[PushNotificationRequest] = Field(..., max_length=PUSH_BATCH_MAX_ITEMS)
+
+
+def send_webpush(subscription: PushSubscription, notification: dict):
+    """Envio síncrono de uma notificação (executado no push_executor)"""
+    
+    subscription_info = {
+        "endpoint": subscription.endpoint,
+        "keys": subscription.keys
+    }
+    
+    # Sem vapid_claims o webpush() não reassina: usa os headers já assinados
+    webpush(
+        subscription_info=subscription_info,
+        data=json.dumps(notification),
+        headers=get_vapid_headers(subscription.endpoint)
+    )
+
+
+async def run_webpush(subscription: PushSubscription, notification: dict):
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(push_executor, send_webpush, subscription, notification)
+
+
+def webpush_status_code(error: WebPushException):
+    # Response do requests com status 4xx/5xx é "falsy": comparar com None
+    return error.response.status_code if error.response is not None else None
+
+
+async def send_batch_item(index: int, item: PushNotificationRequest) -> dict:
+    """Envia um item do lote e devolve o resultado sem propagar exceções"""
+    
+    result = {"index": index, "endpoint": item.subscription.endpoint}
+    
+    try:
+        await run_webpush(item.subscription, item.notification)
+        result["status"] = "success"
+        
+    except WebPushException as e:
+        status_code = webpush_status_code(e)
+        result["status_code"] = status_code
+        # 404/410: subscription não existe mais no serviço de push
+        result["status"] = "expired" if status_code in (404, 410) else "error"
+        result["detail"] = str(e)
+        
+    except Exception as e:
+        result["status"] = "error"
+        result["detail"] = str(e)
+    
+    return result
+
+
 @app.post("/send-notification")
 async def send_push_notification(request: PushNotificationRequest):
     """Envia uma push notification para o dispositivo inscrito"""
     
-    if not VAPID_PRIVATE_KEY or not VAPID_PUBLIC_KEY:
+    if not vapid_key or not VAPID_PUBLIC_KEY:
         raise HTTPException(status_code=500, detail="VAPID keys não configuradas")
     
     try:
-        subscription_info = {
-            "endpoint": request.subscription.endpoint,
-            "keys": request.subscription.keys
-        }
-        
         # Enviar notificação
-        webpush(
-            subscription_info=subscription_info,
-            data=json.dumps(request.notification),
-            vapid_private_key=VAPID_PRIVATE_KEY,
-            vapid_claims=VAPID_CLAIMS
-        )
+        await run_webpush(request.subscription, request.notification)
         
         logger.info(f"✅ Push notification enviada com sucesso")
         return {"status": "success", "message": "Notificação enviada"}
@@ -60,12 +164,39 @@ async def send_push_notification(request: PushNotificationRequest):
         logger.error(f"❌ Erro ao enviar push: {e}")
         
         # Se a subscription expirou, retornar 410
-        if e.response and e.response.status_code == 410:
+        if webpush_status_code(e) == 410:
             raise HTTPException(status_code=410, detail="Subscription expirada")
         
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/send-batch")
+async def send_push_batch(request: PushBatchRequest):
+    """Envia várias notificações em paralelo e devolve o resultado de cada item"""
+    
+    if not vapid_key or not VAPID_PUBLIC_KEY:
+        raise HTTPException(status_code=500, detail="VAPID keys não configuradas")
+    
+    results = await asyncio.gather(*(
+        send_batch_item(index, item) for index, item in enumerate(request.items)
+    ))
+    
+    summary = {"success": 0, "expired": 0, "error": 0}
+    for result in results:
+        summary[result["status"]] += 1
+    
+    logger.info(
+        f"📦 Lote de push: {summary['success']} enviadas, "
+        f"{summary['expired']} expiradas, {summary['error']} com erro"
+    )
+    return {"results": results, **summary}
+
+
+@app.on_event("shutdown")
+async def shutdown_push_executor():
+    push_executor.shutdown(wait=False)
+
+
 @app.get("/vapid-public-key")
 async def get_vapid_public_key():
     """Retorna a chave pública VAPID para o frontend"""
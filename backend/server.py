@@ -1,19 +1,27 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, Response, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, ReturnDocument, UpdateOne
 import os
+import asyncio
+import time
+import json
+import base64
 import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional
+from typing import List, Literal, Optional
 import uuid
 from datetime import datetime, timezone, timedelta
 import bcrypt  # Usar bcrypt diretamente
 from jose import JWTError, jwt
 import random
 import string
+from dateutil.relativedelta import relativedelta
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -23,6 +31,31 @@ SECRET_KEY = os.environ['SECRET_KEY']
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
 
+# Pool dedicado para bcrypt (hash/verificação não podem travar o event loop)
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 2))
+PASSWORD_HASH_MAX_QUEUE = int(os.environ.get('PASSWORD_HASH_MAX_QUEUE', 32))
+
+# Cache de usuários autenticados (por processo)
+USER_CACHE_TTL_SECONDS = float(os.environ.get('USER_CACHE_TTL_SECONDS', 60))
+USER_CACHE_MAX_SIZE = int(os.environ.get('USER_CACHE_MAX_SIZE', 1000))
+
+# Criação automática dos índices do MongoDB ao iniciar
+ENSURE_INDEXES_ON_STARTUP = os.environ.get('ENSURE_INDEXES_ON_STARTUP', 'true').lower() == 'true'
+
+# Máximo de dispositivos com push por usuário (os mais antigos saem primeiro)
+MAX_PUSH_SUBSCRIPTIONS = int(os.environ.get('MAX_PUSH_SUBSCRIPTIONS', 10))
+
+# Paginação das listagens (cursor devolvido no header X-Next-Cursor)
+DEFAULT_PAGE_SIZE = int(os.environ.get('DEFAULT_PAGE_SIZE', 100))
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 1000))
+
+# E-mails com acesso às rotas administrativas (separados por vírgula; vazio = ninguém)
+ADMIN_EMAILS = {
+    email.strip().lower()
+    for email in os.environ.get('ADMIN_EMAILS', '').split(',')
+    if email.strip()
+}
+
 # Usar bcrypt diretamente (sem passlib)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
@@ -51,7 +84,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS"],
     allow_headers=["*"],
-    expose_headers=["*"],
+    expose_headers=["*", "X-Next-Cursor"],  # "*" não vale em requisições com credenciais
     max_age=3600,
 )
 
@@ -67,7 +100,8 @@ class User(BaseModel):
     name: str
     brand_name: Optional[str] = None
     profile_photo: Optional[str] = None
-    push_subscription: Optional[dict] = None
+    push_subscription: Optional[dict] = None  # formato antigo (um único dispositivo)
+    push_subscriptions: List[dict] = []  # um item por dispositivo, único por endpoint
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class UserCreate(BaseModel):
@@ -143,6 +177,17 @@ class PaymentCreate(BaseModel):
     amount: float
     due_date: str
 
+class InstallmentSchedule(BaseModel):
+    count: int = Field(..., ge=1, le=120)
+    first_due_date: str  # formato: 2025-02-06
+    interval_months: int = Field(1, ge=0)
+    interval_days: int = Field(0, ge=0)
+    down_payment: float = Field(0, ge=0)
+    amount: Optional[float] = Field(None, gt=0)  # valor fixo por parcela (padrão: divide total - entrada)
+
+class BulkPayRequest(BaseModel):
+    payment_ids: List[str] = Field(..., min_length=1, max_length=500)
+
 class Gallery(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -203,6 +248,71 @@ class MercadoPagoWebhook(BaseModel):
     user_id: str
 
 
+# ============== DATABASE INDEXES ==============
+
+# (coleção, chaves, opções) - o nome explícito permite relatar o que foi criado
+REQUIRED_INDEXES = [
+    ("users", [("email", ASCENDING)], {"name": "users_email_unique", "unique": True}),
+    ("users", [("id", ASCENDING)], {"name": "users_id_unique", "unique": True}),
+    ("clients", [("id", ASCENDING)], {"name": "clients_id"}),
+    ("clients", [("user_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], {"name": "clients_user_created_at"}),
+    ("clients", [("user_id", ASCENDING), ("name", ASCENDING), ("id", ASCENDING)], {"name": "clients_user_name"}),
+    ("events", [("id", ASCENDING)], {"name": "events_id"}),
+    ("events", [("user_id", ASCENDING), ("event_date", ASCENDING), ("id", ASCENDING)], {"name": "events_user_event_date"}),
+    ("events", [("user_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], {"name": "events_user_created_at"}),
+    ("events", [("event_date", ASCENDING)], {"name": "events_event_date"}),
+    ("payments", [("id", ASCENDING)], {"name": "payments_id"}),
+    ("payments", [("event_id", ASCENDING), ("paid", ASCENDING)], {"name": "payments_event_paid"}),
+    ("payments", [("user_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], {"name": "payments_user_created_at"}),
+    ("payments", [("user_id", ASCENDING), ("due_date", ASCENDING), ("id", ASCENDING)], {"name": "payments_user_due_date"}),
+    ("galleries", [("user_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], {"name": "galleries_user_created_at"}),
+    ("galleries", [("user_id", ASCENDING), ("name", ASCENDING), ("id", ASCENDING)], {"name": "galleries_user_name"}),
+    ("user_stats", [("user_id", ASCENDING)], {"name": "user_stats_user_id_unique", "unique": True}),
+    ("notification_deliveries", [("event_id", ASCENDING), ("reminder_type", ASCENDING)], {"name": "notification_deliveries_event_reminder_unique", "unique": True}),
+    ("password_resets", [("email", ASCENDING)], {"name": "password_resets_email_unique", "unique": True}),
+    ("password_resets", [("expires_at", ASCENDING)], {"name": "password_resets_expires_at_ttl", "expireAfterSeconds": 0}),
+]
+
+async def ensure_indexes() -> dict:
+    """
+    Garante que todos os índices de REQUIRED_INDEXES existem.
+    
+    Returns:
+        Dict com listas "created", "existing" e "failed" (coleção.nome)
+    """
+    report = {"created": [], "existing": [], "failed": []}
+    existing_by_collection = {}
+    
+    for collection_name, keys, options in REQUIRED_INDEXES:
+        collection = db[collection_name]
+        index_name = f"{collection_name}.{options['name']}"
+        
+        if collection_name not in existing_by_collection:
+            existing_by_collection[collection_name] = await collection.index_information()
+        
+        if options["name"] in existing_by_collection[collection_name]:
+            report["existing"].append(index_name)
+            continue
+        
+        try:
+            await collection.create_index(keys, **options)
+            report["created"].append(index_name)
+            print(f"✅ Índice criado: {index_name}")
+        except Exception as e:
+            # Ex.: emails duplicados impedem o índice único - não derruba o servidor
+            report["failed"].append(index_name)
+            print(f"❌ Erro ao criar índice {index_name}: {e}")
+    
+    return report
+
+def as_utc(value) -> datetime:
+    """Converte string ISO ou datetime (naive = UTC, como o Mongo devolve) para datetime UTC"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
 # ============== AUTH FUNCTIONS ==============
 
 def verify_password(plain_password, hashed_password):
@@ -235,6 +345,120 @@ def get_password_hash(password):
         print(f"❌ Erro ao criar hash de senha: {e}")
         raise HTTPException(status_code=500, detail="Erro ao processar senha")
 
+# ============== PASSWORD HASH POOL ==============
+
+password_hash_executor = ThreadPoolExecutor(
+    max_workers=PASSWORD_HASH_WORKERS,
+    thread_name_prefix="password-hash"
+)
+
+# Quantidade de operações no pool (executando + aguardando na fila)
+password_hash_in_flight = 0
+
+password_hash_metrics = {
+    "completed": 0,
+    "rejected": 0,
+    "queue_wait_seconds_total": 0.0,
+    "queue_wait_seconds_max": 0.0,
+    "hash_seconds_total": 0.0,
+    "hash_seconds_max": 0.0,
+}
+
+async def run_password_hash(func, *args):
+    """
+    Executa verify_password/get_password_hash no pool dedicado.
+    Retorna 503 quando o pool e a fila estão cheios (back-pressure).
+    """
+    global password_hash_in_flight
+
+    if password_hash_in_flight >= PASSWORD_HASH_WORKERS + PASSWORD_HASH_MAX_QUEUE:
+        password_hash_metrics["rejected"] += 1
+        raise HTTPException(
+            status_code=503,
+            detail="Servidor ocupado. Tente novamente em alguns segundos.",
+            headers={"Retry-After": "1"}
+        )
+
+    submitted_at = time.perf_counter()
+
+    def timed_call():
+        started_at = time.perf_counter()
+        result = func(*args)
+        return result, started_at - submitted_at, time.perf_counter() - started_at
+
+    password_hash_in_flight += 1
+    try:
+        loop = asyncio.get_running_loop()
+        result, queue_wait, hash_time = await loop.run_in_executor(password_hash_executor, timed_call)
+    finally:
+        password_hash_in_flight -= 1
+
+    password_hash_metrics["completed"] += 1
+    password_hash_metrics["queue_wait_seconds_total"] += queue_wait
+    password_hash_metrics["queue_wait_seconds_max"] = max(password_hash_metrics["queue_wait_seconds_max"], queue_wait)
+    password_hash_metrics["hash_seconds_total"] += hash_time
+    password_hash_metrics["hash_seconds_max"] = max(password_hash_metrics["hash_seconds_max"], hash_time)
+
+    return result
+
+# ============== USER CACHE ==============
+
+class UserCache:
+    """Cache TTL + LRU de usuários autenticados, indexado pelo 'sub' do token (email)"""
+
+    def __init__(self, ttl_seconds: float, max_size: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, email: str) -> Optional[User]:
+        entry = self._entries.get(email)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, user = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[email]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(email)
+        self.hits += 1
+        return user
+
+    def set(self, email: str, user: User):
+        if self.ttl_seconds <= 0 or self.max_size <= 0:
+            return
+
+        self._entries[email] = (time.monotonic() + self.ttl_seconds, user)
+        self._entries.move_to_end(email)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, email: str):
+        if self._entries.pop(email, None) is not None:
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+user_cache = UserCache(USER_CACHE_TTL_SECONDS, USER_CACHE_MAX_SIZE)
+
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -256,6 +480,10 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     except JWTError:
         raise credentials_exception
     
+    cached_user = user_cache.get(email)
+    if cached_user is not None:
+        return cached_user
+    
     user_doc = await db.users.find_one({"email": email}, {"_id": 0})
     if user_doc is None:
         raise credentials_exception
@@ -263,7 +491,129 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     if isinstance(user_doc.get('created_at'), str):
         user_doc['created_at'] = datetime.fromisoformat(user_doc['created_at'])
     
-    return User(**user_doc)
+    user = User(**user_doc)
+    user_cache.set(email, user)
+    return user
+
+async def get_admin_user(current_user: User = Depends(get_current_user)):
+    """Como get_current_user, mas só para e-mails em ADMIN_EMAILS"""
+    if current_user.email.lower() not in ADMIN_EMAILS:
+        raise HTTPException(status_code=403, detail="Apenas administradores")
+    return current_user
+
+# ============== PAGINATION ==============
+
+SortOrder = Literal["asc", "desc"]
+
+def encode_cursor(sort_field: str, value, doc_id: str) -> str:
+    """Cursor opaco com a posição do último item da página"""
+    raw = json.dumps([sort_field, value, doc_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip("=")
+
+def decode_cursor(cursor: str, sort_field: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        field, value, doc_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    
+    if field != sort_field:
+        raise HTTPException(status_code=400, detail="Cursor não corresponde à ordenação solicitada")
+    
+    return value, doc_id
+
+async def paginate(
+    collection,
+    query: dict,
+    response: Response,
+    sort_field: str = "created_at",
+    order: SortOrder = "asc",
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None
+) -> List[dict]:
+    """
+    Paginação por keyset em (sort_field, id).
+    Se houver mais itens, o cursor da próxima página vai no header X-Next-Cursor.
+    """
+    page_size = min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+    direction = ASCENDING if order == "asc" else DESCENDING
+    op = "$gt" if order == "asc" else "$lt"
+    
+    if cursor:
+        value, last_id = decode_cursor(cursor, sort_field)
+        query = {
+            "$and": [
+                query,
+                {"$or": [
+                    {sort_field: {op: value}},
+                    {sort_field: value, "id": {op: last_id}}
+                ]}
+            ]
+        }
+    
+    docs = await collection.find(query, {"_id": 0}).sort(
+        [(sort_field, direction), ("id", direction)]
+    ).limit(page_size + 1).to_list(page_size + 1)
+    
+    if len(docs) > page_size:
+        docs = docs[:page_size]
+        last = docs[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(sort_field, last.get(sort_field), last["id"])
+    
+    return docs
+
+# ============== USER STATS ==============
+
+async def increment_user_stats(user_id: str, **deltas):
+    """
+    Aplica $inc nos contadores do dashboard (user_stats).
+    Sem upsert: se o documento não existir ele é reconstruído na próxima leitura.
+    """
+    deltas = {field: value for field, value in deltas.items() if value}
+    if not deltas:
+        return
+    
+    await db.user_stats.update_one(
+        {"user_id": user_id},
+        {"$inc": deltas, "$set": {"updated_at": datetime.now(timezone.utc)}}
+    )
+
+async def rebuild_user_stats(user_id: str) -> dict:
+    """Recalcula do zero os contadores do dashboard de um usuário"""
+    user_filter = {"user_id": user_id}
+    
+    total_clients = await db.clients.count_documents(user_filter)
+    
+    totals = await db.events.aggregate([
+        {"$match": user_filter},
+        {"$group": {
+            "_id": None,
+            "total_events": {"$sum": 1},
+            "total_revenue": {"$sum": {"$ifNull": ["$amount_paid", 0]}},
+            "total_value": {"$sum": {"$ifNull": ["$total_value", 0]}}
+        }}
+    ]).to_list(1)
+    totals = totals[0] if totals else {"total_events": 0, "total_revenue": 0, "total_value": 0}
+    
+    stats = {
+        "user_id": user_id,
+        "total_clients": total_clients,
+        "total_events": totals["total_events"],
+        "total_revenue": totals["total_revenue"],
+        "total_value": totals["total_value"],
+        "updated_at": datetime.now(timezone.utc)
+    }
+    
+    await db.user_stats.update_one({"user_id": user_id}, {"$set": stats}, upsert=True)
+    return stats
+
+async def rebuild_all_user_stats() -> int:
+    """Job de reconciliação: reconstrói user_stats de todos os usuários"""
+    rebuilt = 0
+    async for user_doc in db.users.find({}, {"_id": 0, "id": 1}):
+        await rebuild_user_stats(user_doc["id"])
+        rebuilt += 1
+    return rebuilt
 
 # ============== AUTH ROUTES ==============
 
@@ -280,7 +630,7 @@ async def register(user_data: UserCreate):
     )
     
     user_dict = user.model_dump()
-    user_dict['password_hash'] = get_password_hash(user_data.password)
+    user_dict['password_hash'] = await run_password_hash(get_password_hash, user_data.password)
     user_dict['created_at'] = user_dict['created_at'].isoformat()
     
     await db.users.insert_one(user_dict)
@@ -295,7 +645,7 @@ async def login(user_data: UserLogin):
     if not user_doc:
         raise HTTPException(status_code=401, detail="Email ou senha incorretos")
     
-    if not verify_password(user_data.password, user_doc['password_hash']):
+    if not await run_password_hash(verify_password, user_data.password, user_doc['password_hash']):
         raise HTTPException(status_code=401, detail="Email ou senha incorretos")
     
     if isinstance(user_doc['created_at'], str):
@@ -312,20 +662,50 @@ async def get_me(current_user: User = Depends(get_current_user)):
 
 @api_router.post("/auth/push-subscription")
 async def save_push_subscription(subscription: dict, current_user: User = Depends(get_current_user)):
-    """Salva a subscription de push notifications do usuário"""
-    await db.users.update_one(
-        {"id": current_user.id},
-        {"$set": {"push_subscription": subscription}}
+    """Salva a subscription de push notifications do dispositivo (uma por endpoint)"""
+    # O frontend envia {"subscription": {...}}
+    subscription = subscription.get("subscription", subscription)
+    endpoint = subscription.get("endpoint")
+    if not endpoint:
+        raise HTTPException(status_code=400, detail="Subscription sem endpoint")
+    
+    # Mesmo endpoint: atualiza as chaves no lugar
+    result = await db.users.update_one(
+        {"id": current_user.id, "push_subscriptions.endpoint": endpoint},
+        {"$set": {"push_subscriptions.$": subscription}}
     )
+    
+    # Endpoint novo: adiciona (o filtro $ne evita duplicata em chamadas simultâneas)
+    if result.matched_count == 0:
+        await db.users.update_one(
+            {"id": current_user.id, "push_subscriptions.endpoint": {"$ne": endpoint}},
+            {"$push": {"push_subscriptions": {"$each": [subscription], "$slice": -MAX_PUSH_SUBSCRIPTIONS}}}
+        )
+    
+    user_cache.invalidate(current_user.email)
     return {"message": "Subscription salva com sucesso"}
 
 @api_router.delete("/auth/push-subscription")
-async def delete_push_subscription(current_user: User = Depends(get_current_user)):
-    """Remove a subscription de push notifications"""
-    await db.users.update_one(
-        {"id": current_user.id},
-        {"$unset": {"push_subscription": ""}}
-    )
+async def delete_push_subscription(endpoint: Optional[str] = None, current_user: User = Depends(get_current_user)):
+    """Remove a subscription de um dispositivo (?endpoint=...) ou de todos"""
+    if endpoint:
+        await db.users.update_one(
+            {"id": current_user.id},
+            {"$pull": {"push_subscriptions": {"endpoint": endpoint}}}
+        )
+        await db.users.update_one(
+            {"id": current_user.id, "$or": [
+                {"push_subscription.endpoint": endpoint},
+                {"push_subscription.subscription.endpoint": endpoint}
+            ]},
+            {"$unset": {"push_subscription": ""}}
+        )
+    else:
+        await db.users.update_one(
+            {"id": current_user.id},
+            {"$unset": {"push_subscription": ""}, "$set": {"push_subscriptions": []}}
+        )
+    user_cache.invalidate(current_user.email)
     return {"message": "Subscription removida com sucesso"}
 
 # ============== PASSWORD RECOVERY ROUTES ==============
@@ -350,7 +730,7 @@ async def forgot_password(request: ForgotPasswordRequest):
         {
             "$set": {
                 "code": reset_code,
-                "expires_at": expires_at.isoformat(),
+                "expires_at": expires_at,  # datetime nativo para o índice TTL
                 "used": False
             }
         },
@@ -386,7 +766,7 @@ async def verify_reset_code(request: VerifyResetCodeRequest):
         raise HTTPException(status_code=400, detail="Este código já foi utilizado")
     
     # Verificar se o código expirou
-    expires_at = datetime.fromisoformat(reset_doc['expires_at'])
+    expires_at = as_utc(reset_doc['expires_at'])
     if datetime.now(timezone.utc) > expires_at:
         raise HTTPException(status_code=400, detail="Código expirado. Solicite um novo código.")
     
@@ -404,16 +784,17 @@ async def reset_password(request: ResetPasswordRequest):
         raise HTTPException(status_code=400, detail="Código inválido")
     
     # Verificar expiração
-    expires_at = datetime.fromisoformat(reset_doc['expires_at'])
+    expires_at = as_utc(reset_doc['expires_at'])
     if datetime.now(timezone.utc) > expires_at:
         raise HTTPException(status_code=400, detail="Código expirado")
     
     # Atualizar senha do usuário
-    new_password_hash = get_password_hash(request.new_password)
+    new_password_hash = await run_password_hash(get_password_hash, request.new_password)
     await db.users.update_one(
         {"email": request.email},
         {"$set": {"password_hash": new_password_hash}}
     )
+    user_cache.invalidate(request.email)
     
     # Marcar código como usado
     await db.password_resets.update_one(
@@ -433,11 +814,19 @@ async def create_client(client_data: ClientCreate, current_user: User = Depends(
     doc = client.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
     await db.clients.insert_one(doc)
+    await increment_user_stats(current_user.id, total_clients=1)
     return client
 
 @api_router.get("/clients", response_model=List[Client])
-async def get_clients(current_user: User = Depends(get_current_user)):
-    clients = await db.clients.find({"user_id": current_user.id}, {"_id": 0}).to_list(1000)
+async def get_clients(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1),
+    cursor: Optional[str] = None,
+    sort: Literal["created_at", "name"] = "created_at",
+    order: SortOrder = "asc",
+    current_user: User = Depends(get_current_user)
+):
+    clients = await paginate(db.clients, {"user_id": current_user.id}, response, sort, order, limit, cursor)
     for client in clients:
         if isinstance(client['created_at'], str):
             client['created_at'] = datetime.fromisoformat(client['created_at'])
@@ -457,6 +846,7 @@ async def delete_client(client_id: str, current_user: User = Depends(get_current
     result = await db.clients.delete_one({"id": client_id, "user_id": current_user.id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Cliente não encontrado")
+    await increment_user_stats(current_user.id, total_clients=-1)
     return {"message": "Cliente deletado com sucesso"}
 
 # ============== EVENT ROUTES ==============
@@ -469,12 +859,25 @@ async def create_event(event_data: EventCreate, current_user: User = Depends(get
     doc['created_at'] = doc['created_at'].isoformat()
     print(f"✅ Documento a ser inserido: {doc}")  # Debug log
     await db.events.insert_one(doc)
+    await increment_user_stats(
+        current_user.id,
+        total_events=1,
+        total_revenue=event.amount_paid,
+        total_value=event.total_value
+    )
     print(f"✅ Evento criado com sucesso: {event.id}")  # Debug log
     return event
 
 @api_router.get("/events", response_model=List[Event])
-async def get_events(current_user: User = Depends(get_current_user)):
-    events = await db.events.find({"user_id": current_user.id}, {"_id": 0}).to_list(1000)
+async def get_events(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1),
+    cursor: Optional[str] = None,
+    sort: Literal["created_at", "event_date"] = "created_at",
+    order: SortOrder = "asc",
+    current_user: User = Depends(get_current_user)
+):
+    events = await paginate(db.events, {"user_id": current_user.id}, response, sort, order, limit, cursor)
     for event in events:
         if isinstance(event['created_at'], str):
             event['created_at'] = datetime.fromisoformat(event['created_at'])
@@ -491,19 +894,35 @@ async def get_event(event_id: str, current_user: User = Depends(get_current_user
 
 @api_router.put("/events/{event_id}", response_model=Event)
 async def update_event(event_id: str, event_data: EventCreate, current_user: User = Depends(get_current_user)):
-    result = await db.events.update_one(
+    previous = await db.events.find_one_and_update(
         {"id": event_id, "user_id": current_user.id},
-        {"$set": event_data.model_dump()}
+        {"$set": event_data.model_dump()},
+        projection={"_id": 0, "amount_paid": 1, "total_value": 1},
+        return_document=ReturnDocument.BEFORE
     )
-    if result.matched_count == 0:
+    if previous is None:
         raise HTTPException(status_code=404, detail="Evento não encontrado")
+    await increment_user_stats(
+        current_user.id,
+        total_revenue=event_data.amount_paid - previous.get('amount_paid', 0),
+        total_value=event_data.total_value - previous.get('total_value', 0)
+    )
     return await get_event(event_id, current_user)
 
 @api_router.delete("/events/{event_id}")
 async def delete_event(event_id: str, current_user: User = Depends(get_current_user)):
-    result = await db.events.delete_one({"id": event_id, "user_id": current_user.id})
-    if result.deleted_count == 0:
+    deleted = await db.events.find_one_and_delete(
+        {"id": event_id, "user_id": current_user.id},
+        projection={"_id": 0, "amount_paid": 1, "total_value": 1}
+    )
+    if deleted is None:
         raise HTTPException(status_code=404, detail="Evento não encontrado")
+    await increment_user_stats(
+        current_user.id,
+        total_events=-1,
+        total_revenue=-deleted.get('amount_paid', 0),
+        total_value=-deleted.get('total_value', 0)
+    )
     return {"message": "Evento deletado com sucesso"}
 
 # ============== PAYMENT ROUTES ==============
@@ -516,9 +935,68 @@ async def create_payment(payment_data: PaymentCreate, current_user: User = Depen
     await db.payments.insert_one(doc)
     return payment
 
+@api_router.post("/events/{event_id}/installments", response_model=List[Payment])
+async def create_installments(event_id: str, schedule: InstallmentSchedule, current_user: User = Depends(get_current_user)):
+    """Gera todas as parcelas de um evento com um único insert_many"""
+    event = await db.events.find_one(
+        {"id": event_id, "user_id": current_user.id},
+        {"_id": 0, "total_value": 1}
+    )
+    if not event:
+        raise HTTPException(status_code=404, detail="Evento não encontrado")
+    
+    if schedule.down_payment > event.get('total_value', 0):
+        raise HTTPException(status_code=400, detail="A entrada não pode ser maior que o valor total do evento")
+    
+    if schedule.interval_months == 0 and schedule.interval_days == 0 and schedule.count > 1:
+        raise HTTPException(status_code=400, detail="Informe o intervalo entre as parcelas")
+    
+    try:
+        first_due_date = datetime.strptime(schedule.first_due_date, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Data da primeira parcela inválida (use AAAA-MM-DD)")
+    
+    if schedule.amount is not None:
+        amounts = [schedule.amount] * schedule.count
+    else:
+        remaining = event.get('total_value', 0) - schedule.down_payment
+        base_amount = round(remaining / schedule.count, 2)
+        # A última parcela absorve a diferença de arredondamento
+        amounts = [base_amount] * (schedule.count - 1) + [round(remaining - base_amount * (schedule.count - 1), 2)]
+    
+    payments = []
+    for i, amount in enumerate(amounts):
+        due_date = first_due_date + relativedelta(
+            months=schedule.interval_months * i,
+            days=schedule.interval_days * i
+        )
+        payments.append(Payment(
+            user_id=current_user.id,
+            event_id=event_id,
+            installment_number=i + 1,
+            amount=amount,
+            due_date=due_date.strftime("%Y-%m-%d")
+        ))
+    
+    docs = []
+    for payment in payments:
+        doc = payment.model_dump()
+        doc['created_at'] = doc['created_at'].isoformat()
+        docs.append(doc)
+    
+    await db.payments.insert_many(docs, ordered=True)
+    return payments
+
 @api_router.get("/payments", response_model=List[Payment])
-async def get_payments(current_user: User = Depends(get_current_user)):
-    payments = await db.payments.find({"user_id": current_user.id}, {"_id": 0}).to_list(1000)
+async def get_payments(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1),
+    cursor: Optional[str] = None,
+    sort: Literal["created_at", "due_date"] = "created_at",
+    order: SortOrder = "asc",
+    current_user: User = Depends(get_current_user)
+):
+    payments = await paginate(db.payments, {"user_id": current_user.id}, response, sort, order, limit, cursor)
     for payment in payments:
         if isinstance(payment['created_at'], str):
             payment['created_at'] = datetime.fromisoformat(payment['created_at'])
@@ -533,20 +1011,74 @@ async def get_payment(payment_id: str, current_user: User = Depends(get_current_
         payment['created_at'] = datetime.fromisoformat(payment['created_at'])
     return Payment(**payment)
 
+@api_router.patch("/payments/pay")
+async def pay_payments(request: BulkPayRequest, current_user: User = Depends(get_current_user)):
+    """Marca várias parcelas como pagas de uma vez (conciliação em lote)"""
+    payment_ids = list(dict.fromkeys(request.payment_ids))
+    batch_id = str(uuid.uuid4())
+    
+    # Transição condicional: só as parcelas ainda não pagas recebem o batch_id
+    await db.payments.update_many(
+        {"id": {"$in": payment_ids}, "user_id": current_user.id, "paid": False},
+        {"$set": {
+            "paid": True,
+            "paid_date": datetime.now(timezone.utc).strftime("%Y-%m-%d"),
+            "paid_batch_id": batch_id
+        }}
+    )
+    
+    claimed = await db.payments.find(
+        {"id": {"$in": payment_ids}, "user_id": current_user.id, "paid_batch_id": batch_id},
+        {"_id": 0, "id": 1, "event_id": 1, "amount": 1}
+    ).to_list(len(payment_ids))
+    
+    paid_by_event = {}
+    for payment in claimed:
+        paid_by_event[payment['event_id']] = paid_by_event.get(payment['event_id'], 0) + payment['amount']
+    
+    if paid_by_event:
+        # Parcelas de eventos já excluídos não entram na receita (rebuild_user_stats não as vê)
+        existing_events = await db.events.distinct(
+            "id", {"id": {"$in": list(paid_by_event)}, "user_id": current_user.id}
+        )
+        paid_by_event = {event_id: amount for event_id, amount in paid_by_event.items() if event_id in existing_events}
+    
+    if paid_by_event:
+        await db.events.bulk_write([
+            UpdateOne({"id": event_id, "user_id": current_user.id}, {"$inc": {"amount_paid": amount}})
+            for event_id, amount in paid_by_event.items()
+        ], ordered=False)
+        await increment_user_stats(current_user.id, total_revenue=sum(paid_by_event.values()))
+    
+    paid_ids = {payment['id'] for payment in claimed}
+    
+    return {
+        "message": f"{len(paid_ids)} pagamento(s) marcado(s) como pago(s)",
+        "paid": [payment_id for payment_id in payment_ids if payment_id in paid_ids],
+        "skipped": [payment_id for payment_id in payment_ids if payment_id not in paid_ids]
+    }
+
 @api_router.patch("/payments/{payment_id}/pay")
 async def pay_payment(payment_id: str, current_user: User = Depends(get_current_user)):
-    result = await db.payments.update_one(
-        {"id": payment_id, "user_id": current_user.id},
-        {"$set": {"paid": True, "paid_date": datetime.now(timezone.utc).strftime("%Y-%m-%d")}}
+    # Transição atômica unpaid -> paid; só quem fez a transição soma no evento
+    payment = await db.payments.find_one_and_update(
+        {"id": payment_id, "user_id": current_user.id, "paid": False},
+        {"$set": {"paid": True, "paid_date": datetime.now(timezone.utc).strftime("%Y-%m-%d")}},
+        projection={"_id": 0, "event_id": 1, "amount": 1}
     )
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Pagamento não encontrado")
+    if payment is None:
+        exists = await db.payments.count_documents({"id": payment_id, "user_id": current_user.id}, limit=1)
+        if not exists:
+            raise HTTPException(status_code=404, detail="Pagamento não encontrado")
+        return {"message": "Pagamento já estava marcado como pago"}
     
-    # Update event amount_paid
-    payment = await db.payments.find_one({"id": payment_id}, {"_id": 0})
-    event_payments = await db.payments.find({"event_id": payment['event_id'], "paid": True}, {"_id": 0}).to_list(1000)
-    total_paid = sum(p['amount'] for p in event_payments)
-    await db.events.update_one({"id": payment['event_id']}, {"$set": {"amount_paid": total_paid}})
+    result = await db.events.update_one(
+        {"id": payment['event_id'], "user_id": current_user.id},
+        {"$inc": {"amount_paid": payment['amount']}}
+    )
+    # Evento já excluído: a parcela fica paga, mas não entra na receita
+    if result.matched_count:
+        await increment_user_stats(current_user.id, total_revenue=payment['amount'])
     
     return {"message": "Pagamento marcado como pago"}
 
@@ -568,8 +1100,15 @@ async def create_gallery(gallery_data: GalleryCreate, current_user: User = Depen
     return gallery
 
 @api_router.get("/galleries", response_model=List[Gallery])
-async def get_galleries(current_user: User = Depends(get_current_user)):
-    galleries = await db.galleries.find({"user_id": current_user.id}, {"_id": 0}).to_list(1000)
+async def get_galleries(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1),
+    cursor: Optional[str] = None,
+    sort: Literal["created_at", "name"] = "created_at",
+    order: SortOrder = "asc",
+    current_user: User = Depends(get_current_user)
+):
+    galleries = await paginate(db.galleries, {"user_id": current_user.id}, response, sort, order, limit, cursor)
     for gallery in galleries:
         if isinstance(gallery['created_at'], str):
             gallery['created_at'] = datetime.fromisoformat(gallery['created_at'])
@@ -579,33 +1118,52 @@ async def get_galleries(current_user: User = Depends(get_current_user)):
 
 @api_router.get("/dashboard/stats", response_model=DashboardStats)
 async def get_dashboard_stats(current_user: User = Depends(get_current_user)):
-    clients = await db.clients.find({"user_id": current_user.id}, {"_id": 0}).to_list(1000)
-    events = await db.events.find({"user_id": current_user.id}, {"_id": 0}).to_list(1000)
+    # Contadores materializados (mantidos com $inc nas rotas de escrita)
+    stats = await db.user_stats.find_one({"user_id": current_user.id}, {"_id": 0})
+    if stats is None:
+        stats = await rebuild_user_stats(current_user.id)
     
-    # Calcular receita usando amount_paid dos eventos (não payments collection)
-    total_revenue = sum(e.get('amount_paid', 0) for e in events)
+    # Receita = amount_paid dos eventos; pendente = total_value - amount_paid
+    total_revenue = stats["total_revenue"]
+    pending_payments = stats["total_value"] - total_revenue
     
-    # Calcular pagamentos pendentes (total_value - amount_paid)
-    pending_payments = sum(e.get('total_value', 0) - e.get('amount_paid', 0) for e in events)
-    
-    # Get upcoming events (next 5)
-    upcoming = sorted(
-        [e for e in events if e['status'] in ['confirmado', 'pendente']],
-        key=lambda x: x['event_date']
-    )[:5]
+    # Próximos 5 eventos (índice events_user_event_date)
+    now_str = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+    upcoming = await db.events.find(
+        {"user_id": current_user.id, "event_date": {"$gte": now_str}, "status": {"$in": ["confirmado", "pendente"]}},
+        {"_id": 0}
+    ).sort("event_date", ASCENDING).limit(5).to_list(5)
     
     for event in upcoming:
         if isinstance(event['created_at'], str):
             event['created_at'] = datetime.fromisoformat(event['created_at'])
     
     return DashboardStats(
-        total_clients=len(clients),
-        total_events=len(events),
+        total_clients=stats["total_clients"],
+        total_events=stats["total_events"],
         total_revenue=total_revenue,
         pending_payments=pending_payments,
         upcoming_events=upcoming
     )
 
+# ============== METRICS ROUTES ==============
+
+@api_router.get("/metrics")
+async def get_metrics(admin_user: User = Depends(get_admin_user)):
+    """Métricas internas do processo (pool de senhas, cache de usuários) - apenas admin"""
+    completed = password_hash_metrics["completed"]
+    return {
+        "password_hash": {
+            **password_hash_metrics,
+            "workers": PASSWORD_HASH_WORKERS,
+            "max_queue": PASSWORD_HASH_MAX_QUEUE,
+            "in_flight": password_hash_in_flight,
+            "queue_wait_seconds_avg": password_hash_metrics["queue_wait_seconds_total"] / completed if completed else 0.0,
+            "hash_seconds_avg": password_hash_metrics["hash_seconds_total"] / completed if completed else 0.0,
+        },
+        "user_cache": user_cache.stats(),
+    }
+
 # ============== INCLUDE ROUTER - DEVE SER DEPOIS DO CORS! ==============
 app.include_router(api_router)
 
@@ -616,8 +1174,51 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# ============== LIFECYCLE ==============
+
+@app.on_event("startup")
+async def startup_ensure_indexes():
+    if not ENSURE_INDEXES_ON_STARTUP:
+        return
+    
+    report = await ensure_indexes()
+    print(
+        f"🗂️ Índices: {len(report['created'])} criados, "
+        f"{len(report['existing'])} existentes, {len(report['failed'])} com erro"
+    )
+
+@app.on_event("shutdown")
+async def shutdown_password_hash_pool():
+    password_hash_executor.shutdown(wait=False)
+
 # ============== RUN SERVER ==============
 if __name__ == "__main__":
+    import argparse
+    import sys
+    
+    parser = argparse.ArgumentParser(description="Fotiva backend")
+    parser.add_argument(
+        "--ensure-indexes",
+        action="store_true",
+        help="Cria os índices do MongoDB e encerra (rodar antes do deploy)"
+    )
+    parser.add_argument(
+        "--rebuild-stats",
+        action="store_true",
+        help="Reconstrói os contadores do dashboard (user_stats) de todos os usuários e encerra"
+    )
+    args = parser.parse_args()
+    
+    if args.ensure_indexes:
+        report = asyncio.run(ensure_indexes())
+        print(json.dumps(report, indent=2))
+        sys.exit(1 if report["failed"] else 0)
+    
+    if args.rebuild_stats:
+        rebuilt = asyncio.run(rebuild_all_user_stats())
+        print(f"✅ user_stats reconstruído para {rebuilt} usuários")
+        sys.exit(0)
+    
     import uvicorn
     port = int(os.environ.get("PORT", 10000))
     uvicorn.run(app, host="0.0.0.0", port=port)
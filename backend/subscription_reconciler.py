@@ -0,0 +1,234 @@
+"""
+Reconciliação das assinaturas com o Mercado Pago - Fotiva
+Corrige o status local quando um webhook se perdeu (renovação ou cancelamento)
+"""
+
+import os
+import time
+import asyncio
+import argparse
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Optional
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, UpdateOne
+
+load_dotenv(Path(__file__).parent / '.env')
+
+# Importados depois do .env: leem a configuração do ambiente ao carregar
+from mercadopago_service import MercadoPagoService
+from subscription_service import parse_datetime
+
+# Intervalo entre rodadas completas (segundos)
+RECONCILE_INTERVAL_SECONDS = int(os.getenv('RECONCILE_INTERVAL_SECONDS', 60 * 60))
+
+# Assinaturas lidas por página (keyset por _id)
+RECONCILE_PAGE_SIZE = int(os.getenv('RECONCILE_PAGE_SIZE', 500))
+
+# Consultas simultâneas ao Mercado Pago e limite de requisições por segundo
+RECONCILE_CONCURRENCY = int(os.getenv('RECONCILE_CONCURRENCY', 10))
+RECONCILE_RATE_PER_SECOND = float(os.getenv('RECONCILE_RATE_PER_SECOND', 20))
+
+
+def parse_remote_date(value: Optional[str]) -> Optional[datetime]:
+    """Datas do Mercado Pago vêm com fuso; as nossas são locais sem fuso"""
+
+    if not value:
+        return None
+
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+
+class RateLimiter:
+    """Espaça as chamadas para no máximo `rate` por segundo"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_slot = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+
+        async with self.lock:
+            now = time.monotonic()
+            delay = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class SubscriptionReconciler:
+    """Compara as assinaturas locais com as preapprovals do Mercado Pago"""
+
+    def __init__(self, db=None, mp_service: Optional[MercadoPagoService] = None):
+        self.mp_service = mp_service or MercadoPagoService()
+        self.semaphore = asyncio.Semaphore(RECONCILE_CONCURRENCY)
+        self.rate_limiter = RateLimiter(RECONCILE_RATE_PER_SECOND)
+
+        if db is None:
+            db = AsyncIOMotorClient(os.environ['MONGO_URL'])[os.environ['DB_NAME']]
+        self.db = db
+
+    async def close(self):
+        await self.mp_service.close()
+
+    async def reconcile_once(self) -> Dict[str, Any]:
+        """
+        Percorre todas as assinaturas com mercadopago_subscription_id
+
+        Returns:
+            Estatísticas da rodada
+        """
+
+        started = time.monotonic()
+        stats = {"checked": 0, "activated": 0, "cancelled": 0, "conflicts": 0, "errors": 0}
+        last_id = None
+
+        while True:
+            query: Dict[str, Any] = {"mercadopago_subscription_id": {"$nin": [None, ""]}}
+            if last_id is not None:
+                query["_id"] = {"$gt": last_id}
+
+            page = await self.db.subscriptions.find(
+                query,
+                {"_id": 1, "user_id": 1, "status": 1, "subscription_end": 1, "mercadopago_subscription_id": 1}
+            ).sort("_id", ASCENDING).limit(RECONCILE_PAGE_SIZE).to_list(RECONCILE_PAGE_SIZE)
+
+            if not page:
+                break
+
+            last_id = page[-1]["_id"]
+
+            remotes = await asyncio.gather(
+                *(self.fetch_remote(subscription) for subscription in page),
+                return_exceptions=True
+            )
+
+            operations = []
+            for subscription, remote in zip(page, remotes):
+                stats["checked"] += 1
+
+                if isinstance(remote, Exception) or remote is None:
+                    stats["errors"] += 1
+                    continue
+
+                operation = self.diff(subscription, remote, stats)
+                if operation:
+                    operations.append(operation)
+
+            if operations:
+                await self.db.subscriptions.bulk_write(operations, ordered=False)
+
+            if len(page) < RECONCILE_PAGE_SIZE:
+                break
+
+        duration = time.monotonic() - started
+        stats["duration_seconds"] = round(duration, 2)
+        stats["checked_per_second"] = round(stats["checked"] / duration, 1) if duration > 0 else 0.0
+
+        print(
+            f"🔄 Assinaturas verificadas: {stats['checked']} ({stats['checked_per_second']}/s) | "
+            f"reativadas/renovadas: {stats['activated']} | canceladas: {stats['cancelled']} | "
+            f"conflitos: {stats['conflicts']} | erros: {stats['errors']} | duração: {duration:.2f}s"
+        )
+
+        return stats
+
+    async def fetch_remote(self, subscription: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Busca a preapproval no Mercado Pago (concorrência e taxa limitadas)"""
+
+        async with self.semaphore:
+            await self.rate_limiter.wait()
+            result = await self.mp_service.get_subscription(subscription["mercadopago_subscription_id"])
+
+        if result["status"] != 200:
+            print(f"⚠️ Preapproval {subscription['mercadopago_subscription_id']} respondeu {result['status']}")
+            return None
+
+        return result["response"]
+
+    def diff(self, subscription: Dict[str, Any], remote: Dict[str, Any], stats: Dict[str, Any]) -> Optional[UpdateOne]:
+        """
+        Monta a atualização quando o status remoto diverge do local
+
+        O filtro inclui o status lido, então uma mudança feita nesse meio tempo
+        (rota ou webhook) não é sobrescrita.
+        """
+
+        remote_status = remote.get("status")
+        local_status = subscription.get("status")
+        match = {"_id": subscription["_id"], "status": local_status}
+
+        if remote_status == "authorized":
+            if local_status == "cancelled":
+                # Cancelada aqui e ainda autorizada lá: não reativamos sozinhos
+                stats["conflicts"] += 1
+                return None
+
+            remote_end = parse_remote_date(remote.get("next_payment_date"))
+            local_end = parse_datetime(subscription.get("subscription_end"))
+
+            if local_status == "active" and (not remote_end or (local_end and local_end >= remote_end)):
+                return None
+
+            fields = {"status": "active", "reconciled_at": datetime.now()}
+            if remote_end:
+                fields["subscription_end"] = remote_end
+
+            stats["activated"] += 1
+            return UpdateOne(match, {"$set": fields})
+
+        if remote_status == "cancelled" and local_status != "cancelled":
+            stats["cancelled"] += 1
+            return UpdateOne(match, {"$set": {
+                "status": "cancelled",
+                "auto_renew": False,
+                "cancelled_at": datetime.now(),
+                "cancellation_reason": "mercadopago_cancelled",
+                "reconciled_at": datetime.now()
+            }})
+
+        return None
+
+    async def run(self):
+        """Roda uma reconciliação a cada RECONCILE_INTERVAL_SECONDS"""
+
+        while True:
+            try:
+                await self.reconcile_once()
+            except Exception as e:
+                print(f"❌ Erro na reconciliação: {str(e)}")
+
+            await asyncio.sleep(RECONCILE_INTERVAL_SECONDS)
+
+
+async def run_reconciler(once: bool = False):
+    reconciler = SubscriptionReconciler()
+
+    print("🚀 Reconciliação de assinaturas iniciada!")
+    print(f"⏰ {'Rodada única' if once else f'A cada {RECONCILE_INTERVAL_SECONDS}s'} | "
+          f"{RECONCILE_CONCURRENCY} consultas simultâneas, até {RECONCILE_RATE_PER_SECOND}/s")
+    print("")
+
+    try:
+        if once:
+            await reconciler.reconcile_once()
+        else:
+            await reconciler.run()
+    finally:
+        await reconciler.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconcilia assinaturas com o Mercado Pago")
+    parser.add_argument("--once", action="store_true", help="Roda uma única vez e sai")
+    args = parser.parse_args()
+
+    asyncio.run(run_reconciler(once=args.once))
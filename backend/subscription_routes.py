@@ -3,12 +3,39 @@
 # Cole estas rotas no seu server.py
 # ========================================
 
+import re
+import asyncio
+
 from subscription_models import *
 from subscription_service import SubscriptionService
 from mercadopago_service import MercadoPagoService
+from payment_webhooks import MERCADOPAGO_WEBHOOK_SECRET, PaymentWebhookProcessor, parse_notification, verify_signature
 
-# Inicializar serviços
+# Inicializar serviços (usa o mesmo `db` do Motor do server.py)
 mp_service = MercadoPagoService()
+SubscriptionService.configure(db)
+webhook_processor = PaymentWebhookProcessor(db, mp_service)
+
+def require_admin(user: dict):
+    """Levanta 403 se o usuário não estiver em ADMIN_EMAILS (definido no server.py)"""
+    
+    if (user.get("email") or "").lower() not in ADMIN_EMAILS:
+        raise HTTPException(status_code=403, detail="Apenas administradores")
+
+@app.on_event("startup")
+async def ensure_subscription_indexes():
+    await SubscriptionService.repository.ensure_indexes()
+    await webhook_processor.ensure_indexes()
+    webhook_processor.start()
+    if not MERCADOPAGO_WEBHOOK_SECRET:
+        print("⚠️ MERCADOPAGO_WEBHOOK_SECRET não configurado: webhooks do Mercado Pago serão recusados")
+    app.state.expiry_sweeper = asyncio.create_task(SubscriptionService.run_expiry_sweeper())
+
+@app.on_event("shutdown")
+async def close_mercadopago_client():
+    app.state.expiry_sweeper.cancel()
+    await webhook_processor.stop()
+    await mp_service.close()
 
 # ========================================
 # ROTAS DE ASSINATURA
@@ -24,20 +51,20 @@ async def get_subscription_status(request: Request):
     if not user:
         raise HTTPException(status_code=401, detail="Não autorizado")
     
-    subscription = SubscriptionService.get_subscription(user["id"])
+    subscription = await SubscriptionService.get_subscription(user["id"])
     
     if not subscription:
         # Criar trial automático para novo usuário
-        subscription = SubscriptionService.create_trial(user["id"])
+        subscription = await SubscriptionService.create_trial(user["id"])
     
-    is_active = SubscriptionService.is_subscription_active(user["id"])
-    days_remaining = SubscriptionService.get_days_remaining(user["id"])
+    is_active = await SubscriptionService.is_subscription_active(user["id"])
+    days_remaining = await SubscriptionService.get_days_remaining(user["id"])
     
     return {
         "subscription": subscription,
         "is_active": is_active,
         "days_remaining": days_remaining,
-        "requires_payment": subscription["status"] == "trial" and days_remaining and days_remaining <= 0
+        "requires_payment": subscription["status"] in ("trial", "expired") and not is_active
     }
 
 @app.post("/api/subscription/create")
@@ -56,9 +83,9 @@ async def create_subscription(data: SubscriptionCreate, request: Request):
     discount_applied = 0.0
     free_months = 0
     
-    # Validar cupom se fornecido
+    # Reservar cupom antes de cobrar (atômico: não vende além de max_uses)
     if data.coupon_code:
-        validation = SubscriptionService.validate_coupon(data.coupon_code, user["id"])
+        validation = await SubscriptionService.reserve_coupon(data.coupon_code, user["id"])
         
         if not validation["valid"]:
             raise HTTPException(status_code=400, detail=validation["message"])
@@ -74,13 +101,18 @@ async def create_subscription(data: SubscriptionCreate, request: Request):
             free_months = int(validation["discount_value"])
             final_price = 0.0  # Primeiro pagamento grátis
     
+    # Depois que o Mercado Pago aprova (ou deixa pendente) a cobrança com
+    # desconto, a reserva do cupom não pode mais ser devolvida por um erro local
+    coupon_settled = False
+    
     try:
         # Criar pagamento no Mercado Pago
-        payment_result = mp_service.create_payment(
+        payment_result = await mp_service.create_payment(
             amount=final_price,
             description=f"Fotiva - Assinatura Mensal",
             payer_email=user["email"],
-            payment_method_id=data.payment_method_id
+            payment_method_id=data.payment_method_id,
+            external_reference=user["id"]
         )
         
         if payment_result["status"] != 201:
@@ -90,11 +122,18 @@ async def create_subscription(data: SubscriptionCreate, request: Request):
         
         # Se pagamento aprovado, criar assinatura recorrente
         if payment_data["status"] == "approved":
-            subscription_result = mp_service.create_subscription(
+            coupon_settled = True
+            
+            # Confirmar o uso do cupom reservado
+            if data.coupon_code:
+                await SubscriptionService.confirm_coupon(data.coupon_code, user["id"], discount_applied)
+            
+            subscription_result = await mp_service.create_subscription(
                 user_email=user["email"],
                 plan_price=plan_price,
                 payer_id=payment_data["payer"]["id"],
-                payment_method_id=data.payment_method_id
+                payment_method_id=data.payment_method_id,
+                external_reference=user["id"]
             )
             
             if subscription_result["status"] != 201:
@@ -104,17 +143,14 @@ async def create_subscription(data: SubscriptionCreate, request: Request):
             
             # Ativar assinatura no sistema
             months_to_add = 1 + free_months
-            subscription = SubscriptionService.activate_subscription(
+            subscription = await SubscriptionService.activate_subscription(
                 user_id=user["id"],
                 plan_id="monthly_19_90",
                 mercadopago_subscription_id=subscription_data["id"],
-                months=months_to_add
+                months=months_to_add,
+                payment_id=payment_data["id"]
             )
             
-            # Registrar uso do cupom
-            if data.coupon_code:
-                SubscriptionService.use_coupon(data.coupon_code, user["id"], discount_applied)
-            
             return {
                 "success": True,
                 "subscription": subscription,
@@ -122,6 +158,17 @@ async def create_subscription(data: SubscriptionCreate, request: Request):
                 "message": "Assinatura ativada com sucesso!"
             }
         else:
+            if data.coupon_code:
+                if payment_data["status"] in ("rejected", "cancelled"):
+                    # Pagamento recusado devolve o cupom
+                    await SubscriptionService.release_coupon(data.coupon_code, user["id"])
+                else:
+                    # Pendente (Pix, boleto): o webhook confirma ou devolve a reserva
+                    await SubscriptionService.hold_coupon_for_payment(
+                        data.coupon_code, user["id"], payment_data["id"], discount_applied
+                    )
+                    coupon_settled = True
+            
             return {
                 "success": False,
                 "payment_status": payment_data["status"],
@@ -129,8 +176,36 @@ async def create_subscription(data: SubscriptionCreate, request: Request):
             }
             
     except Exception as e:
+        if data.coupon_code and not coupon_settled:
+            await SubscriptionService.release_coupon(data.coupon_code, user["id"])
+        
+        if isinstance(e, HTTPException):
+            raise
         raise HTTPException(status_code=500, detail=f"Erro ao criar assinatura: {str(e)}")
 
+@app.get("/api/subscription/expiring")
+async def list_expiring_subscriptions(request: Request, days: int = 7):
+    """Lista trials/assinaturas que vencem nos próximos N dias (apenas admin)"""
+    
+    token = request.headers.get("Authorization", "").replace("Bearer ", "")
+    user = verify_token(token)
+    
+    if not user:
+        raise HTTPException(status_code=401, detail="Não autorizado")
+    
+    require_admin(user)
+    
+    if days < 1 or days > 365:
+        raise HTTPException(status_code=400, detail="days deve estar entre 1 e 365")
+    
+    subscriptions = await SubscriptionService.list_expiring(days)
+    
+    return {
+        "subscriptions": subscriptions,
+        "total": len(subscriptions),
+        "days": days
+    }
+
 @app.post("/api/subscription/cancel")
 async def cancel_subscription(data: SubscriptionCancel, request: Request):
     """Cancela assinatura"""
@@ -141,7 +216,7 @@ async def cancel_subscription(data: SubscriptionCancel, request: Request):
     if not user:
         raise HTTPException(status_code=401, detail="Não autorizado")
     
-    subscription = SubscriptionService.get_subscription(user["id"])
+    subscription = await SubscriptionService.get_subscription(user["id"])
     
     if not subscription or subscription["status"] != "active":
         raise HTTPException(status_code=400, detail="Nenhuma assinatura ativa encontrada")
@@ -149,10 +224,10 @@ async def cancel_subscription(data: SubscriptionCancel, request: Request):
     try:
         # Cancelar no Mercado Pago
         if subscription.get("mercadopago_subscription_id"):
-            mp_service.cancel_subscription(subscription["mercadopago_subscription_id"])
+            await mp_service.cancel_subscription(subscription["mercadopago_subscription_id"])
         
         # Cancelar no sistema
-        cancelled_subscription = SubscriptionService.cancel_subscription(user["id"], data.reason)
+        cancelled_subscription = await SubscriptionService.cancel_subscription(user["id"], data.reason)
         
         return {
             "success": True,
@@ -182,7 +257,7 @@ async def create_coupon(data: CouponCreate, request: Request):
     #     raise HTTPException(status_code=403, detail="Apenas administradores")
     
     try:
-        coupon = SubscriptionService.create_coupon(
+        coupon = await SubscriptionService.create_coupon(
             code=data.code,
             discount_type=data.discount_type,
             discount_value=data.discount_value,
@@ -211,7 +286,7 @@ async def validate_coupon(data: CouponValidate, request: Request):
     if not user:
         raise HTTPException(status_code=401, detail="Não autorizado")
     
-    validation = SubscriptionService.validate_coupon(data.code, user["id"])
+    validation = await SubscriptionService.validate_coupon(data.code, user["id"])
     
     if validation["valid"]:
         # Calcular quanto seria o desconto
@@ -252,7 +327,7 @@ async def list_coupons(request: Request):
     
     # TODO: Adicionar verificação de admin
     
-    coupons = SubscriptionService.list_coupons()
+    coupons = await SubscriptionService.list_coupons()
     
     return {
         "coupons": coupons,
@@ -271,7 +346,7 @@ async def deactivate_coupon(code: str, request: Request):
     
     # TODO: Adicionar verificação de admin
     
-    coupon = SubscriptionService.deactivate_coupon(code)
+    coupon = await SubscriptionService.deactivate_coupon(code)
     
     if not coupon:
         raise HTTPException(status_code=404, detail="Cupom não encontrado")
@@ -288,45 +363,73 @@ async def deactivate_coupon(code: str, request: Request):
 
 @app.post("/api/payments/webhook")
 async def mercadopago_webhook(request: Request):
-    """Webhook para notificações do Mercado Pago"""
+    """
+    Webhook para notificações do Mercado Pago
+    
+    Só valida, deduplica e grava na caixa de entrada: o pagamento é buscado
+    e aplicado pelos workers do webhook_processor, fora da requisição.
+    """
     
     try:
         data = await request.json()
-        
-        # Processar notificação
-        if data.get("type") == "payment":
-            payment_id = data["data"]["id"]
-            payment_info = mp_service.get_payment(payment_id)
-            
-            # Atualizar status do pagamento no seu sistema
-            # TODO: Implementar lógica de atualização
-            
-            print(f"Pagamento recebido: {payment_id} - Status: {payment_info['status']}")
-        
-        return {"success": True}
-        
+    except ValueError:
+        data = {}
+    
+    query = dict(request.query_params)
+    notification = parse_notification(data, query)
+    
+    if not notification:
+        # Outros tópicos (merchant_order, etc.) são ignorados
+        return {"success": True, "ignored": True}
+    
+    # Sem assinatura válida qualquer um poderia gerar consultas ao Mercado Pago
+    if not verify_signature(request.headers, query, notification["payment_id"], MERCADOPAGO_WEBHOOK_SECRET):
+        return JSONResponse(status_code=401, content={"success": False, "error": "Assinatura inválida"})
+    
+    try:
+        queued = await webhook_processor.enqueue(notification)
     except Exception as e:
+        # Sem gravar não podemos confirmar: o Mercado Pago reenvia depois
         print(f"Erro no webhook: {str(e)}")
-        return {"success": False, "error": str(e)}
+        return JSONResponse(status_code=500, content={"success": False, "error": str(e)})
+    
+    return {"success": True, "duplicate": not queued}
+
+@app.get("/api/payments/webhook/metrics")
+async def webhook_metrics(request: Request):
+    """Vazão, atraso e fila do processamento de webhooks (apenas admin)"""
+    
+    token = request.headers.get("Authorization", "").replace("Bearer ", "")
+    user = verify_token(token)
+    
+    if not user:
+        raise HTTPException(status_code=401, detail="Não autorizado")
+    
+    require_admin(user)
+    
+    return await webhook_processor.metrics()
 
 # ========================================
 # MIDDLEWARE DE VERIFICAÇÃO DE ASSINATURA
 # ========================================
 
+# Rotas públicas (não precisam de assinatura)
+PUBLIC_ROUTES = [
+    "/api/auth/login",
+    "/api/auth/register",
+    "/api/subscription/status",
+    "/api/subscription/create",
+    "/api/payments/webhook"
+]
+
+# Um único regex compilado no lugar do loop de startswith por requisição
+PUBLIC_ROUTE_PATTERN = re.compile("|".join(re.escape(route) for route in PUBLIC_ROUTES))
+
 async def check_subscription(request: Request, call_next):
     """Middleware para verificar se usuário tem assinatura ativa"""
     
-    # Rotas públicas (não precisam de assinatura)
-    public_routes = [
-        "/api/auth/login",
-        "/api/auth/register",
-        "/api/subscription/status",
-        "/api/subscription/create",
-        "/api/payments/webhook"
-    ]
-    
     # Se for rota pública, continua
-    if any(request.url.path.startswith(route) for route in public_routes):
+    if PUBLIC_ROUTE_PATTERN.match(request.url.path):
         return await call_next(request)
     
     # Verificar token
@@ -334,8 +437,8 @@ async def check_subscription(request: Request, call_next):
     user = verify_token(token)
     
     if user:
-        # Verificar se tem assinatura ativa
-        is_active = SubscriptionService.is_subscription_active(user["id"])
+        # Verificar se tem assinatura ativa (em cache até o fim do trial/assinatura)
+        is_active = await SubscriptionService.is_subscription_active(user["id"])
         
         if not is_active:
             return JSONResponse(
@@ -1,30 +1,312 @@
+import os
+import time
+import asyncio
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any, List
-import uuid
+from typing import Optional, Dict, Any, List, Set, Tuple
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+# Cache por processo do resultado de is_subscription_active: vale até o fim do
+# trial/assinatura, com este teto para refletir alterações de outros workers
+SUBSCRIPTION_CACHE_TTL_SECONDS = float(os.getenv('SUBSCRIPTION_CACHE_TTL_SECONDS', 300))
+SUBSCRIPTION_CACHE_MAX_SIZE = int(os.getenv('SUBSCRIPTION_CACHE_MAX_SIZE', 10000))
+
+# Assinatura inativa fica pouco em cache: quem acabou de se cadastrar ou pagar
+# em outro worker não pode levar 403 por minutos
+SUBSCRIPTION_INACTIVE_CACHE_TTL_SECONDS = float(os.getenv('SUBSCRIPTION_INACTIVE_CACHE_TTL_SECONDS', 5))
+
+# Intervalo da varredura que marca trials/assinaturas vencidos como expired
+SUBSCRIPTION_SWEEP_INTERVAL_SECONDS = int(os.getenv('SUBSCRIPTION_SWEEP_INTERVAL_SECONDS', 300))
+
+# Pares (cupom, usuário) já resgatados mantidos em memória
+COUPON_USAGE_CACHE_MAX_SIZE = int(os.getenv('COUPON_USAGE_CACHE_MAX_SIZE', 100000))
+
+
+def parse_datetime(value) -> Optional[datetime]:
+    """Datas antigas podem estar salvas como string ISO"""
+
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
+
+
+class SubscriptionRepository:
+    """Acesso às coleções de assinaturas e cupons no MongoDB (Motor)"""
+
+    def __init__(self, db):
+        self.subscriptions = db.subscriptions
+        self.coupons = db.coupons
+        self.coupon_usage = db.coupon_usage
+
+        # Pares com resgate confirmado (status redeemed). Reservas ficam de fora:
+        # release_coupon em outro worker não teria como limpar este set
+        self.used_pairs: Set[Tuple[str, str]] = set()
+
+    async def ensure_indexes(self):
+        await self.subscriptions.create_index("user_id", unique=True, name="subscriptions_user_id_unique")
+        await self.coupons.create_index("code", unique=True, name="coupons_code_unique")
+        await self.coupon_usage.create_index(
+            [("coupon_code", 1), ("user_id", 1)],
+            unique=True,
+            name="coupon_usage_code_user_unique"
+        )
+        # Reservas de pagamentos pendentes, resolvidas pelo webhook
+        await self.coupon_usage.create_index("payment_id", sparse=True, name="coupon_usage_payment_id")
+        # Varredura de vencidos e consulta "vencendo nos próximos N dias"
+        await self.subscriptions.create_index([("status", 1), ("trial_end", 1)], name="subscriptions_status_trial_end")
+        await self.subscriptions.create_index(
+            [("status", 1), ("subscription_end", 1)],
+            name="subscriptions_status_subscription_end"
+        )
+
+    async def get_subscription(self, user_id: str) -> Optional[Dict[str, Any]]:
+        return await self.subscriptions.find_one({"user_id": user_id}, {"_id": 0})
+
+    async def insert_subscription_if_missing(self, subscription: Dict[str, Any]) -> Dict[str, Any]:
+        """Cria a assinatura só se o usuário ainda não tiver uma (seguro entre workers)"""
+
+        return await self.subscriptions.find_one_and_update(
+            {"user_id": subscription["user_id"]},
+            {"$setOnInsert": subscription},
+            upsert=True,
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def update_subscription(
+        self,
+        user_id: str,
+        fields: Dict[str, Any],
+        upsert: bool = False,
+        payment_id: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        update = {"$set": fields}
+        if payment_id:
+            # Pagamentos já contabilizados (o webhook não estende de novo)
+            update["$addToSet"] = {"applied_payment_ids": payment_id}
+
+        return await self.subscriptions.find_one_and_update(
+            {"user_id": user_id},
+            update,
+            upsert=upsert,
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def extend_subscription(
+        self,
+        user_id: str,
+        payment_id: str,
+        now: datetime,
+        days: int
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Soma `days` ao fim da assinatura (a partir de agora se já venceu),
+        uma única vez por pagamento
+
+        Returns:
+            Assinatura atualizada ou None se o pagamento já foi aplicado
+        """
+
+        return await self.subscriptions.find_one_and_update(
+            {"user_id": user_id, "applied_payment_ids": {"$ne": payment_id}},
+            [{
+                "$set": {
+                    "status": "active",
+                    "auto_renew": True,
+                    "subscription_start": {"$ifNull": ["$subscription_start", now]},
+                    "subscription_end": {
+                        "$add": [
+                            {"$max": [{"$ifNull": ["$subscription_end", now]}, now]},
+                            days * 24 * 60 * 60 * 1000
+                        ]
+                    },
+                    "applied_payment_ids": {
+                        "$concatArrays": [{"$ifNull": ["$applied_payment_ids", []]}, [payment_id]]
+                    },
+                    "last_payment_at": now
+                }
+            }],
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def expire_subscriptions(self, now: datetime) -> int:
+        """Marca como expired os trials e assinaturas cujo fim já passou"""
+
+        expired = 0
+
+        for status, end_field in (("trial", "trial_end"), ("active", "subscription_end")):
+            result = await self.subscriptions.update_many(
+                {"status": status, end_field: {"$lte": now}},
+                {"$set": {"status": "expired", "expired_at": now}}
+            )
+            expired += result.modified_count
+
+        return expired
+
+    async def list_expiring(self, start: datetime, end: datetime) -> List[Dict[str, Any]]:
+        expiring = []
+
+        for status, end_field in (("trial", "trial_end"), ("active", "subscription_end")):
+            expiring += await self.subscriptions.find(
+                {"status": status, end_field: {"$gt": start, "$lte": end}},
+                {"_id": 0, "user_id": 1, "status": 1, "plan_id": 1, end_field: 1}
+            ).sort(end_field, 1).to_list(None)
+
+        return expiring
+
+    async def save_coupon(self, coupon: Dict[str, Any]):
+        # replace_one não altera o dict (insert_one adicionaria _id)
+        await self.coupons.replace_one({"code": coupon["code"]}, coupon, upsert=True)
+
+    async def get_coupon(self, code: str) -> Optional[Dict[str, Any]]:
+        return await self.coupons.find_one({"code": code}, {"_id": 0})
+
+    async def update_coupon(self, code: str, update: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        return await self.coupons.find_one_and_update(
+            {"code": code},
+            update,
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def list_coupons(self) -> List[Dict[str, Any]]:
+        return await self.coupons.find({}, {"_id": 0}).sort("created_at", -1).to_list(None)
+
+    def remember_used(self, code: str, user_id: str):
+        if len(self.used_pairs) >= COUPON_USAGE_CACHE_MAX_SIZE:
+            self.used_pairs.clear()
+        self.used_pairs.add((code, user_id))
+
+    async def has_used_coupon(self, code: str, user_id: str) -> bool:
+        if (code, user_id) in self.used_pairs:
+            return True
+
+        # Consulta pontual coberta pelo índice único (coupon_code, user_id)
+        usage = await self.coupon_usage.find_one({"coupon_code": code, "user_id": user_id}, {"_id": 0, "status": 1})
+        if usage is None:
+            return False
+
+        # Registros sem status são anteriores às reservas: já resgatados
+        if usage.get("status", "redeemed") == "redeemed":
+            self.remember_used(code, user_id)
+        return True
+
+    async def insert_coupon_usage(self, usage: Dict[str, Any]) -> bool:
+        """
+        Registra o uso do cupom
+
+        Returns:
+            False se o usuário já tinha usado este cupom (índice único)
+        """
+
+        try:
+            await self.coupon_usage.insert_one(dict(usage))
+            return True
+        except DuplicateKeyError:
+            return False
+
+    async def delete_coupon_reservation(self, code: str, user_id: str) -> bool:
+        # Usos já confirmados (status redeemed) não são devolvidos
+        result = await self.coupon_usage.delete_one({"coupon_code": code, "user_id": user_id, "status": "reserved"})
+        self.used_pairs.discard((code, user_id))
+        return result.deleted_count == 1
+
+    async def attach_payment_to_reservation(self, code: str, user_id: str, payment_id: str, discount_applied: float):
+        await self.coupon_usage.update_one(
+            {"coupon_code": code, "user_id": user_id, "status": "reserved"},
+            {"$set": {"payment_id": payment_id, "discount_applied": discount_applied}}
+        )
+
+    async def find_reservation_by_payment(self, payment_id: str) -> Optional[Dict[str, Any]]:
+        return await self.coupon_usage.find_one({"payment_id": payment_id, "status": "reserved"}, {"_id": 0})
+
+    async def redeem_coupon_usage(self, code: str, user_id: str, discount_applied: float):
+        await self.coupon_usage.update_one(
+            {"coupon_code": code, "user_id": user_id},
+            {"$set": {"status": "redeemed", "discount_applied": discount_applied}}
+        )
+        self.remember_used(code, user_id)
+
+    async def increment_coupon_if_available(self, code: str, now: datetime) -> Optional[Dict[str, Any]]:
+        """
+        Conta um uso do cupom só se ele estiver ativo, dentro da validade e
+        com usos sobrando - tudo numa única atualização condicional
+        """
+
+        return await self.coupons.find_one_and_update(
+            {
+                "code": code,
+                "is_active": True,
+                "valid_from": {"$lte": now},
+                "$and": [
+                    {"$or": [{"valid_until": None}, {"valid_until": {"$gte": now}}]},
+                    # max_uses vazio ou 0 = ilimitado
+                    {"$or": [
+                        {"max_uses": None},
+                        {"max_uses": 0},
+                        {"$expr": {"$lt": ["$current_uses", "$max_uses"]}}
+                    ]}
+                ]
+            },
+            {"$inc": {"current_uses": 1}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+
 
 class SubscriptionService:
     """Serviço de gerenciamento de assinaturas"""
-    
-    # Simulação de banco de dados (você vai substituir por SQLite/PostgreSQL)
-    subscriptions: Dict[str, Any] = {}
-    coupons: Dict[str, Any] = {}
-    coupon_usage: List[Dict[str, Any]] = []
-    
+
+    # Configurado com SubscriptionService.configure(db) na inicialização do app
+    repository: Optional[SubscriptionRepository] = None
+
+    # user_id -> (expira_em, ativa). Cada worker tem o seu: activate/cancel
+    # invalidam o cache local, os demais workers convergem em até TTL segundos
+    _active_cache: Dict[str, Tuple[float, bool]] = {}
+
     @staticmethod
-    def create_trial(user_id: str) -> Dict[str, Any]:
+    def configure(db) -> SubscriptionRepository:
+        """
+        Liga o serviço ao banco de dados
+
+        Args:
+            db: Banco do Motor (AsyncIOMotorDatabase)
+
+        Returns:
+            Repositório criado
+        """
+
+        SubscriptionService.repository = SubscriptionRepository(db)
+        SubscriptionService._active_cache.clear()
+        return SubscriptionService.repository
+
+    @staticmethod
+    def _repo() -> SubscriptionRepository:
+        if SubscriptionService.repository is None:
+            raise RuntimeError("SubscriptionService não configurado: chame SubscriptionService.configure(db)")
+        return SubscriptionService.repository
+
+    @staticmethod
+    def invalidate_cache(user_id: str):
+        SubscriptionService._active_cache.pop(user_id, None)
+
+    @staticmethod
+    async def create_trial(user_id: str) -> Dict[str, Any]:
         """
         Cria período de trial de 30 dias para novo usuário
-        
+
         Args:
             user_id: ID do usuário
-            
+
         Returns:
-            Dados da assinatura trial
+            Dados da assinatura trial (ou a já existente)
         """
-        
+
         now = datetime.now()
         trial_end = now + timedelta(days=30)
-        
+
         subscription = {
             "user_id": user_id,
             "plan_id": "trial",
@@ -36,163 +318,290 @@ class SubscriptionService:
             "auto_renew": True,
             "created_at": now
         }
-        
-        SubscriptionService.subscriptions[user_id] = subscription
+
+        subscription = await SubscriptionService._repo().insert_subscription_if_missing(subscription)
+        SubscriptionService.invalidate_cache(user_id)
         return subscription
-    
+
     @staticmethod
-    def get_subscription(user_id: str) -> Optional[Dict[str, Any]]:
+    async def get_subscription(user_id: str) -> Optional[Dict[str, Any]]:
         """
         Busca assinatura do usuário
-        
+
         Args:
             user_id: ID do usuário
-            
+
         Returns:
             Dados da assinatura ou None
         """
-        
-        return SubscriptionService.subscriptions.get(user_id)
-    
+
+        return await SubscriptionService._repo().get_subscription(user_id)
+
     @staticmethod
-    def is_subscription_active(user_id: str) -> bool:
+    def compute_active_state(subscription: Optional[Dict[str, Any]]) -> Tuple[bool, Optional[datetime]]:
         """
-        Verifica se a assinatura está ativa
-        
+        Calcula se uma assinatura está ativa e até quando esse resultado vale
+
         Args:
-            user_id: ID do usuário
-            
+            subscription: Dados da assinatura
+
         Returns:
-            True se ativa, False caso contrário
+            (ativa, instante em que o resultado muda ou None se não muda sozinho)
         """
-        
-        subscription = SubscriptionService.get_subscription(user_id)
-        
+
         if not subscription:
-            return False
-        
+            return False, None
+
         now = datetime.now()
-        
+
         # Trial ativo
         if subscription["status"] == "trial":
-            if isinstance(subscription["trial_end"], str):
-                trial_end = datetime.fromisoformat(subscription["trial_end"])
-            else:
-                trial_end = subscription["trial_end"]
-            return now < trial_end
-        
+            trial_end = parse_datetime(subscription["trial_end"])
+            return (True, trial_end) if now < trial_end else (False, None)
+
         # Assinatura ativa
         if subscription["status"] == "active":
-            if isinstance(subscription["subscription_end"], str):
-                sub_end = datetime.fromisoformat(subscription["subscription_end"])
-            else:
-                sub_end = subscription["subscription_end"]
-            return now < sub_end if sub_end else True
-        
-        return False
-    
+            sub_end = parse_datetime(subscription["subscription_end"])
+            if not sub_end:
+                return True, None
+            return (True, sub_end) if now < sub_end else (False, None)
+
+        return False, None
+
     @staticmethod
-    def get_days_remaining(user_id: str) -> Optional[int]:
+    def compute_is_active(subscription: Optional[Dict[str, Any]]) -> bool:
+        """
+        Calcula se uma assinatura está ativa
+
+        Args:
+            subscription: Dados da assinatura
+
+        Returns:
+            True se ativa, False caso contrário
+        """
+
+        return SubscriptionService.compute_active_state(subscription)[0]
+
+    @staticmethod
+    async def is_subscription_active(user_id: str) -> bool:
+        """
+        Verifica se a assinatura está ativa (com cache por processo)
+
+        O status é mantido em dia pela varredura (sweep_expired_subscriptions);
+        a data de fim só protege o intervalo entre o vencimento e a próxima
+        varredura. O resultado fica em cache até o fim do trial/assinatura,
+        limitado a SUBSCRIPTION_CACHE_TTL_SECONDS (mudanças de outros workers).
+        Inativa fica só SUBSCRIPTION_INACTIVE_CACHE_TTL_SECONDS, já que o trial
+        ou o pagamento pode ter sido registrado por outro worker.
+
+        Args:
+            user_id: ID do usuário
+
+        Returns:
+            True se ativa, False caso contrário
+        """
+
+        cache = SubscriptionService._active_cache
+        cached = cache.get(user_id)
+        now = time.monotonic()
+
+        if cached and cached[0] > now:
+            return cached[1]
+
+        subscription = await SubscriptionService.get_subscription(user_id)
+        is_active, changes_at = SubscriptionService.compute_active_state(subscription)
+
+        if not is_active:
+            ttl = min(SUBSCRIPTION_CACHE_TTL_SECONDS, SUBSCRIPTION_INACTIVE_CACHE_TTL_SECONDS)
+        else:
+            ttl = SUBSCRIPTION_CACHE_TTL_SECONDS
+            if changes_at:
+                ttl = min(ttl, (changes_at - datetime.now()).total_seconds())
+
+        if ttl <= 0:
+            cache.pop(user_id, None)
+            return is_active
+
+        if len(cache) >= SUBSCRIPTION_CACHE_MAX_SIZE and user_id not in cache:
+            # Descarta a entrada mais antiga (dict mantém ordem de inserção)
+            cache.pop(next(iter(cache)))
+        cache[user_id] = (now + ttl, is_active)
+
+        return is_active
+
+    @staticmethod
+    async def get_days_remaining(user_id: str) -> Optional[int]:
         """
         Retorna quantos dias faltam no trial/assinatura
-        
+
         Args:
             user_id: ID do usuário
-            
+
         Returns:
             Número de dias restantes ou None
         """
-        
-        subscription = SubscriptionService.get_subscription(user_id)
-        
+
+        subscription = await SubscriptionService.get_subscription(user_id)
+
         if not subscription:
             return None
-        
+
         now = datetime.now()
-        
+
         if subscription["status"] == "trial":
-            if isinstance(subscription["trial_end"], str):
-                trial_end = datetime.fromisoformat(subscription["trial_end"])
-            else:
-                trial_end = subscription["trial_end"]
-            delta = trial_end - now
+            delta = parse_datetime(subscription["trial_end"]) - now
             return max(0, delta.days)
-        
+
         if subscription["status"] == "active" and subscription["subscription_end"]:
-            if isinstance(subscription["subscription_end"], str):
-                sub_end = datetime.fromisoformat(subscription["subscription_end"])
-            else:
-                sub_end = subscription["subscription_end"]
-            delta = sub_end - now
+            delta = parse_datetime(subscription["subscription_end"]) - now
             return max(0, delta.days)
-        
+
         return None
-    
+
     @staticmethod
-    def activate_subscription(
+    async def activate_subscription(
         user_id: str,
         plan_id: str,
         mercadopago_subscription_id: str,
-        months: int = 1
+        months: int = 1,
+        payment_id: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         Ativa assinatura paga
-        
+
         Args:
             user_id: ID do usuário
             plan_id: ID do plano
             mercadopago_subscription_id: ID da assinatura no Mercado Pago
             months: Número de meses
-            
+            payment_id: ID do pagamento que ativou (não é aplicado de novo pelo webhook)
+
         Returns:
             Dados da assinatura atualizada
         """
-        
+
         now = datetime.now()
         subscription_end = now + timedelta(days=30 * months)
-        
-        subscription = SubscriptionService.subscriptions.get(user_id, {})
-        subscription.update({
-            "plan_id": plan_id,
-            "status": "active",
-            "subscription_start": now,
-            "subscription_end": subscription_end,
-            "mercadopago_subscription_id": mercadopago_subscription_id,
-            "activated_at": now
-        })
-        
-        SubscriptionService.subscriptions[user_id] = subscription
+
+        subscription = await SubscriptionService._repo().update_subscription(
+            user_id,
+            {
+                "plan_id": plan_id,
+                "status": "active",
+                "subscription_start": now,
+                "subscription_end": subscription_end,
+                "mercadopago_subscription_id": mercadopago_subscription_id,
+                "activated_at": now
+            },
+            upsert=True,
+            payment_id=str(payment_id) if payment_id else None
+        )
+
+        SubscriptionService.invalidate_cache(user_id)
+        return subscription
+
+    @staticmethod
+    async def apply_approved_payment(user_id: str, payment_id: str, months: int = 1) -> Optional[Dict[str, Any]]:
+        """
+        Estende a assinatura por um pagamento aprovado (idempotente)
+
+        Args:
+            user_id: ID do usuário
+            payment_id: ID do pagamento no Mercado Pago
+            months: Número de meses
+
+        Returns:
+            Assinatura atualizada ou None se o pagamento já tinha sido aplicado
+            (ou o usuário não tem assinatura)
+        """
+
+        subscription = await SubscriptionService._repo().extend_subscription(
+            user_id,
+            str(payment_id),
+            datetime.now(),
+            days=30 * months
+        )
+
+        SubscriptionService.invalidate_cache(user_id)
         return subscription
-    
+
+    @staticmethod
+    async def sweep_expired_subscriptions() -> int:
+        """
+        Passa para expired, em lote, os trials e assinaturas vencidos
+
+        Returns:
+            Quantidade de assinaturas expiradas
+        """
+
+        return await SubscriptionService._repo().expire_subscriptions(datetime.now())
+
+    @staticmethod
+    async def list_expiring(days: int) -> List[Dict[str, Any]]:
+        """
+        Lista trials e assinaturas que vencem nos próximos `days` dias
+
+        Args:
+            days: Janela em dias a partir de agora
+
+        Returns:
+            Lista com user_id, status, plan_id e a data de fim (ends_at)
+        """
+
+        now = datetime.now()
+        expiring = await SubscriptionService._repo().list_expiring(now, now + timedelta(days=days))
+
+        for subscription in expiring:
+            subscription["ends_at"] = subscription.pop("trial_end", None) or subscription.pop("subscription_end", None)
+
+        return sorted(expiring, key=lambda subscription: subscription["ends_at"])
+
+    @staticmethod
+    async def run_expiry_sweeper():
+        """Roda sweep_expired_subscriptions a cada SUBSCRIPTION_SWEEP_INTERVAL_SECONDS"""
+
+        while True:
+            try:
+                expired = await SubscriptionService.sweep_expired_subscriptions()
+                if expired:
+                    print(f"⌛ {expired} assinatura(s)/trial(s) marcados como expirados")
+            except Exception as e:
+                print(f"❌ Erro na varredura de assinaturas: {str(e)}")
+
+            await asyncio.sleep(SUBSCRIPTION_SWEEP_INTERVAL_SECONDS)
+
     @staticmethod
-    def cancel_subscription(user_id: str, reason: Optional[str] = None) -> Dict[str, Any]:
+    async def cancel_subscription(user_id: str, reason: Optional[str] = None) -> Optional[Dict[str, Any]]:
         """
         Cancela assinatura
-        
+
         Args:
             user_id: ID do usuário
             reason: Motivo do cancelamento
-            
+
         Returns:
-            Dados da assinatura cancelada
-        """
-        
-        subscription = SubscriptionService.subscriptions.get(user_id)
-        
-        if subscription:
-            subscription["status"] = "cancelled"
-            subscription["cancelled_at"] = datetime.now()
-            subscription["cancellation_reason"] = reason
-            subscription["auto_renew"] = False
-        
+            Dados da assinatura cancelada ou None
+        """
+
+        subscription = await SubscriptionService._repo().update_subscription(
+            user_id,
+            {
+                "status": "cancelled",
+                "cancelled_at": datetime.now(),
+                "cancellation_reason": reason,
+                "auto_renew": False
+            }
+        )
+
+        SubscriptionService.invalidate_cache(user_id)
         return subscription
-    
+
     # ========================================
     # CUPONS
     # ========================================
-    
+
     @staticmethod
-    def create_coupon(
+    async def create_coupon(
         code: str,
         discount_type: str,
         discount_value: float,
@@ -203,7 +612,7 @@ class SubscriptionService:
     ) -> Dict[str, Any]:
         """
         Cria um cupom de desconto
-        
+
         Args:
             code: Código do cupom (ex: BEMVINDO)
             discount_type: percentage, fixed, free_months
@@ -212,13 +621,13 @@ class SubscriptionService:
             max_uses: Máximo de usos
             valid_from: Data de início
             valid_until: Data de fim
-            
+
         Returns:
             Dados do cupom criado
         """
-        
+
         code = code.upper()
-        
+
         coupon = {
             "code": code,
             "discount_type": discount_type,
@@ -231,119 +640,213 @@ class SubscriptionService:
             "created_by": created_by,
             "created_at": datetime.now()
         }
-        
-        SubscriptionService.coupons[code] = coupon
+
+        await SubscriptionService._repo().save_coupon(coupon)
         return coupon
-    
+
     @staticmethod
-    def validate_coupon(code: str, user_id: str) -> Dict[str, Any]:
+    async def validate_coupon(code: str, user_id: str) -> Dict[str, Any]:
         """
         Valida um cupom
-        
+
         Args:
             code: Código do cupom
             user_id: ID do usuário
-            
+
         Returns:
             Dict com valid (bool), message (str), discount_value (float)
         """
-        
+
         code = code.upper()
-        coupon = SubscriptionService.coupons.get(code)
-        
+        repo = SubscriptionService._repo()
+        coupon = await repo.get_coupon(code)
+
         if not coupon:
             return {"valid": False, "message": "Cupom não encontrado"}
-        
+
         if not coupon["is_active"]:
             return {"valid": False, "message": "Cupom inativo"}
-        
+
         now = datetime.now()
-        
+
         # Verificar validade
-        if isinstance(coupon["valid_from"], str):
-            valid_from = datetime.fromisoformat(coupon["valid_from"])
-        else:
-            valid_from = coupon["valid_from"]
-            
-        if now < valid_from:
+        if now < parse_datetime(coupon["valid_from"]):
             return {"valid": False, "message": "Cupom ainda não está válido"}
-        
-        if coupon["valid_until"]:
-            if isinstance(coupon["valid_until"], str):
-                valid_until = datetime.fromisoformat(coupon["valid_until"])
-            else:
-                valid_until = coupon["valid_until"]
-                
-            if now > valid_until:
-                return {"valid": False, "message": "Cupom expirado"}
-        
+
+        if coupon["valid_until"] and now > parse_datetime(coupon["valid_until"]):
+            return {"valid": False, "message": "Cupom expirado"}
+
         # Verificar usos
         if coupon["max_uses"] and coupon["current_uses"] >= coupon["max_uses"]:
             return {"valid": False, "message": "Cupom esgotado"}
-        
+
         # Verificar se usuário já usou
-        user_usage = [u for u in SubscriptionService.coupon_usage if u["user_id"] == user_id and u["coupon_code"] == code]
-        if user_usage:
+        if await repo.has_used_coupon(code, user_id):
             return {"valid": False, "message": "Você já usou este cupom"}
-        
+
         return {
             "valid": True,
             "message": "Cupom válido",
             "discount_type": coupon["discount_type"],
             "discount_value": coupon["discount_value"]
         }
-    
+
     @staticmethod
-    def use_coupon(code: str, user_id: str, discount_applied: float) -> None:
+    async def reserve_coupon(code: str, user_id: str) -> Dict[str, Any]:
         """
-        Registra uso de cupom
-        
+        Reserva (resgata) um cupom de forma atômica, antes da cobrança
+
+        O uso do usuário é gravado primeiro (índice único impede o segundo
+        resgate) e o contador só é incrementado por uma atualização condicional
+        que confere ativo, validade e max_uses - assim o cupom nunca é vendido
+        além do limite, mesmo com checkouts simultâneos. Se o pagamento falhar,
+        chame release_coupon.
+
+        Args:
+            code: Código do cupom
+            user_id: ID do usuário
+
+        Returns:
+            Mesmo formato de validate_coupon
+        """
+
+        code = code.upper()
+        repo = SubscriptionService._repo()
+        now = datetime.now()
+
+        inserted = await repo.insert_coupon_usage({
+            "coupon_code": code,
+            "user_id": user_id,
+            "status": "reserved",
+            "discount_applied": None,
+            "used_at": now
+        })
+
+        if not inserted:
+            return {"valid": False, "message": "Você já usou este cupom"}
+
+        coupon = await repo.increment_coupon_if_available(code, now)
+
+        if not coupon:
+            # Desfaz a reserva e descobre o motivo para a mensagem
+            await repo.delete_coupon_reservation(code, user_id)
+            validation = await SubscriptionService.validate_coupon(code, user_id)
+            if validation["valid"]:
+                # Outro checkout levou o último uso entre as duas operações
+                return {"valid": False, "message": "Cupom esgotado"}
+            return validation
+
+        return {
+            "valid": True,
+            "message": "Cupom válido",
+            "discount_type": coupon["discount_type"],
+            "discount_value": coupon["discount_value"]
+        }
+
+    @staticmethod
+    async def confirm_coupon(code: str, user_id: str, discount_applied: float) -> None:
+        """
+        Marca a reserva como resgatada depois do pagamento aprovado
+
         Args:
             code: Código do cupom
             user_id: ID do usuário
             discount_applied: Desconto aplicado em reais
         """
-        
+
+        await SubscriptionService._repo().redeem_coupon_usage(code.upper(), user_id, discount_applied)
+
+    @staticmethod
+    async def release_coupon(code: str, user_id: str) -> bool:
+        """
+        Devolve um cupom reservado (pagamento recusado ou com erro)
+
+        Args:
+            code: Código do cupom
+            user_id: ID do usuário
+
+        Returns:
+            True se havia reserva para devolver
+        """
+
         code = code.upper()
-        coupon = SubscriptionService.coupons.get(code)
-        
-        if coupon:
-            coupon["current_uses"] += 1
-            
-            SubscriptionService.coupon_usage.append({
-                "coupon_code": code,
-                "user_id": user_id,
-                "discount_applied": discount_applied,
-                "used_at": datetime.now()
-            })
-    
+        repo = SubscriptionService._repo()
+
+        # Só decrementa quem realmente apagou a reserva (release repetido é inofensivo)
+        if not await repo.delete_coupon_reservation(code, user_id):
+            return False
+
+        await repo.update_coupon(code, {"$inc": {"current_uses": -1}})
+        return True
+
+    @staticmethod
+    async def hold_coupon_for_payment(code: str, user_id: str, payment_id, discount_applied: float) -> None:
+        """
+        Liga a reserva a um pagamento pendente (Pix, boleto)
+
+        Args:
+            code: Código do cupom
+            user_id: ID do usuário
+            payment_id: ID do pagamento no Mercado Pago
+            discount_applied: Desconto aplicado em reais
+        """
+
+        await SubscriptionService._repo().attach_payment_to_reservation(
+            code.upper(),
+            user_id,
+            str(payment_id),
+            discount_applied
+        )
+
+    @staticmethod
+    async def settle_coupon_for_payment(payment_id, approved: bool) -> Optional[str]:
+        """
+        Confirma ou devolve o cupom reservado para um pagamento pendente
+
+        Args:
+            payment_id: ID do pagamento no Mercado Pago
+            approved: True se o pagamento foi aprovado, False se recusado
+
+        Returns:
+            "coupon_redeemed", "coupon_released" ou None se não havia reserva
+        """
+
+        reservation = await SubscriptionService._repo().find_reservation_by_payment(str(payment_id))
+
+        if not reservation:
+            return None
+
+        code, user_id = reservation["coupon_code"], reservation["user_id"]
+
+        if approved:
+            await SubscriptionService.confirm_coupon(code, user_id, reservation.get("discount_applied") or 0.0)
+            return "coupon_redeemed"
+
+        await SubscriptionService.release_coupon(code, user_id)
+        return "coupon_released"
+
     @staticmethod
-    def list_coupons() -> List[Dict[str, Any]]:
+    async def list_coupons() -> List[Dict[str, Any]]:
         """
         Lista todos os cupons
-        
+
         Returns:
             Lista de cupons
         """
-        
-        return list(SubscriptionService.coupons.values())
-    
+
+        return await SubscriptionService._repo().list_coupons()
+
     @staticmethod
-    def deactivate_coupon(code: str) -> Dict[str, Any]:
+    async def deactivate_coupon(code: str) -> Optional[Dict[str, Any]]:
         """
         Desativa um cupom
-        
+
         Args:
             code: Código do cupom
-            
+
         Returns:
-            Cupom desativado
+            Cupom desativado ou None
         """
-        
+
         code = code.upper()
-        coupon = SubscriptionService.coupons.get(code)
-        
-        if coupon:
-            coupon["is_active"] = False
-        
-        return coupon
+        return await SubscriptionService._repo().update_coupon(code, {"$set": {"is_active": False}})
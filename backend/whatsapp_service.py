@@ -0,0 +1,209 @@
+"""
+Envio de WhatsApp (Twilio) sem bloquear o event loop
+"""
+
+import os
+import time
+import asyncio
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+# Threads para as chamadas síncronas do SDK do Twilio
+WHATSAPP_WORKERS = int(os.getenv('WHATSAPP_WORKERS', 4))
+
+# Reenvio com backoff exponencial para falhas temporárias (429, 5xx, rede)
+WHATSAPP_MAX_RETRIES = int(os.getenv('WHATSAPP_MAX_RETRIES', 5))
+WHATSAPP_RETRY_BASE_SECONDS = float(os.getenv('WHATSAPP_RETRY_BASE_SECONDS', 2))
+
+# Resultados de WhatsAppSender.send
+SENT = "sent"
+QUEUED = "queued"
+
+# Chamado quando uma mensagem da fila de reenvio é entregue (True) ou descartada (False, erro)
+ResultCallback = Callable[[bool, Optional[str]], Awaitable[None]]
+
+
+@lru_cache(maxsize=4096)
+def normalize_phone(phone: str) -> str:
+    """Formata o número no padrão E.164 (adiciona +55 se não tiver código do país)"""
+
+    digits = ''.join(char for char in phone if char.isdigit())
+
+    if phone.strip().startswith('+'):
+        return '+' + digits
+
+    return '+55' + digits
+
+
+def strip_whatsapp_prefix(number: str) -> str:
+    """TWILIO_WHATSAPP_FROM pode vir com ou sem o prefixo 'whatsapp:'"""
+
+    return number[len('whatsapp:'):] if number.startswith('whatsapp:') else number
+
+
+class TwilioWhatsAppProvider:
+    """Provider real: cliente do Twilio criado uma única vez e reutilizado"""
+
+    def __init__(self, account_sid: str, auth_token: str, from_number: str):
+        from twilio.rest import Client
+
+        self.client = Client(account_sid, auth_token)
+        self.from_number = strip_whatsapp_prefix(from_number)
+
+    def send(self, to: str, body: str):
+        """Chamada síncrona - executada no pool de threads do WhatsAppSender"""
+
+        self.client.messages.create(
+            from_=f'whatsapp:{self.from_number}',
+            to=f'whatsapp:{to}',
+            body=body
+        )
+
+    @staticmethod
+    def is_transient(error: Exception) -> bool:
+        from twilio.base.exceptions import TwilioRestException
+
+        if isinstance(error, TwilioRestException):
+            return error.status == 429 or error.status >= 500
+
+        # Erros de rede do requests herdam de OSError
+        return isinstance(error, OSError)
+
+
+class FakeWhatsAppProvider:
+    """Provider local para testes: guarda as mensagens em memória"""
+
+    def __init__(self, transient_failures: int = 0):
+        self.sent: List[Dict[str, Any]] = []
+        self.attempts: List[float] = []
+        self.transient_failures = transient_failures
+
+    def send(self, to: str, body: str):
+        self.attempts.append(time.monotonic())
+
+        if self.transient_failures > 0:
+            self.transient_failures -= 1
+            raise ConnectionError("Falha temporária simulada")
+
+        self.sent.append({"to": to, "body": body})
+
+    @staticmethod
+    def is_transient(error: Exception) -> bool:
+        return isinstance(error, ConnectionError)
+
+
+class WhatsAppSender:
+    """Envia mensagens pelo provider em threads, com fila de reenvio"""
+
+    def __init__(
+        self,
+        provider,
+        workers: int = WHATSAPP_WORKERS,
+        max_retries: int = WHATSAPP_MAX_RETRIES,
+        retry_base_seconds: float = WHATSAPP_RETRY_BASE_SECONDS
+    ):
+        self.provider = provider
+        self.max_retries = max_retries
+        self.retry_base_seconds = retry_base_seconds
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="whatsapp")
+
+        # (instante do reenvio, tentativa, desempate, telefone, mensagem, callback)
+        self.retry_queue: Optional[asyncio.PriorityQueue] = None
+        self._retry_worker: Optional[asyncio.Task] = None
+        self._sequence = itertools.count()
+
+    async def send(self, phone: str, body: str, on_result: Optional[ResultCallback] = None) -> str:
+        """
+        Envia uma mensagem.
+
+        Args:
+            phone: Telefone do destinatário
+            body: Texto da mensagem
+            on_result: Chamado quando uma mensagem que foi para a fila de
+                reenvio é finalmente entregue ou descartada
+
+        Returns:
+            SENT se o provider aceitou agora, QUEUED se foi para a fila de
+            reenvio (ainda não entregue)
+        """
+
+        to = normalize_phone(phone)
+
+        try:
+            await self._send_now(to, body)
+            return SENT
+
+        except Exception as e:
+            if self.max_retries > 0 and self.provider.is_transient(e):
+                print(f"⚠️ Falha temporária no WhatsApp para {to}, reenviando depois: {str(e)}")
+                self._schedule_retry(to, body, 1, on_result)
+                return QUEUED
+            raise
+
+    async def close(self):
+        if self._retry_worker:
+            self._retry_worker.cancel()
+        self.executor.shutdown(wait=False)
+
+    async def _send_now(self, to: str, body: str):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.provider.send, to, body)
+
+    def _schedule_retry(self, to: str, body: str, attempt: int, on_result: Optional[ResultCallback]):
+        if self.retry_queue is None:
+            self.retry_queue = asyncio.PriorityQueue()
+        if self._retry_worker is None or self._retry_worker.done():
+            self._retry_worker = asyncio.create_task(self._run_retries())
+
+        delay = self.retry_base_seconds * (2 ** (attempt - 1))
+        self.retry_queue.put_nowait((time.monotonic() + delay, attempt, next(self._sequence), to, body, on_result))
+
+    async def _run_retries(self):
+        while True:
+            item = await self.retry_queue.get()
+            due_at, attempt, _, to, body, on_result = item
+
+            wait = due_at - time.monotonic()
+            if wait > 0:
+                # Ainda não venceu: devolve para a fila (outro item pode vencer antes)
+                self.retry_queue.put_nowait(item)
+                await asyncio.sleep(min(wait, 1.0))
+                continue
+
+            try:
+                await self._send_now(to, body)
+                print(f"✅ WhatsApp reenviado para {to} (tentativa {attempt})")
+                await self._notify(on_result, True, None)
+
+            except Exception as e:
+                if attempt < self.max_retries and self.provider.is_transient(e):
+                    self._schedule_retry(to, body, attempt + 1, on_result)
+                else:
+                    print(f"❌ WhatsApp para {to} descartado após {attempt} tentativa(s): {str(e)}")
+                    await self._notify(on_result, False, str(e))
+
+    @staticmethod
+    async def _notify(on_result: Optional[ResultCallback], delivered: bool, error: Optional[str]):
+        if on_result is None:
+            return
+
+        try:
+            await on_result(delivered, error)
+        except Exception as e:
+            print(f"❌ Erro ao registrar resultado do WhatsApp: {str(e)}")
+
+
+def create_whatsapp_sender() -> Optional[WhatsAppSender]:
+    """Cria o sender com as credenciais do Twilio do ambiente (None se faltarem)"""
+
+    account_sid = os.getenv('TWILIO_ACCOUNT_SID')
+    auth_token = os.getenv('TWILIO_AUTH_TOKEN')
+    from_whatsapp = os.getenv('TWILIO_WHATSAPP_FROM')
+
+    if not all([account_sid, auth_token, from_whatsapp]):
+        print("❌ Credenciais do Twilio não configuradas")
+        return None
+
+    return WhatsAppSender(TwilioWhatsAppProvider(account_sid, auth_token, from_whatsapp))
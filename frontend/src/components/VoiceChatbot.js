@@ -3,6 +3,7 @@ import { Mic, MicOff, Send, X, Loader, CheckCircle, AlertCircle } from 'lucide-r
 import { useNavigate } from 'react-router-dom';
 import { useAuth } from '@/contexts/AuthContext';
 import axios from 'axios';
+import { fetchAllPages } from '@/lib/pagination';
 
 const API_URL = process.env.REACT_APP_BACKEND_URL;
 
@@ -168,10 +169,9 @@ const VoiceChatbot = () => {
   const fetchClients = async () => {
     try {
       const token = localStorage.getItem('token');
-      const response = await axios.get(`${API_URL}/api/clients`, {
+      return await fetchAllPages(`${API_URL}/api/clients`, {
         headers: { Authorization: `Bearer ${token}` }
       });
-      return response.data;
     } catch (error) {
       console.error('Erro ao buscar clientes:', error);
       return [];
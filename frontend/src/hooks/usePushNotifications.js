@@ -111,13 +111,16 @@ export const usePushNotifications = () => {
     try {
       setLoading(true);
 
+      const endpoint = subscription ? subscription.endpoint : null;
+
       if (subscription) {
         await subscription.unsubscribe();
       }
 
-      // Remover do backend
+      // Remover do backend (apenas este dispositivo)
       const token = localStorage.getItem('token');
-      await fetch(`${API_URL}/api/auth/push-subscription`, {
+      const query = endpoint ? `?endpoint=${encodeURIComponent(endpoint)}` : '';
+      await fetch(`${API_URL}/api/auth/push-subscription${query}`, {
         method: 'DELETE',
         headers: {
           'Authorization': `Bearer ${token}`
@@ -0,0 +1,24 @@
+import axios from "axios";
+
+// Itens por página pedidos ao backend (o servidor limita a MAX_PAGE_SIZE)
+const PAGE_SIZE = 500;
+
+/**
+ * Busca todas as páginas de uma listagem paginada do backend.
+ * Segue o header X-Next-Cursor até ele não vir mais.
+ */
+export async function fetchAllPages(url, config = {}) {
+  const items = [];
+  let cursor = null;
+
+  do {
+    const response = await axios.get(url, {
+      ...config,
+      params: { ...config.params, limit: PAGE_SIZE, ...(cursor ? { cursor } : {}) }
+    });
+    items.push(...response.data);
+    cursor = response.headers["x-next-cursor"];
+  } while (cursor);
+
+  return items;
+}
@@ -1,5 +1,5 @@
 import React, { useState, useEffect } from 'react';
-import axios from 'axios';
+import { fetchAllPages } from '@/lib/pagination';
 import './Agenda.css';
 
 const Agenda = () => {
@@ -16,13 +16,13 @@ const Agenda = () => {
     try {
       setLoading(true);
       const token = localStorage.getItem('token');
-      const response = await axios.get(
+      const data = await fetchAllPages(
         `${process.env.REACT_APP_BACKEND_URL}/api/events`,
         {
           headers: { Authorization: `Bearer ${token}` }
         }
       );
-      setEvents(response.data || []);
+      setEvents(data);
     } catch (error) {
       console.error('Erro ao buscar eventos:', error);
       setEvents([]);
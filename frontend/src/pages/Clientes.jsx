@@ -4,6 +4,7 @@ import { Plus, Search, User, Phone, Mail, Edit2, Trash2 } from 'lucide-react';
 import axios from 'axios';
 import DashboardLayout from '@/components/DashboardLayout';
 import { toast } from 'sonner';
+import { fetchAllPages } from '@/lib/pagination';
 
 const API_URL = process.env.REACT_APP_BACKEND_URL;
 
@@ -19,10 +20,10 @@ const Clientes = () => {
   const fetchClientes = async () => {
     try {
       const token = localStorage.getItem('token');
-      const response = await axios.get(`${API_URL}/api/clients`, {
+      const data = await fetchAllPages(`${API_URL}/api/clients`, {
         headers: { Authorization: `Bearer ${token}` }
       });
-      setClientes(response.data);
+      setClientes(data);
     } catch (error) {
       console.error('Erro ao buscar clientes:', error);
       toast.error('Erro ao carregar clientes');
@@ -3,6 +3,7 @@ import { useNavigate } from 'react-router-dom';
 import { Calendar, Plus, Search, MapPin, DollarSign, Edit2, Trash2, User } from 'lucide-react';
 import DashboardLayout from '@/components/DashboardLayout';
 import { toast } from 'sonner';
+import { fetchAllPages } from '@/lib/pagination';
 
 const Eventos = () => {
   const navigate = useNavigate();
@@ -20,17 +21,11 @@ const Eventos = () => {
   const fetchEventos = async () => {
     try {
       const token = localStorage.getItem('token');
-      const response = await fetch(`${API_URL}/api/events`, {
+      const data = await fetchAllPages(`${API_URL}/api/events`, {
         headers: {
           'Authorization': `Bearer ${token}`
         }
       });
-
-      if (!response.ok) {
-        throw new Error('Erro ao buscar eventos');
-      }
-
-      const data = await response.json();
       setEventos(data);
     } catch (err) {
       console.error('Erro ao buscar eventos:', err);
@@ -4,6 +4,7 @@ import axios from 'axios';
 import { Plus, Image as ImageIcon } from 'lucide-react';
 import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogTrigger } from '@/components/ui/dialog';
 import { toast } from 'sonner';
+import { fetchAllPages } from '@/lib/pagination';
 
 const API_URL = `${process.env.REACT_APP_BACKEND_URL}/api`;
 
@@ -23,8 +24,7 @@ const Galeria = () => {
 
   const fetchGalleries = async () => {
     try {
-      const response = await axios.get(`${API_URL}/galleries`);
-      setGalleries(response.data);
+      setGalleries(await fetchAllPages(`${API_URL}/galleries`));
     } catch (error) {
       toast.error('Erro ao carregar galerias');
     } finally {
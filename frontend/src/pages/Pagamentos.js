@@ -4,6 +4,7 @@ import axios from 'axios';
 import { Plus, Check, Clock, AlertCircle, Edit2, Trash2, Link as LinkIcon, Copy } from 'lucide-react';
 import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogTrigger } from '@/components/ui/dialog';
 import { toast } from 'sonner';
+import { fetchAllPages } from '@/lib/pagination';
 
 const API_URL = `${process.env.REACT_APP_BACKEND_URL}/api`;
 
@@ -31,12 +32,12 @@ const Pagamentos = () => {
 
   const fetchData = async () => {
     try {
-      const [paymentsRes, eventsRes] = await Promise.all([
-        axios.get(`${API_URL}/payments`),
-        axios.get(`${API_URL}/events`)
+      const [paymentsData, eventsData] = await Promise.all([
+        fetchAllPages(`${API_URL}/payments`),
+        fetchAllPages(`${API_URL}/events`)
       ]);
-      setPayments(paymentsRes.data);
-      setEvents(eventsRes.data);
+      setPayments(paymentsData);
+      setEvents(eventsData);
     } catch (error) {
       toast.error('Erro ao carregar pagamentos');
     } finally {
@@ -50,31 +51,13 @@ const Pagamentos = () => {
       const selectedEvent = events.find(e => e.id === formData.event_id);
       if (!selectedEvent) return;
 
-      const downPayment = parseFloat(formData.down_payment);
-      const remaining = selectedEvent.total_value - downPayment;
-      const installmentAmount = remaining / parseInt(formData.installments);
-
-      // Create installments
-      const promises = [];
-      for (let i = 1; i <= parseInt(formData.installments); i++) {
-        const dueDate = new Date(formData.first_due_date);
-        dueDate.setMonth(dueDate.getMonth() + (i - 1));
-        
-        promises.push(
-          axios.post(`${API_URL}/payments`, {
-            event_id: selectedEvent.id,
-            client_id: selectedEvent.client_id,
-            client_name: selectedEvent.client_name,
-            event_name: selectedEvent.name,
-            installment_number: i,
-            total_installments: parseInt(formData.installments),
-            amount: installmentAmount,
-            due_date: dueDate.toISOString().split('T')[0]
-          })
-        );
-      }
-
-      await Promise.all(promises);
+      // Todas as parcelas são geradas no servidor em uma única chamada
+      await axios.post(`${API_URL}/events/${selectedEvent.id}/installments`, {
+        count: parseInt(formData.installments),
+        first_due_date: formData.first_due_date,
+        interval_months: 1,
+        down_payment: parseFloat(formData.down_payment) || 0
+      });
       toast.success(`${formData.installments} parcelas criadas com sucesso!`);
       setShowDialog(false);
       setFormData({
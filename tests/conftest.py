@@ -0,0 +1,30 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "backend"))
+
+# server.py lê estas variáveis no import; o banco real nunca é usado nos testes
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "fotiva_test")
+os.environ.setdefault("SECRET_KEY", "test-secret")
+
+
+@pytest.fixture
+def server(monkeypatch):
+    """server.py com um MongoDB em memória no lugar do Motor"""
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    import server as server_module
+
+    monkeypatch.setattr(server_module, "db", mongomock_motor.AsyncMongoMockClient()["fotiva_test"])
+    server_module.user_cache._entries.clear()
+    return server_module
+
+
+@pytest.fixture
+def make_user(server):
+    def factory(email="fotografo@fotiva.com"):
+        return server.User(email=email, name="Fotógrafo")
+    return factory
@@ -0,0 +1,137 @@
+import asyncio
+
+import httpx
+import pytest
+
+import fake_mercadopago
+import mercadopago_service
+from mercadopago_service import MercadoPagoService
+
+
+class RecordingTransport(httpx.ASGITransport):
+    """ASGITransport que guarda as requisições enviadas ao fake"""
+
+    def __init__(self, app):
+        super().__init__(app=app)
+        self.requests = []
+
+    async def handle_async_request(self, request):
+        self.requests.append(request)
+        return await super().handle_async_request(request)
+
+
+@pytest.fixture
+def transport():
+    fake_mercadopago.payments.clear()
+    fake_mercadopago.preapprovals.clear()
+    return RecordingTransport(fake_mercadopago.app)
+
+
+def make_service(transport):
+    return MercadoPagoService(base_url="http://fake-mp", access_token="TEST-TOKEN", transport=transport)
+
+
+def test_create_and_get_payment(transport):
+    async def scenario():
+        service = make_service(transport)
+        try:
+            created = await service.create_payment(
+                amount=19.9,
+                description="Assinatura Fotiva",
+                payer_email="fotografo@fotiva.com",
+                payment_method_id="pix",
+                external_reference="user-1"
+            )
+            fetched = await service.get_payment(created["response"]["id"])
+            return created, fetched
+        finally:
+            await service.close()
+
+    created, fetched = asyncio.run(scenario())
+
+    assert created["status"] == 201
+    assert created["response"]["status"] == "approved"
+    assert created["response"]["external_reference"] == "user-1"
+    assert fetched == {"status": 200, "response": created["response"]}
+
+    post, get = transport.requests
+    assert post.headers["Authorization"] == "Bearer TEST-TOKEN"
+    assert post.headers["X-Idempotency-Key"]
+    assert "X-Idempotency-Key" not in get.headers
+    assert post.extensions["timeout"]["read"] == mercadopago_service.MERCADOPAGO_PAYMENT_TIMEOUT_SECONDS
+    assert get.extensions["timeout"]["read"] == mercadopago_service.MERCADOPAGO_TIMEOUT_SECONDS
+    assert get.extensions["timeout"]["connect"] == mercadopago_service.MERCADOPAGO_CONNECT_TIMEOUT_SECONDS
+
+
+def test_each_post_gets_its_own_idempotency_key(transport):
+    async def scenario():
+        service = make_service(transport)
+        try:
+            for _ in range(2):
+                await service.create_payment(19.9, "Assinatura Fotiva", "fotografo@fotiva.com", "pix")
+        finally:
+            await service.close()
+
+    asyncio.run(scenario())
+
+    keys = [request.headers["X-Idempotency-Key"] for request in transport.requests]
+    assert len(set(keys)) == 2
+
+
+def test_create_and_get_preapproval(transport):
+    async def scenario():
+        service = make_service(transport)
+        try:
+            created = await service.create_subscription(
+                user_email="fotografo@fotiva.com",
+                plan_price=19.9,
+                payer_id="payer-1",
+                payment_method_id="visa",
+                external_reference="user-1"
+            )
+            fetched = await service.get_subscription(created["response"]["id"])
+            cancelled = await service.cancel_subscription(created["response"]["id"])
+            return created, fetched, cancelled
+        finally:
+            await service.close()
+
+    created, fetched, cancelled = asyncio.run(scenario())
+
+    assert created["status"] == 201
+    assert fetched["status"] == 200
+    assert fetched["response"]["status"] == "authorized"
+    assert fetched["response"]["auto_recurring"]["transaction_amount"] == 19.9
+    assert cancelled["response"]["status"] == "cancelled"
+
+
+def test_unknown_payment_returns_status_and_body(transport):
+    async def scenario():
+        service = make_service(transport)
+        try:
+            return await service.get_payment("999")
+        finally:
+            await service.close()
+
+    result = asyncio.run(scenario())
+
+    assert result["status"] == 404
+    assert result["response"] == {"detail": "Payment not found"}
+
+
+def test_close_releases_the_client_and_a_new_one_is_created_on_demand(transport):
+    async def scenario():
+        service = make_service(transport)
+        first = service.get_client()
+        await service.close()
+        closed = first.is_closed, service.client
+        result = await service.get_payment("999")
+        second = service.client
+        await service.close()
+        return closed, result, first is second
+
+    (was_closed, client_after_close), result, same_client = asyncio.run(scenario())
+
+    assert was_closed is True
+    assert client_after_close is None
+    assert result["status"] == 404
+    assert same_client is False
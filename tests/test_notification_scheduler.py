@@ -0,0 +1,29 @@
+import asyncio
+
+import pytest
+
+
+def test_refresh_falls_back_to_short_interval_without_change_stream(monkeypatch, capsys):
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    import notification_service_updated as notifications
+
+    monkeypatch.setattr(notifications, "CHANGE_STREAM_RETRY_SECONDS", 0.01)
+
+    async def scenario():
+        # mongomock não tem change stream, como um MongoDB standalone
+        scheduler = notifications.NotificationScheduler(db=mongomock_motor.AsyncMongoMockClient()["fotiva_test"])
+        watcher = asyncio.create_task(scheduler.watch_events())
+        await asyncio.sleep(0.1)
+        watcher.cancel()
+        await asyncio.gather(watcher, return_exceptions=True)
+        await scheduler.close()
+        return scheduler
+
+    scheduler = asyncio.run(scenario())
+
+    assert scheduler.change_stream_active is False
+    assert scheduler.refresh_interval() == min(
+        notifications.SCHEDULE_REFRESH_SECONDS, notifications.SCHEDULE_REFRESH_DEGRADED_SECONDS
+    )
+    assert scheduler.refresh_interval() <= 600
+    assert capsys.readouterr().out.count("Change stream de eventos indisponível") == 1
@@ -0,0 +1,131 @@
+import asyncio
+import hashlib
+import hmac
+from datetime import datetime, timezone
+
+import httpx
+import pytest
+
+import fake_mercadopago
+from mercadopago_service import MercadoPagoService
+from payment_webhooks import PaymentWebhookProcessor, verify_signature
+from subscription_service import SubscriptionService
+
+SECRET = "webhook-secret"
+
+
+def sign(payment_id, request_id="req-1", ts="1704908010", secret=SECRET):
+    manifest = f"id:{payment_id};request-id:{request_id};ts:{ts};"
+    v1 = hmac.new(secret.encode(), manifest.encode(), hashlib.sha256).hexdigest()
+    return {"x-signature": f"ts={ts},v1={v1}", "x-request-id": request_id}
+
+
+def test_verify_signature_accepts_only_the_signed_payment():
+    headers = sign("123")
+
+    assert verify_signature(headers, {"data.id": "123"}, "123", SECRET)
+    assert not verify_signature(headers, {"data.id": "123"}, "123", "outra-chave")
+    assert not verify_signature(headers, {"data.id": "456"}, "456", SECRET)
+    assert not verify_signature(headers, {"data.id": "123"}, "456", SECRET)
+    assert not verify_signature({}, {"data.id": "123"}, "123", SECRET)
+    assert not verify_signature(headers, {"data.id": "123"}, "123", "")
+
+
+@pytest.fixture
+def processor():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    db = mongomock_motor.AsyncMongoMockClient()["fotiva_test"]
+    SubscriptionService.configure(db)
+    fake_mercadopago.payments.clear()
+
+    mp_service = MercadoPagoService(
+        base_url="http://fake-mp",
+        access_token="TEST-TOKEN",
+        transport=httpx.ASGITransport(app=fake_mercadopago.app)
+    )
+    return PaymentWebhookProcessor(db, mp_service, workers=1)
+
+
+async def create_payment(processor, user_id):
+    created = await processor.mp_service.create_payment(19.9, "Assinatura Fotiva", "fotografo@fotiva.com", "pix", external_reference=user_id)
+    return str(created["response"]["id"])
+
+
+async def process_notification(processor, payment_id):
+    await processor.enqueue({
+        "notification_id": f"payment:{payment_id}:payment.updated",
+        "type": "payment",
+        "action": "payment.updated",
+        "payment_id": payment_id
+    })
+    item = await processor.claim_next()
+    await processor.process(item)
+    return await processor.db.payment_webhook_inbox.find_one({"_id": item["_id"]})
+
+
+def test_unknown_payment_is_finished_without_retries(processor):
+    async def scenario():
+        try:
+            return await process_notification(processor, "999")
+        finally:
+            await processor.mp_service.close()
+
+    item = asyncio.run(scenario())
+
+    assert item["status"] == "done"
+    assert item["outcome"] == "not_found"
+    assert item["attempts"] == 1
+    assert processor.stats["retried"] == 0
+
+
+def test_other_client_errors_fail_without_retries(processor, monkeypatch):
+    async def forbidden(payment_id):
+        return {"status": 403, "response": {"message": "forbidden"}}
+
+    monkeypatch.setattr(processor.mp_service, "get_payment", forbidden)
+
+    item = asyncio.run(process_notification(processor, "123"))
+
+    assert item["status"] == "failed"
+    assert processor.stats["retried"] == 0
+
+
+def test_server_errors_are_retried(processor, monkeypatch):
+    async def unavailable(payment_id):
+        return {"status": 503, "response": {}}
+
+    monkeypatch.setattr(processor.mp_service, "get_payment", unavailable)
+
+    item = asyncio.run(process_notification(processor, "123"))
+
+    assert item["status"] == "pending"
+    assert item["available_at"].replace(tzinfo=timezone.utc) > datetime.now(timezone.utc)
+    assert processor.stats["retried"] == 1
+
+
+def test_approved_payment_outcomes(processor, monkeypatch):
+    applied = set()
+
+    # O $add de datas do pipeline de extend_subscription não existe no mongomock
+    async def apply_approved_payment(user_id, payment_id, months=1):
+        if payment_id in applied or await SubscriptionService.get_subscription(user_id) is None:
+            return None
+        applied.add(payment_id)
+        return {"user_id": user_id, "status": "active"}
+
+    monkeypatch.setattr(SubscriptionService, "apply_approved_payment", apply_approved_payment)
+
+    async def scenario():
+        try:
+            orphan = await create_payment(processor, "sem-assinatura")
+            no_subscription = await processor.apply_payment(orphan)
+
+            await SubscriptionService.create_trial("user-1")
+            payment_id = await create_payment(processor, "user-1")
+            extended = await processor.apply_payment(payment_id)
+            repeated = await processor.apply_payment(payment_id)
+            return no_subscription, extended, repeated
+        finally:
+            await processor.mp_service.close()
+
+    assert asyncio.run(scenario()) == ("no_subscription", "extended", "already_applied")
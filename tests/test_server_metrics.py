@@ -0,0 +1,16 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+
+def test_metrics_require_admin(server, make_user, monkeypatch):
+    monkeypatch.setattr(server, "ADMIN_EMAILS", {"admin@fotiva.com"})
+
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(server.get_admin_user(make_user("fotografo@fotiva.com")))
+    assert exc.value.status_code == 403
+
+    admin = asyncio.run(server.get_admin_user(make_user("Admin@Fotiva.com")))
+    metrics = asyncio.run(server.get_metrics(admin))
+    assert set(metrics) == {"password_hash", "user_cache"}
@@ -0,0 +1,32 @@
+import asyncio
+
+from fastapi import Response
+
+
+async def list_all_clients(server, user, limit=None):
+    pages = []
+    cursor = None
+    while True:
+        response = Response()
+        page = await server.get_clients(response, limit=limit, cursor=cursor, sort="created_at", order="asc", current_user=user)
+        pages.append(page)
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return pages
+
+
+def test_default_page_is_smaller_than_max_and_cursor_reaches_the_end(server, make_user):
+    user = make_user()
+    total = server.DEFAULT_PAGE_SIZE + 50
+
+    async def scenario():
+        for i in range(total):
+            await server.create_client(server.ClientCreate(name=f"Cliente {i:03d}"), current_user=user)
+        return await list_all_clients(server, user), await list_all_clients(server, user, limit=server.MAX_PAGE_SIZE)
+
+    default_pages, max_pages = asyncio.run(scenario())
+
+    assert server.DEFAULT_PAGE_SIZE < server.MAX_PAGE_SIZE
+    assert [len(page) for page in default_pages] == [server.DEFAULT_PAGE_SIZE, 50]
+    assert len({client["id"] for page in default_pages for client in page}) == total
+    assert [len(page) for page in max_pages] == [total]
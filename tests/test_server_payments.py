@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from pydantic import ValidationError
+
+
+def create_event(server, user, total_value=1000):
+    return server.create_event(server.EventCreate(
+        client_id="cliente-1",
+        event_type="casamento",
+        event_date="2030-05-10T15:00:00",
+        total_value=total_value
+    ), current_user=user)
+
+
+def create_payment(server, user, event_id, amount):
+    return server.create_payment(server.PaymentCreate(
+        event_id=event_id,
+        installment_number=1,
+        amount=amount,
+        due_date="2030-01-10"
+    ), current_user=user)
+
+
+async def revenue(server, user):
+    stats = await server.db.user_stats.find_one({"user_id": user.id})
+    return stats["total_revenue"]
+
+
+def test_paying_payments_of_a_deleted_event_does_not_change_stats(server, make_user):
+    user = make_user()
+
+    async def scenario():
+        await server.rebuild_user_stats(user.id)
+        live_event = await create_event(server, user)
+        deleted_event = await create_event(server, user)
+
+        live = await create_payment(server, user, live_event.id, 100)
+        orphan_single = await create_payment(server, user, deleted_event.id, 200)
+        orphan_bulk = await create_payment(server, user, deleted_event.id, 300)
+
+        await server.delete_event(deleted_event.id, current_user=user)
+        before = await revenue(server, user)
+
+        await server.pay_payment(orphan_single.id, current_user=user)
+        after_single = await revenue(server, user)
+
+        result = await server.pay_payments(server.BulkPayRequest(payment_ids=[orphan_bulk.id, live.id]), current_user=user)
+        after_bulk = await revenue(server, user)
+
+        rebuilt = await server.rebuild_user_stats(user.id)
+        return before, after_single, after_bulk, result, rebuilt, live.id, orphan_bulk.id
+
+    before, after_single, after_bulk, result, rebuilt, live_id, orphan_id = asyncio.run(scenario())
+
+    assert after_single == before
+    assert after_bulk == before + 100
+    assert sorted(result["paid"]) == sorted([live_id, orphan_id])
+    assert rebuilt["total_revenue"] == after_bulk
+
+
+def test_installments_reject_down_payment_above_total(server, make_user):
+    user = make_user()
+
+    async def scenario():
+        event = await create_event(server, user, total_value=1000)
+        schedule = server.InstallmentSchedule(count=3, first_due_date="2030-01-10", down_payment=1500)
+        try:
+            await server.create_installments(event.id, schedule, current_user=user)
+        except HTTPException as e:
+            return e.status_code, await server.db.payments.count_documents({"event_id": event.id})
+
+    status_code, stored = asyncio.run(scenario())
+
+    assert status_code == 400
+    assert stored == 0
+
+
+def test_installment_schedule_rejects_negative_amounts(server):
+    with pytest.raises(ValidationError):
+        server.InstallmentSchedule(count=3, first_due_date="2030-01-10", down_payment=-10)
+    with pytest.raises(ValidationError):
+        server.InstallmentSchedule(count=3, first_due_date="2030-01-10", amount=-50)
+    with pytest.raises(ValidationError):
+        server.InstallmentSchedule(count=0, first_due_date="2030-01-10")
@@ -0,0 +1,54 @@
+import asyncio
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "backend"))
+
+import subscription_service  # noqa: E402
+from subscription_service import SubscriptionService  # noqa: E402
+
+
+@pytest.fixture
+def repository():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    return SubscriptionService.configure(mongomock_motor.AsyncMongoMockClient()["fotiva_test"])
+
+
+def trial(user_id):
+    now = datetime.now()
+    return {"user_id": user_id, "status": "trial", "trial_start": now, "trial_end": now + timedelta(days=30)}
+
+
+def test_inactive_verdict_expires_quickly_so_other_workers_see_new_trials(repository, monkeypatch):
+    monkeypatch.setattr(subscription_service, "SUBSCRIPTION_INACTIVE_CACHE_TTL_SECONDS", 0.05)
+
+    async def scenario():
+        before = await SubscriptionService.is_subscription_active("user-1")
+        # Outro worker cria o trial: o cache deste processo não é invalidado
+        await repository.insert_subscription_if_missing(trial("user-1"))
+        still_cached = await SubscriptionService.is_subscription_active("user-1")
+        await asyncio.sleep(0.1)
+        return before, still_cached, await SubscriptionService.is_subscription_active("user-1")
+
+    assert asyncio.run(scenario()) == (False, False, True)
+
+
+def test_active_verdict_keeps_the_long_ttl(repository):
+    async def scenario():
+        await repository.insert_subscription_if_missing(trial("user-2"))
+        return await SubscriptionService.is_subscription_active("user-2")
+
+    assert asyncio.run(scenario()) is True
+    expires_at, _ = SubscriptionService._active_cache["user-2"]
+    assert expires_at - time.monotonic() > subscription_service.SUBSCRIPTION_INACTIVE_CACHE_TTL_SECONDS
+
+
+def test_inactive_verdict_is_not_cached_with_zero_ttl(repository, monkeypatch):
+    monkeypatch.setattr(subscription_service, "SUBSCRIPTION_INACTIVE_CACHE_TTL_SECONDS", 0)
+
+    assert asyncio.run(SubscriptionService.is_subscription_active("user-3")) is False
+    assert "user-3" not in SubscriptionService._active_cache
@@ -0,0 +1,67 @@
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "backend"))
+
+from whatsapp_service import QUEUED, SENT, FakeWhatsAppProvider, WhatsAppSender  # noqa: E402
+
+RETRY_BASE_SECONDS = 0.05
+
+
+async def send_and_wait(provider, max_retries, timeout=5.0):
+    sender = WhatsAppSender(provider, workers=1, max_retries=max_retries, retry_base_seconds=RETRY_BASE_SECONDS)
+    results = []
+    done = asyncio.Event()
+
+    async def on_result(delivered, error):
+        results.append((delivered, error))
+        done.set()
+
+    try:
+        outcome = await sender.send("(11) 98765-4321", "Lembrete", on_result)
+        if outcome == QUEUED:
+            await asyncio.wait_for(done.wait(), timeout)
+        return outcome, results
+    finally:
+        await sender.close()
+
+
+def test_send_delivers_immediately_without_failures():
+    provider = FakeWhatsAppProvider()
+
+    outcome, results = asyncio.run(send_and_wait(provider, max_retries=3))
+
+    assert outcome == SENT
+    assert results == []
+    assert provider.sent == [{"to": "+5511987654321", "body": "Lembrete"}]
+
+
+def test_transient_failures_are_retried_with_exponential_backoff():
+    provider = FakeWhatsAppProvider(transient_failures=3)
+
+    outcome, results = asyncio.run(send_and_wait(provider, max_retries=5))
+
+    assert outcome == QUEUED
+    assert results == [(True, None)]
+    assert len(provider.sent) == 1
+    assert len(provider.attempts) == 4
+
+    gaps = [later - earlier for earlier, later in zip(provider.attempts, provider.attempts[1:])]
+    for retry, gap in enumerate(gaps):
+        assert gap >= RETRY_BASE_SECONDS * (2 ** retry) * 0.9
+
+
+def test_message_is_dropped_after_max_retries():
+    provider = FakeWhatsAppProvider(transient_failures=10)
+
+    outcome, results = asyncio.run(send_and_wait(provider, max_retries=2))
+
+    assert outcome == QUEUED
+    assert len(results) == 1
+    delivered, error = results[0]
+    assert delivered is False
+    assert error
+    assert provider.sent == []
+    # Envio inicial + 2 reenvios
+    assert len(provider.attempts) == 3